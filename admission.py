@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import math
+import time
+import logging
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Assumed seconds a request holds its slot until some have been measured
+DEFAULT_HOLD_SECONDS = 5.0
+
+# Weight of the latest hold time in the running average
+HOLD_SMOOTHING = 0.2
+
+# Seconds between two calls of the check of a background request while it waits
+CHECK_INTERVAL = 1.0
+
+# Bounds of the Retry-After estimate, in seconds
+MIN_RETRY_AFTER = 1
+MAX_RETRY_AFTER = 300
+
+class AdmissionRejected(Exception):
+    """Raised when a request is turned away instead of being admitted"""
+
+    def __init__(self, message, reason, status_code, retry_after):
+        super().__init__(message)
+        self.reason = reason
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+class AdmissionTicket:
+    """A request's claim on an endpoint slot and on slots of the share roots it reads"""
+
+    def __init__(self, controller, endpoint, roots, background=False):
+        self.controller = controller
+        self.endpoint = endpoint
+        self.roots = roots
+        self.background = background
+        self.granted = False
+        self.released = False
+        self.enqueued_at = time.monotonic()
+        self.admitted_at = None
+        self.wait_seconds = 0.0
+        self._event = threading.Event()
+
+    def release(self):
+        """Give the slots back; calling it again does nothing"""
+        self.controller._release(self)
+
+class AdmissionController:
+    """
+    Limits how many heavy requests run at once, in total, per endpoint and
+    per share root, and queues the ones that don't fit yet.
+
+    Waiting requests are admitted in arrival order as slots free up. A
+    waiting request holds back newer requests that need one of the same
+    slots, so it can't be starved, while requests for other endpoints and
+    roots pass it. When the queue is full, or a request has waited for
+    the queue timeout, it is rejected with an estimate of when to retry.
+
+    Only heavy endpoints go through the controller. Waiting requests
+    occupy server threads, so the total of max_active and queue_size
+    should stay below the thread count, leaving threads for light
+    endpoints such as listings and health checks. Background work that
+    bounds its own concurrency, such as archive jobs, waits without a
+    place in the queue and without a timeout.
+    """
+
+    def __init__(self, endpoint_limits=None, root_limit=0, max_active=0, queue_size=8, queue_timeout=30.0):
+        """
+        Args:
+            endpoint_limits (dict): Requests of an endpoint running at once,
+                keyed by endpoint name; 0 or missing means no limit
+            root_limit (int): Requests reading one share root at once (0 = no limit)
+            max_active (int): Heavy requests running at once (0 = no limit)
+            queue_size (int): Requests waiting at once; more are rejected
+            queue_timeout (float): Seconds a request waits before it is rejected
+        """
+        if queue_size < 0 or queue_timeout < 0:
+            raise ValueError("queue_size and queue_timeout cannot be negative")
+
+        self.endpoint_limits = dict(endpoint_limits or {})
+        self.root_limit = root_limit
+        self.max_active = max_active
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self._lock = threading.Lock()
+        self._queue = deque()
+        self._active = 0
+        self._endpoint_active = {}
+        self._root_active = {}
+        self._counters = {}
+
+    def _endpoint_counters(self, endpoint):
+        counters = self._counters.get(endpoint)
+        if counters is None:
+            counters = self._counters[endpoint] = {
+                'admitted': 0,
+                'completed': 0,
+                'queued': 0,
+                'rejected_queue_full': 0,
+                'rejected_timeout': 0,
+                'wait_seconds_total': 0.0,
+                'max_wait_seconds': 0.0,
+                'hold_seconds': DEFAULT_HOLD_SECONDS
+            }
+        return counters
+
+    def acquire(self, endpoint, roots=(), background=False, check=None):
+        """
+        Wait until the request may run
+
+        Args:
+            endpoint (str): Endpoint name the limits are keyed by
+            roots (iterable): Share roots the request reads
+            background (bool): Wait as long as it takes, outside the
+                bounded queue, instead of being rejected
+            check (callable): Called about once a second while a background
+                request waits; an exception it raises withdraws the request
+                and is passed on
+
+        Returns:
+            AdmissionTicket: Granted ticket, to be released when done
+
+        Raises:
+            AdmissionRejected: The queue is full or the wait timed out
+        """
+        ticket = AdmissionTicket(self, endpoint, tuple(sorted(set(roots))), background)
+        with self._lock:
+            counters = self._endpoint_counters(endpoint)
+            self._queue.append(ticket)
+            self._grant()
+            if not ticket.granted:
+                if not background and sum(not waiting.background for waiting in self._queue) > self.queue_size:
+                    self._queue.remove(ticket)
+                    counters['rejected_queue_full'] += 1
+                    raise AdmissionRejected(
+                        f"Too many {endpoint} requests; {len(self._queue)} already waiting",
+                        'queue_full', 429, self._retry_after(endpoint)
+                    )
+                counters['queued'] += 1
+                logger.info(f"Queued {endpoint} request for {', '.join(ticket.roots) or 'no root'}")
+
+        if background:
+            while not ticket._event.wait(CHECK_INTERVAL):
+                if check is not None:
+                    try:
+                        check()
+                    except BaseException:
+                        self._withdraw(ticket)
+                        raise
+        elif not ticket.granted:
+            ticket._event.wait(self.queue_timeout)
+
+        with self._lock:
+            if not ticket.granted:
+                self._queue.remove(ticket)
+                # Newer requests held back by this one may fit now
+                self._grant()
+                counters['rejected_timeout'] += 1
+                raise AdmissionRejected(
+                    f"Timed out after {self.queue_timeout:g}s waiting to run a {endpoint} request",
+                    'timeout', 503, self._retry_after(endpoint)
+                )
+            ticket.wait_seconds = ticket.admitted_at - ticket.enqueued_at
+            counters['admitted'] += 1
+            counters['wait_seconds_total'] += ticket.wait_seconds
+            counters['max_wait_seconds'] = max(counters['max_wait_seconds'], ticket.wait_seconds)
+        return ticket
+
+    def _withdraw(self, ticket):
+        """Take a ticket out of the queue, or give its slots back if granted meanwhile"""
+        with self._lock:
+            if not ticket.granted:
+                self._queue.remove(ticket)
+                self._grant()
+                return
+        self._release(ticket)
+
+    def _grant(self):
+        """Admit waiting tickets in arrival order as far as the limits allow"""
+        now = time.monotonic()
+        held_endpoints, held_roots = set(), set()
+        for ticket in list(self._queue):
+            if (ticket.endpoint not in held_endpoints and held_roots.isdisjoint(ticket.roots)
+                    and self._fits(ticket)):
+                self._queue.remove(ticket)
+                self._active += 1
+                self._endpoint_active[ticket.endpoint] = self._endpoint_active.get(ticket.endpoint, 0) + 1
+                for root in ticket.roots:
+                    self._root_active[root] = self._root_active.get(root, 0) + 1
+                ticket.granted = True
+                ticket.admitted_at = now
+                ticket._event.set()
+            else:
+                # Keep what this ticket waits for from newer tickets
+                held_endpoints.add(ticket.endpoint)
+                held_roots.update(ticket.roots)
+
+    def _fits(self, ticket):
+        if self.max_active and self._active >= self.max_active:
+            return False
+        limit = self.endpoint_limits.get(ticket.endpoint)
+        if limit and self._endpoint_active.get(ticket.endpoint, 0) >= limit:
+            return False
+        return not self.root_limit or all(
+            self._root_active.get(root, 0) < self.root_limit for root in ticket.roots
+        )
+
+    def _release(self, ticket):
+        with self._lock:
+            if ticket.released or not ticket.granted:
+                return
+            ticket.released = True
+            self._active -= 1
+            self._endpoint_active[ticket.endpoint] -= 1
+            for root in ticket.roots:
+                self._root_active[root] -= 1
+                if not self._root_active[root]:
+                    del self._root_active[root]
+
+            counters = self._endpoint_counters(ticket.endpoint)
+            held = time.monotonic() - ticket.admitted_at
+            if counters['completed']:
+                counters['hold_seconds'] += HOLD_SMOOTHING * (held - counters['hold_seconds'])
+            else:
+                counters['hold_seconds'] = held
+            counters['completed'] += 1
+            self._grant()
+
+    def _retry_after(self, endpoint):
+        """Seconds until the requests ahead are likely done, from recent hold times"""
+        limit = self.endpoint_limits.get(endpoint) or self.max_active or 1
+        waiting = sum(1 for ticket in self._queue if ticket.endpoint == endpoint)
+        estimate = self._endpoint_counters(endpoint)['hold_seconds'] * (waiting + 1) / limit
+        return min(MAX_RETRY_AFTER, max(MIN_RETRY_AFTER, math.ceil(estimate)))
+
+    def stats(self):
+        """Limits, running and waiting requests, rejections and wait times"""
+        now = time.monotonic()
+        with self._lock:
+            endpoints = {}
+            for endpoint in sorted(set(self.endpoint_limits) | set(self._counters)):
+                counters = dict(self._endpoint_counters(endpoint))
+                waiting = [ticket for ticket in self._queue if ticket.endpoint == endpoint]
+                admitted = counters['admitted']
+                endpoints[endpoint] = {
+                    'limit': self.endpoint_limits.get(endpoint) or None,
+                    'active': self._endpoint_active.get(endpoint, 0),
+                    'waiting': len(waiting),
+                    'oldest_wait_seconds': round(max((now - ticket.enqueued_at for ticket in waiting), default=0.0), 3),
+                    'admitted': admitted,
+                    'queued': counters['queued'],
+                    'rejected_queue_full': counters['rejected_queue_full'],
+                    'rejected_timeout': counters['rejected_timeout'],
+                    'average_wait_seconds': round(counters['wait_seconds_total'] / admitted, 3) if admitted else 0.0,
+                    'max_wait_seconds': round(counters['max_wait_seconds'], 3),
+                    'average_hold_seconds': round(counters['hold_seconds'], 3) if counters['completed'] else None
+                }
+            return {
+                'active': self._active,
+                'waiting': len(self._queue),
+                'max_active': self.max_active or None,
+                'queue_size': self.queue_size,
+                'queue_timeout_seconds': self.queue_timeout,
+                'root_limit': self.root_limit or None,
+                'roots': dict(self._root_active),
+                'endpoints': endpoints
+            }
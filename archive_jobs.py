@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Minimum seconds between two progress writes of a running job's state file
+STATE_WRITE_INTERVAL = 1.0
+
+class JobCancelled(Exception):
+    """Raised inside a job when it has been cancelled"""
+
+class JobQueueFull(Exception):
+    """Raised when a job is submitted while the queue is full"""
+
+class ArchiveJob:
+    """State and progress of one background archive build"""
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    COMPLETED = 'completed'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
+    FINISHED_STATES = (COMPLETED, FAILED, CANCELLED)
+
+    def __init__(self, nas_path, policy):
+        self.job_id = uuid.uuid4().hex
+        self.nas_path = nas_path
+        self.policy = policy
+        self.status = self.QUEUED
+        self.stage = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.archive_started = None
+        self.files_scanned = 0
+        self.files_total = None
+        self.files_archived = 0
+        self.files_skipped = 0
+        self.bytes_total = 0
+        self.bytes_archived = 0
+        self.archive_id = None
+        self.archive_path = None
+        self.error = None
+        self.cancel_event = threading.Event()
+        self.state_written = 0.0
+        self.cancel_checked = 0.0
+
+    @property
+    def finished_state(self):
+        return self.status in self.FINISHED_STATES
+
+    def eta_seconds(self):
+        """Estimate the remaining archive time from the throughput so far"""
+        if self.stage != 'archive' or not self.bytes_archived or self.finished_state:
+            return None
+        elapsed = time.time() - self.archive_started
+        remaining = max(self.bytes_total - self.bytes_archived, 0)
+        return round(remaining * elapsed / self.bytes_archived, 1)
+
+    def to_dict(self):
+        percent = None
+        if self.status == self.COMPLETED:
+            percent = 100.0
+        elif self.bytes_total and self.stage == 'archive':
+            percent = round(100.0 * self.bytes_archived / self.bytes_total, 1)
+
+        return {
+            'job_id': self.job_id,
+            'nas_path': self.nas_path,
+            'compression': self.policy.mode,
+            'status': self.status,
+            'stage': self.stage,
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished,
+            'progress': {
+                'files_scanned': self.files_scanned,
+                'files_total': self.files_total,
+                'files_archived': self.files_archived,
+                'files_skipped': self.files_skipped,
+                'bytes_total': self.bytes_total,
+                'bytes_archived': self.bytes_archived,
+                'percent': percent,
+                'eta_seconds': self.eta_seconds()
+            },
+            'archive_id': self.archive_id,
+            'error': self.error
+        }
+
+class ArchiveJobManager:
+    """
+    Runs archive builds on a bounded pool of background threads.
+
+    At most max_workers jobs run at once and at most queue_size wait for a
+    worker; submitting beyond that raises JobQueueFull. Job state is also
+    written to state_dir, so status and cancel requests work from any
+    server process sharing that directory, not only the one running the job.
+    A job that has to build its archive first waits for admission, so jobs
+    share the limits of the archive endpoints.
+    """
+
+    def __init__(self, downloader, max_workers=4, queue_size=32, state_dir=None, retention=3600, admit=None):
+        """
+        Args:
+            downloader (NASExcelDownloader): Scans and builds the archives
+            max_workers (int): Jobs run at once
+            queue_size (int): Jobs that may wait for a worker
+            state_dir (str): Directory of job state files shared by processes
+            retention (float): Seconds finished jobs are remembered
+            admit (callable): Called with the NAS path and a cancellation
+                check before an archive is built; waits for a slot and
+                returns a ticket to release once the archive is done
+        """
+        self.downloader = downloader
+        self.admit = admit
+        self.max_workers = max_workers
+        self.queue_size = queue_size
+        self.state_dir = state_dir
+        self.retention = retention
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="archive-job")
+
+    def _state_path(self, job_id, suffix='.json'):
+        return os.path.join(self.state_dir, f"{job_id}{suffix}")
+
+    def _write_state(self, job, force=False):
+        """Write the job state file, at most once per STATE_WRITE_INTERVAL unless forced"""
+        if not self.state_dir:
+            return
+        now = time.monotonic()
+        if not force and now - job.state_written < STATE_WRITE_INTERVAL:
+            return
+        job.state_written = now
+
+        try:
+            os.makedirs(self.state_dir, exist_ok=True)
+            temp_path = self._state_path(job.job_id, f".{uuid.uuid4().hex}.tmp")
+            state = job.to_dict()
+            state['archive_path'] = job.archive_path
+            with open(temp_path, 'w') as f:
+                json.dump(state, f)
+            os.replace(temp_path, self._state_path(job.job_id))
+        except OSError as e:
+            logger.warning(f"Failed to write state of job {job.job_id}: {str(e)}")
+
+    def _read_state(self, job_id):
+        if not self.state_dir:
+            return None
+        try:
+            with open(self._state_path(job_id)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _prune(self):
+        """Forget finished jobs older than the retention window"""
+        expired_before = time.time() - self.retention
+        with self._lock:
+            expired = [
+                job_id for job_id, job in self._jobs.items()
+                if job.finished_state and job.finished < expired_before
+            ]
+            for job_id in expired:
+                del self._jobs[job_id]
+
+        for job_id in expired:
+            for suffix in ('.json', '.cancel'):
+                try:
+                    os.remove(self._state_path(job_id, suffix))
+                except OSError:
+                    pass
+
+    def queued_count(self):
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job.status == ArchiveJob.QUEUED)
+
+    def running_count(self):
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job.status == ArchiveJob.RUNNING)
+
+    def submit(self, nas_path, policy):
+        """
+        Queue an archive build
+
+        Args:
+            nas_path (str): NAS path to archive
+            policy (CompressionPolicy): How entries are compressed
+
+        Returns:
+            ArchiveJob: The queued job
+        """
+        self._prune()
+        job = ArchiveJob(nas_path, policy)
+        with self._lock:
+            queued = sum(1 for queued_job in self._jobs.values() if queued_job.status == ArchiveJob.QUEUED)
+            if queued >= self.queue_size:
+                raise JobQueueFull(f"Job queue is full ({queued} jobs waiting)")
+            self._jobs[job.job_id] = job
+
+        self._write_state(job, force=True)
+        self._pool.submit(self._run, job)
+        logger.info(f"Queued archive job {job.job_id} for {nas_path}")
+        return job
+
+    def get(self, job_id):
+        """
+        Look up a job
+
+        Returns:
+            dict: Job state, or None if unknown
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            state = job.to_dict()
+            state['archive_path'] = job.archive_path
+            return state
+        return self._read_state(job_id)
+
+    def list(self):
+        """Return the state of all jobs known to this process"""
+        self._prune()
+        with self._lock:
+            jobs = sorted(self._jobs.values(), key=lambda job: job.created)
+        return [job.to_dict() for job in jobs]
+
+    def cancel(self, job_id):
+        """
+        Cancel a queued or running job
+
+        Returns:
+            dict: Job state after the request, or None if unknown
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+
+        if job is None:
+            state = self._read_state(job_id)
+            if state and state['status'] not in ArchiveJob.FINISHED_STATES:
+                # Running in another process, which checks for this marker
+                open(self._state_path(job_id, '.cancel'), 'w').close()
+                state['status_requested'] = ArchiveJob.CANCELLED
+            return state
+
+        if not job.finished_state:
+            job.cancel_event.set()
+            logger.info(f"Cancellation requested for job {job_id}")
+        return job.to_dict()
+
+    def _check_cancelled(self, job):
+        if job.cancel_event.is_set():
+            raise JobCancelled()
+        if self.state_dir and time.monotonic() - job.cancel_checked >= STATE_WRITE_INTERVAL:
+            job.cancel_checked = time.monotonic()
+            if os.path.exists(self._state_path(job.job_id, '.cancel')):
+                job.cancel_event.set()
+                raise JobCancelled()
+
+    def _run(self, job):
+        downloader = self.downloader
+        try:
+            self._check_cancelled(job)
+            job.status = ArchiveJob.RUNNING
+            job.started = time.time()
+            job.stage = 'scan'
+            self._write_state(job, force=True)
+
+            # The fingerprint keys the archive cache, so skip cached scans
+            xlsx_files = []
+            for entry in downloader.iter_xlsx_files(job.nas_path, fresh=True):
+                xlsx_files.append(entry)
+                job.files_scanned += 1
+                job.bytes_total += entry.size
+                self._check_cancelled(job)
+                self._write_state(job)
+
+            if not xlsx_files:
+                raise FileNotFoundError(f"No Excel files found in {job.nas_path}")
+
+            xlsx_files.sort(key=lambda entry: entry.relative_path)
+            job.files_total = len(xlsx_files)
+            job.stage = 'archive'
+            job.archive_started = time.time()
+            self._write_state(job, force=True)
+
+            fingerprint = downloader.fingerprint_files(xlsx_files, job.policy)
+            cached_path = downloader.archive_cache.get(fingerprint)
+            if cached_path:
+                logger.info(f"Job {job.job_id} reuses cached archive {fingerprint}")
+                job.archive_id, job.archive_path = fingerprint, cached_path
+                job.files_archived = job.files_total
+                job.bytes_archived = job.bytes_total
+            else:
+                def progress(bytes_read=0, files_done=0):
+                    job.bytes_archived += bytes_read
+                    job.files_archived += files_done
+                    self._check_cancelled(job)
+                    self._write_state(job)
+
+                ticket = None
+                if self.admit is not None:
+                    job.stage = 'wait'
+                    self._write_state(job, force=True)
+                    ticket = self.admit(job.nas_path, lambda: self._check_cancelled(job))
+                    job.stage = 'archive'
+                    job.archive_started = time.time()
+                    self._write_state(job, force=True)
+                try:
+                    job.archive_id, job.archive_path, skipped = downloader.build_archive(
+                        [entry.path for entry in xlsx_files], job.nas_path, fingerprint, job.policy, progress
+                    )
+                finally:
+                    if ticket is not None:
+                        ticket.release()
+                job.files_skipped = len(skipped)
+
+            job.status = ArchiveJob.COMPLETED
+            logger.info(f"Job {job.job_id} completed: {job.files_archived} files, archive {job.archive_id}")
+
+        except JobCancelled:
+            job.status = ArchiveJob.CANCELLED
+            logger.info(f"Job {job.job_id} cancelled")
+
+        except Exception as e:
+            job.status = ArchiveJob.FAILED
+            job.error = f"{type(e).__name__}: {str(e)}"
+            logger.error(f"Job {job.job_id} failed: {job.error}")
+
+        finally:
+            job.finished = time.time()
+            self._write_state(job, force=True)
+
+    def shutdown(self):
+        """Cancel all jobs and stop the worker threads"""
+        with self._lock:
+            jobs = list(self._jobs.values())
+        for job in jobs:
+            job.cancel_event.set()
+        self._pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+from datetime import datetime
+
+# Default allowed slowdown of a benchmark's median against the baseline
+DEFAULT_TOLERANCE = 0.25
+
+# Synthetic share layouts. Every directory down to `depth` has `fanout`
+# subdirectories and `files` files, of which `other_ratio` don't match
+# *.xlsx. Sizes are in bytes at scale 1.0.
+LAYOUTS = {
+    'deep': {'depth': 8, 'fanout': 2, 'files': 4, 'size': 16 * 1024, 'other_ratio': 0.25},
+    'wide': {'depth': 1, 'fanout': 200, 'files': 5, 'size': 16 * 1024, 'other_ratio': 0.25},
+    'tiny': {'depth': 2, 'fanout': 10, 'files': 40, 'size': 2 * 1024, 'other_ratio': 0.0},
+    'huge': {'depth': 0, 'fanout': 0, 'files': 4, 'size': 64 * 1024 ** 2, 'other_ratio': 0.0},
+    'mixed': {'depth': 3, 'fanout': 4, 'files': 10, 'size': 32 * 1024, 'other_ratio': 0.5},
+}
+
+# Extensions of the files that must not be picked up by a scan
+OTHER_EXTENSIONS = ('.csv', '.xls', '.pdf', '.txt', '.xlsx.bak', '.docx')
+
+def percentile(values, percent):
+    """
+    Nearest-rank percentile
+
+    Args:
+        values (list): Observations, in any order
+        percent (float): Percentile between 0 and 100
+
+    Returns:
+        float: The percentile, or None without observations
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * percent // 100))
+    return ordered[int(rank) - 1]
+
+def generate_tree(root, layout, scale=1.0, seed=0):
+    """
+    Generate a synthetic share under root, unless an identical one exists.
+    Workbook contents are random bytes, which like real .xlsx files
+    (zip containers) don't compress.
+
+    Args:
+        root (str): Directory to create the tree in
+        layout (dict): Entry of LAYOUTS
+        scale (float): Multiplier of the file sizes
+        seed (int): Seed of the file contents and names
+
+    Returns:
+        dict: Number of xlsx files, their total size and number of other files
+    """
+    marker_path = os.path.join(root, '.benchmark_tree.json')
+    spec = {'layout': layout, 'scale': scale, 'seed': seed}
+    try:
+        with open(marker_path) as f:
+            marker = json.load(f)
+        if marker['spec'] == spec:
+            return marker['summary']
+    except (OSError, ValueError, KeyError):
+        pass
+
+    shutil.rmtree(root, ignore_errors=True)
+    os.makedirs(root)
+    rng = random.Random(seed)
+    size = max(1, int(layout['size'] * scale))
+    summary = {'xlsx_files': 0, 'xlsx_bytes': 0, 'other_files': 0}
+
+    def fill(directory, depth):
+        for index in range(layout['files']):
+            if rng.random() < layout['other_ratio']:
+                name = f"data_{index:04d}{rng.choice(OTHER_EXTENSIONS)}"
+                summary['other_files'] += 1
+            else:
+                name = f"report_{index:04d}.xlsx"
+                summary['xlsx_files'] += 1
+                summary['xlsx_bytes'] += size
+            with open(os.path.join(directory, name), 'wb') as f:
+                remaining = size
+                while remaining > 0:
+                    chunk = min(remaining, 1024 * 1024)
+                    f.write(rng.randbytes(chunk))
+                    remaining -= chunk
+
+        if depth < layout['depth']:
+            for index in range(layout['fanout']):
+                subdir = os.path.join(directory, f"folder_{depth + 1}_{index:03d}")
+                os.mkdir(subdir)
+                fill(subdir, depth + 1)
+
+    fill(root, 0)
+    with open(marker_path, 'w') as f:
+        json.dump({'spec': spec, 'summary': summary}, f)
+    return summary
+
+def measure(function, repeat, setup=None, teardown=None):
+    """
+    Run a benchmark once to warm up, then repeat times
+
+    Args:
+        function (callable): Code under test
+        repeat (int): Number of measured runs
+        setup (callable): Run before every call, not measured
+        teardown (callable): Run after every call with its result, not measured
+
+    Returns:
+        list: Durations of the measured runs in seconds
+    """
+    durations = []
+    for run in range(repeat + 1):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - started
+        if teardown:
+            teardown(result)
+        if run:
+            durations.append(elapsed)
+    return durations
+
+def summarize(durations, files, bytes_processed):
+    """Throughput at the median and latency percentiles of a benchmark"""
+    median = percentile(durations, 50)
+    return {
+        'runs': len(durations),
+        'files': files,
+        'bytes': bytes_processed,
+        'p50_seconds': round(median, 6),
+        'p95_seconds': round(percentile(durations, 95), 6),
+        'p99_seconds': round(percentile(durations, 99), 6),
+        'files_per_second': round(files / median, 1) if median else None,
+        'mb_per_second': round(bytes_processed / 1024 ** 2 / median, 2) if median else None
+    }
+
+def run_layout(module, client, root, summary, repeat):
+    """
+    Benchmark the downloader stages and the endpoints on one tree
+
+    Args:
+        module: The nas_excel_downloader module
+        client: Flask test client of the app
+        root (str): Root of the synthetic share
+        summary (dict): Returned by generate_tree
+        repeat (int): Number of measured runs per benchmark
+
+    Returns:
+        dict: Results keyed by benchmark name
+    """
+    downloader = module.downloader
+    files, size = summary['xlsx_files'], summary['xlsx_bytes']
+    results = {}
+
+    # Every run starts cold, as the first request for a folder would
+    clear_cache = downloader.scan_cache.clear
+
+    results['find_xlsx_files'] = summarize(
+        measure(lambda: downloader.find_xlsx_files(root), repeat, setup=clear_cache),
+        files, 0
+    )
+
+    xlsx_files = downloader.find_xlsx_files(root)
+    workspaces = []
+
+    def copy():
+        workspace = downloader.create_workspace()
+        workspaces.append(workspace)
+        return downloader.copy_xlsx_files(xlsx_files, root, workspace)
+
+    def release(_):
+        while workspaces:
+            downloader.release_workspace(workspaces.pop())
+
+    results['copy_xlsx_files'] = summarize(measure(copy, repeat, teardown=release), files, size)
+
+    staging_dir = copy()
+    try:
+        zip_path = os.path.join(workspaces[0].root, 'benchmark.zip')
+        results['create_zip_archive'] = summarize(
+            measure(lambda: downloader.create_zip_archive(staging_dir, zip_path), repeat),
+            files, size
+        )
+    finally:
+        release(None)
+
+    def post(endpoint, payload):
+        def call():
+            response = client.post(endpoint, json=payload)
+            body = response.get_data()
+            response.close()
+            if response.status_code != 200:
+                raise RuntimeError(f"{endpoint} returned HTTP {response.status_code}: {body[:200]!r}")
+            return body
+        return call
+
+    results['POST /list-xlsx'] = summarize(
+        measure(post('/list-xlsx', {'nas_path': root}), repeat, setup=clear_cache), files, 0
+    )
+    results['POST /download-xlsx'] = summarize(
+        measure(post('/download-xlsx', {'nas_path': root}), repeat, setup=clear_cache), files, size
+    )
+    results['POST /download-xlsx stream'] = summarize(
+        measure(post('/download-xlsx', {'nas_path': root, 'stream': True}), repeat, setup=clear_cache),
+        files, size
+    )
+    return results
+
+def compare_with_baseline(results, baseline, tolerance):
+    """
+    Find benchmarks whose median got slower than the baseline allows
+
+    Returns:
+        list: Description of every regression
+    """
+    regressions = []
+    for layout, benchmarks in baseline.get('results', {}).items():
+        for name, expected in benchmarks.items():
+            current = results.get(layout, {}).get(name)
+            if current is None:
+                continue
+            limit = expected['p50_seconds'] * (1 + tolerance)
+            if current['p50_seconds'] > limit:
+                regressions.append(
+                    f"{layout} / {name}: p50 {current['p50_seconds']:.4f}s, "
+                    f"baseline {expected['p50_seconds']:.4f}s (limit {limit:.4f}s)"
+                )
+    return regressions
+
+def print_results(results):
+    print(f"{'benchmark':<40} {'p50 s':>9} {'p95 s':>9} {'p99 s':>9} {'files/s':>10} {'MB/s':>9}")
+    for layout, benchmarks in results.items():
+        for name, result in benchmarks.items():
+            mb_per_second = result['mb_per_second'] if result['bytes'] else '-'
+            print(
+                f"{layout + ' / ' + name:<40} {result['p50_seconds']:>9.4f} {result['p95_seconds']:>9.4f} "
+                f"{result['p99_seconds']:>9.4f} {result['files_per_second']:>10} {mb_per_second:>9}"
+            )
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the NAS Excel downloader on synthetic share layouts")
+    parser.add_argument("-l", "--layout", action="append", choices=sorted(LAYOUTS),
+                        help="Layout to benchmark, can be repeated (default: all)")
+    parser.add_argument("-w", "--workdir", default=os.path.join(tempfile.gettempdir(), "nas_xlsx_benchmark"),
+                        help="Where synthetic trees are generated and kept between runs")
+    parser.add_argument("-s", "--scale", type=float, default=1.0, help="Multiplier of the file sizes")
+    parser.add_argument("-r", "--repeat", type=int, default=5, help="Measured runs per benchmark (default: 5)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the generated trees")
+    parser.add_argument("-o", "--output", help="Write results as JSON to this file")
+    parser.add_argument("-b", "--baseline", help="JSON results of a previous run to compare against")
+    parser.add_argument("-t", "--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help=f"Allowed p50 slowdown against the baseline (default: {DEFAULT_TOLERANCE})")
+    args = parser.parse_args()
+
+    # Archives must be built every time rather than served from the cache
+    os.environ['NAS_ARCHIVE_CACHE_MAX_BYTES'] = '0'
+    import nas_excel_downloader
+    logging.getLogger().setLevel(logging.WARNING)
+    client = nas_excel_downloader.app.test_client()
+
+    results = {}
+    for layout_name in args.layout or sorted(LAYOUTS):
+        root = os.path.join(args.workdir, layout_name)
+        summary = generate_tree(root, LAYOUTS[layout_name], args.scale, args.seed)
+        print(
+            f"Benchmarking {layout_name}: {summary['xlsx_files']} xlsx files "
+            f"({summary['xlsx_bytes'] / 1024 ** 2:.1f} MB), {summary['other_files']} other files",
+            file=sys.stderr
+        )
+        results[layout_name] = run_layout(nas_excel_downloader, client, root, summary, args.repeat)
+
+    print_results(results)
+
+    if args.output:
+        report = {
+            'meta': {
+                'timestamp': datetime.now().isoformat(),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpu_count': os.cpu_count(),
+                'scale': args.scale,
+                'seed': args.seed,
+                'repeat': args.repeat
+            },
+            'results': results
+        }
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(results, baseline, args.tolerance)
+        if regressions:
+            print(f"PERFORMANCE REGRESSION: {len(regressions)} benchmarks slower than the baseline allows")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print("No regressions against the baseline")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import sqlite3
+import logging
+from contextlib import closing
+from xlsx_reader import XlsxWorkbook
+from workbook_index import plan_update
+
+logger = logging.getLogger(__name__)
+
+# Bump when the tables change; older index files are rebuilt from scratch
+SCHEMA_VERSION = 1
+
+# Workbooks stored per transaction while updating
+COMMIT_INTERVAL = 50
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS workbooks (
+    id INTEGER PRIMARY KEY,
+    root TEXT NOT NULL,
+    relative_path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    indexed_at REAL NOT NULL,
+    cell_count INTEGER NOT NULL,
+    error TEXT,
+    UNIQUE (root, relative_path)
+);
+CREATE TABLE IF NOT EXISTS cells (
+    id INTEGER PRIMARY KEY,
+    workbook_id INTEGER NOT NULL,
+    sheet TEXT NOT NULL,
+    cell TEXT NOT NULL,
+    text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS cells_by_workbook ON cells (workbook_id);
+CREATE VIRTUAL TABLE IF NOT EXISTS cell_text USING fts5(
+    text, content='cells', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS cells_deleted AFTER DELETE ON cells BEGIN
+    INSERT INTO cell_text (cell_text, rowid, text) VALUES ('delete', old.id, old.text);
+END;
+"""
+
+def extract_text_cells(path, relative_path):
+    """
+    Read the text cells of every sheet of a workbook; runs in a worker
+    process
+
+    Returns:
+        dict: relative_path, and either 'cells' as (sheet, cell reference,
+            text) tuples or the 'error' that stopped the parse
+    """
+    try:
+        cells = []
+        with XlsxWorkbook(path) as workbook:
+            for sheet in workbook.sheets:
+                cells.extend((sheet['name'], ref, text) for ref, text in workbook.iter_text_cells(sheet['name']))
+        return {'relative_path': relative_path, 'cells': cells}
+    except Exception as e:
+        return {'relative_path': relative_path, 'error': f"{type(e).__name__}: {e}"}
+
+def match_expression(query, prefix=False):
+    """
+    Turn user input into an FTS5 phrase: its words must appear next to
+    each other, so 'TRD-2024-0042' finds that id and nothing else
+
+    Args:
+        query (str): Text to search for
+        prefix (bool): Let the last word match as a prefix
+    """
+    return '"' + query.replace('"', '""') + '"' + ('*' if prefix else '')
+
+class CellSearchIndex:
+    """
+    Inverted index of the text cells (shared strings, inline strings and
+    formula text results) of workbooks, stored in an SQLite FTS5 table.
+
+    Updates are incremental like the metadata index: only workbooks whose
+    size or mtime changed are parsed, on the process pool of a
+    WorkbookConverter. Every operation opens its own connection, so the
+    index can be used from any thread and shared by server processes.
+    """
+
+    def __init__(self, db_path, converter):
+        """
+        Args:
+            db_path (str): Index file, created if missing
+            converter (WorkbookConverter): Pool the workbooks are parsed on
+        """
+        self.db_path = db_path
+        self.converter = converter
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        with closing(self._connect()) as connection, connection:
+            version = connection.execute("PRAGMA user_version").fetchone()[0]
+            if version != SCHEMA_VERSION:
+                logger.info(f"Creating cell search index {db_path} (schema {version} -> {SCHEMA_VERSION})")
+                connection.executescript(
+                    "DROP TABLE IF EXISTS cell_text; DROP TABLE IF EXISTS cells; DROP TABLE IF EXISTS workbooks;"
+                )
+                connection.executescript(_SCHEMA)
+                connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def _connect(self):
+        connection = sqlite3.connect(self.db_path, timeout=30)
+        connection.row_factory = sqlite3.Row
+        connection.execute("PRAGMA journal_mode = WAL")
+        # WAL stays consistent without a sync per commit; the index can be rebuilt
+        connection.execute("PRAGMA synchronous = NORMAL")
+        return connection
+
+    def update(self, root, entries):
+        """
+        Bring the index of a root in line with a scan of it
+
+        Args:
+            root (str): Normalized NAS path the entries were scanned from
+            entries (list): WalkEntry objects of the scan
+
+        Returns:
+            dict: Counts of indexed, unchanged, removed and failed workbooks,
+                cells added and the seconds taken
+        """
+        started = time.perf_counter()
+        with closing(self._connect()) as connection:
+            known = {
+                row['relative_path']: (row['size'], row['mtime'])
+                for row in connection.execute(
+                    "SELECT relative_path, size, mtime FROM workbooks WHERE root = ?", (root,)
+                )
+            }
+
+        found, changed, removed = plan_update(known, entries)
+        entries_by_path = dict(changed)
+
+        failed = 0
+        cells_added = 0
+        with closing(self._connect()) as connection:
+            pending = 0
+            results = self.converter.iter_map(extract_text_cells, [entry for _, entry in changed])
+            for result in results:
+                relative_path = result['relative_path']
+                error = result.get('error')
+                if error:
+                    logger.warning(f"Failed to index cells of {relative_path}: {error}")
+                    failed += 1
+                cells = result.get('cells', [])
+                cells_added += len(cells)
+                self._store(connection, root, relative_path, entries_by_path[relative_path], cells, error)
+                pending += 1
+                if pending >= COMMIT_INTERVAL:
+                    connection.commit()
+                    pending = 0
+            for relative_path in removed:
+                self._delete(connection, root, relative_path)
+            connection.commit()
+
+        stats = {
+            'indexed': len(changed) - failed,
+            'unchanged': found - len(changed),
+            'removed': len(removed),
+            'failed': failed,
+            'cells_added': cells_added,
+            'seconds': round(time.perf_counter() - started, 3)
+        }
+        logger.info(f"Updated cell search index of {root}: {stats}")
+        return stats
+
+    def _delete(self, connection, root, relative_path):
+        row = connection.execute(
+            "SELECT id FROM workbooks WHERE root = ? AND relative_path = ?", (root, relative_path)
+        ).fetchone()
+        if row is not None:
+            # Row by row deletes keep the FTS table in step through the trigger
+            connection.execute("DELETE FROM cells WHERE workbook_id = ?", (row['id'],))
+            connection.execute("DELETE FROM workbooks WHERE id = ?", (row['id'],))
+
+    def _store(self, connection, root, relative_path, entry, cells, error):
+        self._delete(connection, root, relative_path)
+        workbook_id = connection.execute(
+            "INSERT INTO workbooks (root, relative_path, size, mtime, indexed_at, cell_count, error) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (root, relative_path, entry.size, entry.mtime, time.time(), len(cells), error)
+        ).lastrowid
+        connection.executemany(
+            "INSERT INTO cells (workbook_id, sheet, cell, text) VALUES (?, ?, ?, ?)",
+            [(workbook_id, sheet, cell, text) for sheet, cell, text in cells]
+        )
+        # One FTS insert per workbook is several times faster than a
+        # trigger firing for every cell
+        connection.execute(
+            "INSERT INTO cell_text (rowid, text) SELECT id, text FROM cells WHERE workbook_id = ?", (workbook_id,)
+        )
+
+    def search(self, query, root=None, limit=100, prefix=False, exact=False):
+        """
+        Find cells containing the words of query, best matches first
+
+        Args:
+            query (str): Words to search for, matched as a phrase and
+                regardless of case and accents
+            root (str): Only workbooks indexed under this normalized path
+            limit (int): Most cells returned
+            prefix (bool): Let the last word match as a prefix
+            exact (bool): Only cells whose whole text equals query
+                (ignoring case)
+
+        Returns:
+            list: Matches with root, relative_path, sheet, cell and text
+        """
+        conditions = ["cell_text MATCH ?"]
+        parameters = [match_expression(query, prefix)]
+        if root is not None:
+            conditions.append("w.root = ?")
+            parameters.append(root)
+        if exact:
+            conditions.append("c.text = ? COLLATE NOCASE")
+            parameters.append(query)
+
+        with closing(self._connect()) as connection:
+            rows = connection.execute(
+                "SELECT w.root, w.relative_path, c.sheet, c.cell, c.text FROM cell_text "
+                "JOIN cells c ON c.id = cell_text.rowid JOIN workbooks w ON w.id = c.workbook_id "
+                f"WHERE {' AND '.join(conditions)} ORDER BY cell_text.rank LIMIT ?",
+                parameters + [limit]
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def stats(self):
+        """Number of indexed roots, workbooks and cells and the index file size"""
+        with closing(self._connect()) as connection:
+            counts = connection.execute(
+                "SELECT COUNT(DISTINCT root), COUNT(*), COUNT(error), COALESCE(SUM(cell_count), 0) FROM workbooks"
+            ).fetchone()
+        return {
+            'db_path': self.db_path,
+            'roots': counts[0],
+            'workbooks': counts[1],
+            'failed_workbooks': counts[2],
+            'cells': counts[3],
+            'size_bytes': os.path.getsize(self.db_path) if os.path.exists(self.db_path) else 0
+        }
@@ -3,10 +3,651 @@
 
 import os
 import sys
-import shutil
+import json
+import time
+import uuid
 import argparse
+import functools
+import threading
 import subprocess
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from tree_walker import ParallelTreeWalker
+from fast_copy import (
+    copy_file, file_sha256, read_checksum_manifest, write_checksum_manifest,
+    DEFAULT_BUFFER_SIZE, CHECKSUM_MANIFEST_NAME
+)
+
+# Seconds between two progress lines
+PROGRESS_INTERVAL = 2.0
+
+# Copies that may wait for a worker per worker, so enumeration stays
+# ahead of copying without holding the whole tree in memory
+PENDING_PER_JOB = 4
+
+# Name of the sync manifest kept in the target directory
+SYNC_MANIFEST_NAME = ".nas_sync_manifest.json"
+
+# Bump when the manifest layout changes so old manifests are ignored
+SYNC_MANIFEST_VERSION = 1
+
+# Allowed difference between source and target mtimes, in seconds, to
+# absorb timestamp rounding of SMB and FAT filesystems
+MTIME_TOLERANCE = 1.0
+
+# Name of the journal of the current copy run, kept in the target directory
+COPY_JOURNAL_NAME = ".nas_copy_journal.jsonl"
+
+# Files are written under this suffix and renamed once complete
+PARTIAL_SUFFIX = ".nas_partial"
+
+# Minimum seconds between two fsyncs of the journal; completed copies are
+# flushed to disk and journaled as done in batches at the same pace
+JOURNAL_SYNC_INTERVAL = 1.0
+
+# Failed files are retried this many times, waiting RETRY_DELAY seconds
+# before the first retry and twice as long before each following one
+DEFAULT_RETRIES = 3
+DEFAULT_RETRY_DELAY = 2.0
+
+def partial_path(target_file):
+    """Return the temporary name a file is written under until it is complete"""
+    return target_file.with_name(f".{target_file.name}{PARTIAL_SUFFIX}")
+
+def fsync_file(path):
+    """Flush a written file's data to disk"""
+    fd = os.open(path, os.O_RDWR | getattr(os, 'O_BINARY', 0))
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def sync_files(paths):
+    """
+    Flush copied files, and their renames, to disk. One sync() covers any
+    number of files where the platform has it; elsewhere (Windows) each
+    file is flushed, as NTFS journals renames itself.
+    """
+    if hasattr(os, 'sync'):
+        os.sync()
+        return
+    for path in paths:
+        try:
+            fsync_file(path)
+        except FileNotFoundError:
+            pass
+
+def copy_file_atomic(source, target_file, resume_from=0, buffer_size=DEFAULT_BUFFER_SIZE,
+                     checksum=False, verify=False, checkpoint=None):
+    """
+    Copy a file under a temporary name and rename it into place, so the
+    target never holds a half-written file. Nothing is flushed to disk
+    here; CopyJournal.done does that in batches before journaling copies
+    as complete.
+
+    Args:
+        source (Path): File to copy
+        target_file (Path): Destination
+        resume_from (int): Bytes of the temporary file already written by
+            an interrupted copy of the same source, appended to
+        buffer_size (int): Buffer of hashed copies
+        checksum (bool): Compute the SHA-256 of the source while copying
+        verify (bool): Read the written file back and compare its SHA-256
+            before renaming it into place (implies checksum)
+        checkpoint (callable): Called with the number of bytes of the
+            temporary file flushed to disk so far, see fast_copy.copy_file
+
+    Returns:
+        CopyResult: Outcome of the copy
+    """
+    temp_file = partial_path(target_file)
+    result = copy_file(source, temp_file, buffer_size, checksum or verify, resume_from, checkpoint)
+    if verify and file_sha256(temp_file, buffer_size) != result.sha256:
+        os.remove(temp_file)
+        raise OSError(f"Checksum mismatch after copying {source}")
+    os.replace(temp_file, target_file)
+    return result
+
+class CopyJournal:
+    """
+    Append-only record of a copy run in the target directory, one JSON
+    object per line: "start" when a file begins copying, "synced" each
+    time a prefix of its temporary file has been flushed to disk, "done"
+    once it has been renamed into place and flushed to disk, which is
+    done for all files completed within JOURNAL_SYNC_INTERVAL at once
+    rather than one fsync per file, and "failed" when it gave up. A
+    run that dies can be resumed from it: completed files are skipped and
+    partially written ones continued after their last synced prefix, as
+    long as their source still has the size and mtime recorded at the
+    start. A torn last line from a crash is ignored. The journal is
+    removed once a run completes.
+    """
+
+    def __init__(self, target_path):
+        self.path = Path(target_path) / COPY_JOURNAL_NAME
+        self.completed = {}
+        self.started = {}
+        self.synced = {}
+        self._file = None
+        self._synced = 0.0
+        self._pending = []
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+
+    def load(self):
+        """
+        Read the journal of a previous run
+
+        Returns:
+            int: Number of files recorded as completed
+        """
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    if record['event'] == 'done':
+                        self.completed[record['path']] = record
+                        self.started.pop(record['path'], None)
+                        self.synced.pop(record['path'], None)
+                    elif record['event'] == 'start':
+                        self.started[record['path']] = record
+                        # A resumed copy keeps the prefix synced before
+                        self.synced[record['path']] = record.get('offset', 0)
+                    elif record['event'] == 'synced':
+                        self.synced[record['path']] = record['offset']
+        except FileNotFoundError:
+            pass
+        return len(self.completed)
+
+    def open(self, resume=False):
+        """Start writing, appending to the previous journal when resuming"""
+        torn = False
+        if resume:
+            try:
+                with open(self.path, 'rb') as f:
+                    f.seek(0, os.SEEK_END)
+                    if f.tell():
+                        f.seek(-1, os.SEEK_END)
+                        torn = f.read(1) != b'\n'
+            except FileNotFoundError:
+                pass
+        self._file = open(self.path, 'a' if resume else 'w', encoding='utf-8')
+        if torn:
+            # End the torn last line, so the next record isn't glued onto it
+            self._file.write('\n')
+
+    def _write(self, record):
+        with self._lock:
+            self._file.write(json.dumps(record) + '\n')
+            self._file.flush()
+        self._sync()
+
+    def _sync(self, force=False):
+        """
+        Flush the journal, at most every JOURNAL_SYNC_INTERVAL seconds
+        unless forced. Pending "done" records are written only after
+        their files have been flushed, so the journal never lists a
+        completed copy that a power loss could still take away.
+        """
+        # Other threads go on copying while one of them syncs
+        if not self._sync_lock.acquire(blocking=force):
+            return
+        try:
+            now = time.monotonic()
+            if not force and now - self._synced < JOURNAL_SYNC_INTERVAL:
+                return
+            self._synced = now
+            with self._lock:
+                pending, self._pending = self._pending, []
+            if pending:
+                sync_files(target_file for _, target_file in pending)
+            with self._lock:
+                for record, _ in pending:
+                    self._file.write(json.dumps(record) + '\n')
+                self._file.flush()
+                os.fsync(self._file.fileno())
+        finally:
+            self._sync_lock.release()
+
+    @staticmethod
+    def _key(entry):
+        return entry.relative_path.replace(os.sep, '/')
+
+    def _matches(self, record, entry):
+        return record is not None and record['size'] == entry.size and record['mtime'] == entry.mtime
+
+    def is_completed(self, entry):
+        """Return True if the previous run copied this version of the file"""
+        return self._matches(self.completed.get(self._key(entry)), entry)
+
+    def resume_offset(self, entry, target_file):
+        """
+        Return how many bytes of an interrupted copy of this file can be
+        kept: the prefix journaled as flushed to disk. Bytes written after
+        it may not have reached the disk before a crash.
+        """
+        key = self._key(entry)
+        if not self._matches(self.started.get(key), entry):
+            return 0
+        offset = self.synced.get(key, 0)
+        try:
+            size = partial_path(target_file).stat().st_size
+        except OSError:
+            return 0
+        return offset if offset <= min(size, entry.size) else 0
+
+    def start(self, entry, offset=0):
+        self._write({
+            'event': 'start', 'path': self._key(entry), 'size': entry.size, 'mtime': entry.mtime, 'offset': offset
+        })
+
+    def checkpoint(self, entry, offset):
+        """Record that the first offset bytes of a file's temporary copy are on disk"""
+        self._write({'event': 'synced', 'path': self._key(entry), 'offset': offset})
+
+    def done(self, entry, target_file, sha256=None):
+        """Journal a copy as complete once target_file has been flushed to disk"""
+        record = {
+            'event': 'done', 'path': self._key(entry), 'size': entry.size, 'mtime': entry.mtime, 'sha256': sha256
+        }
+        with self._lock:
+            self._pending.append((record, target_file))
+        self._sync()
+
+    def completed_sha256(self, entry):
+        """Return the checksum recorded when the previous run copied a file, if any"""
+        return self.completed.get(self._key(entry), {}).get('sha256')
+
+    def failed(self, entry, error):
+        self._write({'event': 'failed', 'path': self._key(entry), 'error': f"{type(error).__name__}: {str(error)}"})
+
+    def close(self, remove=False):
+        """Flush pending records and close the journal, removing it when the run is complete"""
+        if self._file is not None:
+            self._sync(force=True)
+            self._file.close()
+            self._file = None
+        if remove:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+class SyncManifest:
+    """
+    Record of the files copied by the last sync into a target directory.
+
+    With a manifest from a previous sync of the same source, a file is
+    unchanged when its source size and mtime match the recorded ones, so
+    no target file has to be stat'ed. Without one, source files are
+    compared with the target files themselves. With checksum enabled,
+    files of equal size are compared by SHA-256 content hash instead of
+    mtime.
+    """
+
+    def __init__(self, target_path, source, checksum=False):
+        self.target_path = Path(target_path)
+        self.source = source
+        self.checksum = checksum
+        self.previous = None
+        self.files = {}
+        self._lock = threading.Lock()
+
+    @property
+    def path(self):
+        return self.target_path / SYNC_MANIFEST_NAME
+
+    def load(self):
+        """
+        Read the manifest of the previous sync
+
+        Returns:
+            bool: True if a usable manifest for this source was found
+        """
+        try:
+            with open(self.path) as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable sync manifest {self.path}: {str(e)}")
+            return False
+
+        if manifest.get('version') != SYNC_MANIFEST_VERSION or manifest.get('source') != self.source:
+            print("Sync manifest belongs to another source, comparing with target files")
+            return False
+        self.previous = manifest['files']
+        return True
+
+    def needs_copy(self, entry, target_file):
+        """
+        Decide whether a source file has to be copied; unchanged files
+        are recorded in the new manifest right away
+
+        Args:
+            entry (WalkEntry): Source file
+            target_file (Path): Where it is copied to
+
+        Returns:
+            bool: True if the file is new or changed
+        """
+        key = entry.relative_path.replace(os.sep, '/')
+        sha256 = None
+
+        if self.previous is not None:
+            known = self.previous.get(key)
+            if known is None or known['size'] != entry.size:
+                return True
+            if self.checksum:
+                sha256 = file_sha256(entry.path)
+                if sha256 != (known.get('sha256') or file_sha256(target_file)):
+                    return True
+            elif abs(known['mtime'] - entry.mtime) > MTIME_TOLERANCE:
+                return True
+        else:
+            try:
+                stat = target_file.stat()
+            except FileNotFoundError:
+                return True
+            if stat.st_size != entry.size:
+                return True
+            if self.checksum:
+                sha256 = file_sha256(entry.path)
+                if sha256 != file_sha256(target_file):
+                    return True
+            elif abs(stat.st_mtime - entry.mtime) > MTIME_TOLERANCE:
+                return True
+
+        self.record(entry, sha256)
+        return False
+
+    def sha256_of(self, entry):
+        """Return the checksum recorded for a file in this sync, if known"""
+        with self._lock:
+            return self.files.get(entry.relative_path.replace(os.sep, '/'), {}).get('sha256')
+
+    def record(self, entry, sha256=None):
+        """Add a file that is now up to date in the target to the manifest"""
+        if self.checksum and sha256 is None:
+            sha256 = file_sha256(self.target_path / entry.relative_path)
+        with self._lock:
+            self.files[entry.relative_path.replace(os.sep, '/')] = {
+                'size': entry.size,
+                'mtime': entry.mtime,
+                'sha256': sha256
+            }
+
+    def stale_paths(self):
+        """
+        Return relative paths ('/' separated) of files the previous sync
+        copied whose source is gone. Only files recorded in the previous
+        manifest are ever returned, so files that were in the target
+        before the first sync are never considered stale.
+        """
+        if self.previous is None:
+            return []
+        return sorted(path for path in self.previous if path not in self.files)
+
+    def keep_previous(self, entries):
+        """
+        Carry the previous records of files that failed to copy over to the
+        new manifest, so they are neither deleted nor considered up to date
+        """
+        if self.previous is None:
+            return
+        with self._lock:
+            for entry in entries:
+                key = entry.relative_path.replace(os.sep, '/')
+                if key not in self.files and key in self.previous:
+                    self.files[key] = self.previous[key]
+
+    def save(self):
+        """Write the manifest atomically"""
+        temp_path = self.target_path / f".{SYNC_MANIFEST_NAME}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump({'version': SYNC_MANIFEST_VERSION, 'source': self.source, 'files': self.files}, f)
+        os.replace(temp_path, self.path)
+
+def delete_stale_files(target_path, relative_paths):
+    """
+    Remove target files whose source is gone, and directories left empty
+
+    Returns:
+        int: Number of files removed
+    """
+    removed = 0
+    parents = set()
+    for relative_path in relative_paths:
+        target_file = target_path / relative_path
+        try:
+            target_file.unlink()
+            removed += 1
+        except FileNotFoundError:
+            pass
+        parents.update(parent for parent in target_file.parents if target_path in parent.parents)
+
+    # Deepest first, so emptied parents can go too
+    for directory in sorted(parents, key=lambda path: len(path.parts), reverse=True):
+        try:
+            directory.rmdir()
+        except OSError:
+            pass
+    return removed
+
+class CopyProgress:
+    """
+    Thread-safe copy counters printed as one aggregated line every
+    PROGRESS_INTERVAL seconds instead of a line per file
+    """
+
+    def __init__(self, interval=PROGRESS_INTERVAL, verbose=False):
+        self.interval = interval
+        self.verbose = verbose
+        self.files = 0
+        self.bytes = 0
+        self.unchanged = 0
+        self.resumed = 0
+        self.failed = 0
+        self.started = time.monotonic()
+        self._reported = self.started
+        self._lock = threading.Lock()
+
+    def add(self, relative_path, size):
+        with self._lock:
+            self.files += 1
+            self.bytes += size
+            if self.verbose:
+                print(f"Copied: {relative_path}")
+            now = time.monotonic()
+            if now - self._reported >= self.interval:
+                self._reported = now
+                print(self.summary())
+
+    def add_unchanged(self):
+        with self._lock:
+            self.unchanged += 1
+
+    def add_resumed(self):
+        with self._lock:
+            self.resumed += 1
+
+    def add_failed(self, relative_path, error):
+        with self._lock:
+            self.failed += 1
+            print(f"Failed to copy {relative_path}: {str(error)}")
+
+    def summary(self):
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        skipped = ""
+        if self.unchanged:
+            skipped += f", {self.unchanged} unchanged"
+        if self.resumed:
+            skipped += f", {self.resumed} already copied"
+        return (
+            f"Copied {self.files} files ({self.bytes / 1024 ** 2:.1f} MB){skipped} in {elapsed:.0f}s, "
+            f"{self.files / elapsed:.1f} files/s, {self.bytes / 1024 ** 2 / elapsed:.1f} MB/s"
+        )
+
+class ParallelCopier:
+    """
+    Copies files found by the walker on a bounded pool of threads while
+    the walker is still listing directories. Over SMB each copy costs
+    several round trips, so overlapping many of them hides the latency.
+    """
+
+    def __init__(self, target_path, jobs=1, progress=None, manifest=None, journal=None,
+                 retries=DEFAULT_RETRIES, retry_delay=DEFAULT_RETRY_DELAY,
+                 buffer_size=DEFAULT_BUFFER_SIZE, checksums=False, verify=False):
+        """
+        Args:
+            target_path (Path): Directory to copy into
+            jobs (int): Number of files copied at the same time
+            progress (CopyProgress): Receives copy counts
+            manifest (SyncManifest): When given, only new and changed
+                files are copied and every file is recorded in it
+            journal (CopyJournal): When given, every copy is recorded in it
+                and files it lists as completed are skipped
+            retries (int): Times failed files are tried again
+            retry_delay (float): Seconds before the first retry, doubled
+                before each following one
+            buffer_size (int): Buffer of hashed copies
+            checksums (bool): Collect the SHA-256 of every file in
+                self.checksums, computed while copying
+            verify (bool): Read every copied file back and compare its
+                SHA-256 before renaming it into place
+        """
+        if jobs < 1:
+            raise ValueError("jobs must be at least 1")
+        self.target_path = target_path
+        self.jobs = jobs
+        self.progress = progress or CopyProgress()
+        self.manifest = manifest
+        self.journal = journal
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.buffer_size = buffer_size
+        self.collect_checksums = checksums or verify
+        self.verify = verify
+        self.checksums = {}
+        self._checksums_lock = threading.Lock()
+        self._created_dirs = set()
+        self._dirs_lock = threading.Lock()
+
+    def ensure_dir(self, directory):
+        """Create a target directory once, however many files it receives"""
+        with self._dirs_lock:
+            if directory in self._created_dirs:
+                return
+        directory.mkdir(parents=True, exist_ok=True)
+        with self._dirs_lock:
+            self._created_dirs.add(directory)
+            # Parents were created along the way
+            self._created_dirs.update(directory.parents)
+
+    def copy_file(self, entry):
+        """Copy one WalkEntry, keeping its relative path"""
+        target_file = self.target_path / entry.relative_path
+        journal = self.journal
+        manifest = self.manifest
+        if journal is not None and journal.is_completed(entry):
+            sha256 = journal.completed_sha256(entry)
+            if manifest is not None:
+                manifest.record(entry, sha256)
+            self._record_checksum(entry, sha256)
+            self.progress.add_resumed()
+            return
+        if manifest is not None and not manifest.needs_copy(entry, target_file):
+            self._record_checksum(entry, manifest.sha256_of(entry))
+            self.progress.add_unchanged()
+            return
+
+        self.ensure_dir(target_file.parent)
+        resume_from = journal.resume_offset(entry, target_file) if journal is not None else 0
+        checkpoint = None
+        if journal is not None:
+            journal.start(entry, resume_from)
+            checkpoint = functools.partial(journal.checkpoint, entry)
+        # Hashing during the copy saves reading the file again later
+        checksum = self.collect_checksums or (manifest is not None and manifest.checksum)
+        result = copy_file_atomic(
+            entry.path, target_file, resume_from, self.buffer_size, checksum, self.verify, checkpoint
+        )
+        if journal is not None:
+            journal.done(entry, target_file, result.sha256)
+        if manifest is not None:
+            manifest.record(entry, result.sha256)
+        self._record_checksum(entry, result.sha256)
+        self.progress.add(entry.relative_path, result.bytes_copied)
+
+    def _record_checksum(self, entry, sha256):
+        if self.collect_checksums and sha256:
+            with self._checksums_lock:
+                self.checksums[entry.relative_path.replace(os.sep, '/')] = sha256
+
+    def _copy_all(self, entries):
+        """
+        Copy entries on the pool
+
+        Returns:
+            list: (entry, exception) of every file that failed
+        """
+        failures = []
+
+        def copy(entry):
+            try:
+                self.copy_file(entry)
+            except Exception as e:
+                failures.append((entry, e))
+
+        if self.jobs == 1:
+            for entry in entries:
+                copy(entry)
+            return failures
+
+        slots = threading.BoundedSemaphore(self.jobs * PENDING_PER_JOB)
+
+        def copy_in_slot(entry):
+            try:
+                copy(entry)
+            finally:
+                slots.release()
+
+        with ThreadPoolExecutor(max_workers=self.jobs, thread_name_prefix="copy") as pool:
+            for entry in entries:
+                slots.acquire()
+                pool.submit(copy_in_slot, entry)
+        return failures
+
+    def run(self, entries):
+        """
+        Copy every entry. Files that fail are collected and retried with
+        exponential backoff once all others have been copied.
+
+        Args:
+            entries (iterable): WalkEntry objects, typically from iter_files
+
+        Returns:
+            list: (entry, exception) of the files that still failed after
+                the last retry
+        """
+        failures = self._copy_all(entries)
+        delay = self.retry_delay
+        for attempt in range(1, self.retries + 1):
+            if not failures:
+                break
+            print(f"Retrying {len(failures)} failed files in {delay:.0f}s (attempt {attempt} of {self.retries})")
+            time.sleep(delay)
+            delay *= 2
+            failures = self._copy_all([entry for entry, _ in failures])
+
+        for entry, error in failures:
+            self.progress.add_failed(entry.relative_path, error)
+            if self.journal is not None:
+                self.journal.failed(entry, error)
+        return failures
 
 def map_network_drive(nas_path, username, password):
     """
@@ -50,7 +691,10 @@ def unmap_network_drive(nas_path):
     except Exception as e:
         print(f"Error unmapping network drive: {str(e)}")
 
-def copy_nas_files(nas_path, target_dir=".", username=None, password=None):
+def copy_nas_files(nas_path, target_dir=".", username=None, password=None, jobs=1, verbose=False,
+                   sync=False, checksum=False, delete=False, resume=False,
+                   retries=DEFAULT_RETRIES, retry_delay=DEFAULT_RETRY_DELAY,
+                   buffer_size=DEFAULT_BUFFER_SIZE, checksums=False, verify=False):
     """
     Copy files from NAS path to target directory
     
@@ -59,6 +703,17 @@ def copy_nas_files(nas_path, target_dir=".", username=None, password=None):
         target_dir (str): Target directory, default is current directory
         username (str): Username for NAS authentication
         password (str): Password for NAS authentication
+        jobs (int): Number of files copied at the same time
+        verbose (bool): Print a line for every copied file
+        sync (bool): Only copy files that are new or changed since the last sync
+        checksum (bool): In sync mode, compare files of equal size by content hash
+        delete (bool): In sync mode, remove target files whose source is gone
+        resume (bool): Continue an interrupted run from its journal
+        retries (int): Times failed files are tried again
+        retry_delay (float): Seconds before the first retry, doubled after each
+        buffer_size (int): Buffer of hashed copies
+        checksums (bool): Write a SHA256SUMS manifest into the target directory
+        verify (bool): Compare the SHA-256 of every written file with its source
     """
     drive_mapped = False
     try:
@@ -83,26 +738,65 @@ def copy_nas_files(nas_path, target_dir=".", username=None, password=None):
         
         # Get all files under NAS directory
         nas_dir = Path(nas_path)
-        files_copied = 0
+        progress = CopyProgress(verbose=verbose)
         
-        print(f"Starting to copy files from {nas_path} to {target_dir}")
+        print(f"Starting to copy files from {nas_path} to {target_dir} ({jobs} jobs)")
         
-        # Traverse all files and subdirectories under NAS directory
-        for item in nas_dir.rglob("*"):
-            if item.is_file():
-                # Calculate relative path to maintain directory structure
-                relative_path = item.relative_to(nas_dir)
-                target_file = target_path / relative_path
-                
-                # Create parent directory for target file
-                target_file.parent.mkdir(parents=True, exist_ok=True)
-                
-                # Copy file
-                shutil.copy2(item, target_file)
-                print(f"Copied: {relative_path}")
-                files_copied += 1
+        # Traverse all files and subdirectories under NAS directory,
+        # listing directories in parallel while earlier files are copied
+        manifest = None
+        if sync:
+            manifest = SyncManifest(target_path, str(nas_dir), checksum)
+            if manifest.load():
+                print(f"Comparing with sync manifest of {len(manifest.previous)} files")
+        
+        journal = CopyJournal(target_path)
+        if resume:
+            print(f"Resuming: {journal.load()} files already copied by the interrupted run")
+        journal.open(resume)
+        
+        copier = ParallelCopier(
+            target_path, jobs, progress, manifest, journal, retries, retry_delay, buffer_size, checksums, verify
+        )
+        try:
+            failures = copier.run(ParallelTreeWalker().iter_files(nas_dir))
+        finally:
+            journal.close()
         
-        print(f"Copy completed! Total {files_copied} files copied")
+        print(progress.summary())
+        
+        deleted = []
+        if manifest is not None:
+            if failures:
+                # Deleting now would remove the last good copy of failed files
+                manifest.keep_previous(entry for entry, _ in failures)
+            elif delete and manifest.previous is None:
+                # Without a record of what earlier syncs copied, any other
+                # file in the target could be taken for a stale one
+                print("Not deleting anything: there is no sync manifest of an earlier run to tell "
+                      "copied files from other files in the target")
+            elif delete:
+                deleted = manifest.stale_paths()
+                removed = delete_stale_files(target_path, deleted)
+                print(f"Deleted {removed} files no longer in the source")
+            manifest.save()
+        
+        if copier.collect_checksums:
+            # Files not copied this time keep the checksums of earlier runs
+            checksum_path = target_path / CHECKSUM_MANIFEST_NAME
+            checksums = read_checksum_manifest(checksum_path)
+            checksums.update(copier.checksums)
+            for relative_path in deleted:
+                checksums.pop(relative_path, None)
+            write_checksum_manifest(checksum_path, checksums)
+            print(f"Wrote checksums of {len(checksums)} files to {checksum_path}")
+        
+        if failures:
+            print(f"Copy incomplete: {len(failures)} files failed; run again with --resume to retry them")
+            return False
+        
+        journal.close(remove=True)
+        print(f"Copy completed! Total {progress.files} files copied")
         return True
         
     except Exception as e:
@@ -119,15 +813,41 @@ def main():
     parser.add_argument("-t", "--target", default=".", help="Target directory (default: current directory)")
     parser.add_argument("-u", "--username", help="Username for NAS authentication")
     parser.add_argument("-p", "--password", help="Password for NAS authentication")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="Number of files copied in parallel (default: 1)")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Print every copied file")
+    parser.add_argument("-s", "--sync", action="store_true", help="Only copy files that are new or changed")
+    parser.add_argument("-c", "--checksum", action="store_true",
+                        help="Compare files of equal size by content hash instead of mtime (implies --sync)")
+    parser.add_argument("--delete", action="store_true",
+                        help="Remove target files that no longer exist in the source (requires --sync)")
+    parser.add_argument("-r", "--resume", action="store_true",
+                        help="Continue an interrupted copy, skipping the files it completed")
+    parser.add_argument("--retries", type=int, default=DEFAULT_RETRIES,
+                        help=f"Times failed files are retried (default: {DEFAULT_RETRIES})")
+    parser.add_argument("-b", "--buffer-size", type=int, default=DEFAULT_BUFFER_SIZE // 1024 ** 2,
+                        help=f"Copy buffer in MB (default: {DEFAULT_BUFFER_SIZE // 1024 ** 2})")
+    parser.add_argument("--checksums", action="store_true",
+                        help=f"Write the SHA-256 of every file, computed while copying, to {CHECKSUM_MANIFEST_NAME}")
+    parser.add_argument("--verify", action="store_true",
+                        help="Read every copied file back and compare its SHA-256 with the source (implies --checksums)")
+    parser.add_argument("--retry-delay", type=float, default=DEFAULT_RETRY_DELAY,
+                        help=f"Seconds before the first retry, doubled after each (default: {DEFAULT_RETRY_DELAY:.0f})")
     
     args = parser.parse_args()
     
+    sync = args.sync or args.checksum
+    if args.delete and not sync:
+        parser.error("--delete requires --sync")
+    
     # Get credentials from environment variables if not provided as arguments
     username = args.username or os.getenv('NAS_USERNAME')
     password = args.password or os.getenv('NAS_PASSWORD')
     
     # Execute copy operation
-    success = copy_nas_files(args.nas_path, args.target, username, password)
+    success = copy_nas_files(args.nas_path, args.target, username, password, args.jobs, args.verbose,
+                             sync, args.checksum, args.delete, args.resume,
+                             args.retries, args.retry_delay, args.buffer_size * 1024 ** 2,
+                             args.checksums, args.verify)
     
     # Set exit code based on execution result
     sys.exit(0 if success else 1)
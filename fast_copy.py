@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import uuid
+import errno
+import shutil
+import hashlib
+
+# Default read/write buffer of hashed copies; large buffers mean fewer
+# round trips for each workbook read over SMB
+DEFAULT_BUFFER_SIZE = 8 * 1024 * 1024
+
+# Smallest buffer allocated for a file, so one that grows while being
+# read still moves in reasonable steps
+MIN_BUFFER_SIZE = 64 * 1024
+
+# Largest request handed to copy_file_range/sendfile at once
+KERNEL_COPY_CHUNK = 1024 * 1024 * 1024
+
+# Bytes between two checkpoints of a copy that reports them; each one
+# flushes the target to disk
+CHECKPOINT_SIZE = 64 * 1024 * 1024
+
+# Name of the checksum manifest, in the format of sha256sum
+CHECKSUM_MANIFEST_NAME = "SHA256SUMS"
+
+# Errors meaning the kernel can't copy between these two files, so the
+# next method should be tried (only before anything has been copied)
+_KERNEL_COPY_UNSUPPORTED = {
+    errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EBADF, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EPERM
+}
+
+class CopyResult:
+    """Outcome of copy_file"""
+
+    __slots__ = ('bytes_copied', 'sha256', 'method')
+
+    def __init__(self, bytes_copied, sha256, method):
+        self.bytes_copied = bytes_copied
+        self.sha256 = sha256
+        self.method = method
+
+    def __repr__(self):
+        return f"CopyResult(bytes_copied={self.bytes_copied}, sha256={self.sha256!r}, method={self.method!r})"
+
+def _write_all(dst, data):
+    written = 0
+    while written < len(data):
+        written += dst.write(data[written:])
+
+def _file_buffer(f, buffer_size):
+    """
+    Allocate a read buffer no larger than what is left of the file, since
+    zeroing a full-size buffer costs more than copying a small workbook
+    """
+    try:
+        remaining = os.fstat(f.fileno()).st_size - f.tell()
+    except OSError:
+        remaining = buffer_size
+    return bytearray(max(MIN_BUFFER_SIZE, min(buffer_size, remaining)))
+
+def _buffered_copy(src, dst, buffer_size, digest, advance=None):
+    """Copy through one reusable buffer, hashing what passes through it"""
+    buffer = _file_buffer(src, buffer_size)
+    view = memoryview(buffer)
+    copied = 0
+    while True:
+        count = src.readinto(buffer)
+        if not count:
+            break
+        chunk = view[:count]
+        if digest is not None:
+            digest.update(chunk)
+        _write_all(dst, chunk)
+        copied += count
+        if advance is not None:
+            advance(copied)
+    return copied
+
+def _kernel_copy(src, dst, offset, chunk_size=KERNEL_COPY_CHUNK, advance=None):
+    """
+    Copy without passing the data through user space; advance, when given,
+    is called with the bytes copied so far after every chunk
+
+    Returns:
+        tuple: (bytes copied, method name), or (None, None) when the kernel
+            can't copy between these files
+    """
+    src_fd, dst_fd = src.fileno(), dst.fileno()
+
+    methods = []
+    if hasattr(os, 'copy_file_range'):
+        methods.append(('copy_file_range', lambda position: os.copy_file_range(src_fd, dst_fd, chunk_size)))
+    if hasattr(os, 'sendfile') and os.name == 'posix':
+        methods.append(('sendfile', lambda position: os.sendfile(dst_fd, src_fd, position, chunk_size)))
+
+    for name, copy_chunk in methods:
+        copied = 0
+        while True:
+            try:
+                count = copy_chunk(offset + copied)
+            except OSError as e:
+                if copied == 0 and e.errno in _KERNEL_COPY_UNSUPPORTED:
+                    break
+                raise
+            if count == 0:
+                # Some filesystems report nothing copied instead of failing
+                if copied == 0 and os.fstat(src_fd).st_size > offset:
+                    break
+                return copied, name
+            copied += count
+            if advance is not None:
+                advance(copied)
+    return None, None
+
+def copy_file(source, target, buffer_size=DEFAULT_BUFFER_SIZE, checksum=False, resume_from=0,
+              checkpoint=None, checkpoint_size=CHECKPOINT_SIZE):
+    """
+    Copy a file and its metadata (like shutil.copy2) as fast as the
+    platform allows.
+
+    Without checksum, the kernel copies the data (copy_file_range, then
+    sendfile) so it never enters Python. With checksum, the data goes
+    through a buffer of up to buffer_size bytes and is hashed on its way,
+    so the SHA-256 costs no extra read of the source.
+
+    Args:
+        source (str or Path): File to copy
+        target (str or Path): Destination file, overwritten
+        buffer_size (int): Largest buffer of the user-space copy
+        checksum (bool): Compute the SHA-256 of the content
+        resume_from (int): Bytes already in target from an interrupted
+            copy of the same source; the copy continues after them
+        checkpoint (callable): When given, target is flushed to disk about
+            every checkpoint_size bytes and checkpoint is called with the
+            number of bytes of target that are durable, which is where a
+            copy interrupted by a crash can safely resume
+        checkpoint_size (int): Bytes between two checkpoints
+
+    Returns:
+        CopyResult: Bytes copied in total, SHA-256 hex digest (or None)
+            and the copy method used
+    """
+    digest = hashlib.sha256() if checksum else None
+
+    with open(source, 'rb', buffering=0) as src, open(target, 'r+b' if resume_from else 'wb', buffering=0) as dst:
+        if resume_from:
+            if digest is not None:
+                # The kept prefix is local, so rereading it is cheap
+                remaining = resume_from
+                while remaining:
+                    chunk = dst.read(min(remaining, buffer_size))
+                    if not chunk:
+                        raise OSError(f"Partial copy {target} is shorter than {resume_from} bytes")
+                    digest.update(chunk)
+                    remaining -= len(chunk)
+            src.seek(resume_from)
+            dst.seek(resume_from)
+            dst.truncate()
+
+        advance = None
+        chunk_size = KERNEL_COPY_CHUNK
+        if checkpoint is not None:
+            synced = 0
+
+            def advance(copied):
+                nonlocal synced
+                if copied - synced >= checkpoint_size:
+                    os.fsync(dst.fileno())
+                    synced = copied
+                    checkpoint(resume_from + copied)
+
+            chunk_size = min(chunk_size, checkpoint_size)
+
+        copied, method = (None, None) if digest is not None else _kernel_copy(
+            src, dst, resume_from, chunk_size, advance
+        )
+        if copied is None:
+            copied, method = _buffered_copy(src, dst, buffer_size, digest, advance), 'buffered'
+
+    shutil.copystat(source, target)
+    return CopyResult(resume_from + copied, digest.hexdigest() if digest is not None else None, method)
+
+def file_sha256(file_path, buffer_size=DEFAULT_BUFFER_SIZE):
+    """Return the SHA-256 hex digest of a file"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb', buffering=0) as f:
+        buffer = _file_buffer(f, buffer_size)
+        view = memoryview(buffer)
+        while True:
+            count = f.readinto(buffer)
+            if not count:
+                break
+            digest.update(view[:count])
+    return digest.hexdigest()
+
+def read_checksum_manifest(path):
+    """
+    Read a manifest written by write_checksum_manifest
+
+    Returns:
+        dict: SHA-256 hex digests keyed by relative path, empty if missing
+    """
+    checksums = {}
+    try:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                digest, separator, relative_path = line.rstrip('\n').partition('  ')
+                if separator:
+                    checksums[relative_path] = digest
+    except FileNotFoundError:
+        pass
+    return checksums
+
+def format_checksum_manifest(checksums):
+    """Render checksums keyed by relative path in the format of sha256sum"""
+    return ''.join(f"{digest}  {relative_path}\n" for relative_path, digest in sorted(checksums.items()))
+
+def write_checksum_manifest(path, checksums):
+    """
+    Write checksums keyed by relative path ('/' separated) atomically, in
+    a format `sha256sum -c` can verify from the manifest's directory
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    temp_path = os.path.join(directory, f".{os.path.basename(path)}.{uuid.uuid4().hex}.tmp")
+    with open(temp_path, 'w', encoding='utf-8', newline='\n') as f:
+        f.write(format_checksum_manifest(checksums))
+    os.replace(temp_path, path)
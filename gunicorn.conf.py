@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+#
+# Production server configuration:
+#   gunicorn -c gunicorn.conf.py nas_excel_downloader:app
+#
+# Every worker is a separate process with its own interpreter, so archive
+# builds scale across all cores instead of sharing one GIL. Settings are
+# read from NAS_SERVER_* environment variables; gunicorn command-line
+# options override them.
+
+import os
+import multiprocessing
+
+bind = os.getenv('NAS_SERVER_BIND', '0.0.0.0:5000')
+
+# Worker processes, and threads per process serving requests concurrently
+workers = int(os.getenv('NAS_SERVER_WORKERS', multiprocessing.cpu_count()))
+threads = int(os.getenv('NAS_SERVER_THREADS', 8))
+worker_class = 'gthread'
+
+# A worker that doesn't check in for this long is killed and replaced;
+# gthread workers check in from their main loop, so long downloads are fine
+timeout = int(os.getenv('NAS_SERVER_TIMEOUT', 120))
+
+# Seconds workers get to finish in-flight requests on shutdown or reload
+graceful_timeout = int(os.getenv('NAS_SERVER_GRACEFUL_TIMEOUT', 60))
+keepalive = int(os.getenv('NAS_SERVER_KEEPALIVE', 5))
+
+# Recycle workers after this many requests (0 = never), with jitter so
+# they don't all restart at the same time
+max_requests = int(os.getenv('NAS_SERVER_MAX_REQUESTS', 0))
+max_requests_jitter = int(os.getenv('NAS_SERVER_MAX_REQUESTS_JITTER', max_requests // 10))
+
+# Each process deflates with its own thread pool; split the cores between
+# workers unless the pool size was configured explicitly
+os.environ.setdefault('NAS_ZIP_COMPRESS_WORKERS', str(max(1, multiprocessing.cpu_count() // max(workers, 1))))
+
+# Same for the processes parsing workbooks for /convert-xlsx
+os.environ.setdefault('NAS_CONVERT_WORKERS', str(max(1, multiprocessing.cpu_count() // max(workers, 1))))
+
+# Heavy requests running and waiting for a slot each take a thread; keep
+# at least half of the threads free for listings and health checks
+os.environ.setdefault('NAS_ADMISSION_MAX_ACTIVE', str(max(1, threads // 4)))
+os.environ.setdefault('NAS_ADMISSION_QUEUE_SIZE', str(max(1, threads // 4)))
+
+def post_worker_init(worker):
+    worker.log.info(f"Worker {worker.pid} ready")
+
+def worker_exit(server, worker):
+    """Release the worker's jobs and request workspaces before it exits"""
+    from nas_excel_downloader import cleanup_on_exit
+    cleanup_on_exit()
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import time
+import shutil
+import builtins
+import threading
+
+class LatencyProfile:
+    """
+    Simulated cost of filesystem operations on a remote share
+
+    Latencies are in seconds per call; bandwidth is in bytes per second
+    and shared by all concurrent reads, like a single network link.
+    """
+
+    def __init__(self, listdir=0.0, stat=0.0, open=0.0, read=0.0, bandwidth=None):
+        for name, value in (('listdir', listdir), ('stat', stat), ('open', open), ('read', read)):
+            if value < 0:
+                raise ValueError(f"{name} latency cannot be negative")
+        if bandwidth is not None and bandwidth <= 0:
+            raise ValueError("bandwidth must be positive")
+
+        self.listdir = listdir
+        self.stat = stat
+        self.open = open
+        self.read = read
+        self.bandwidth = bandwidth
+
+    @classmethod
+    def smb(cls, round_trip=0.001, bandwidth=100 * 1024 ** 2):
+        """Profile of an SMB share: one round trip per call and a 100 MB/s link by default"""
+        return cls(listdir=round_trip, stat=round_trip, open=round_trip, read=round_trip, bandwidth=bandwidth)
+
+    def __repr__(self):
+        return (
+            f"LatencyProfile(listdir={self.listdir}, stat={self.stat}, open={self.open}, "
+            f"read={self.read}, bandwidth={self.bandwidth})"
+        )
+
+class _SlowDirEntry:
+    """DirEntry whose stat() costs a round trip, as it does over SMB"""
+
+    __slots__ = ('_entry', '_injector', '_stat')
+
+    def __init__(self, entry, injector):
+        self._entry = entry
+        self._injector = injector
+        self._stat = None
+
+    name = property(lambda self: self._entry.name)
+    path = property(lambda self: self._entry.path)
+
+    def is_dir(self, *, follow_symlinks=True):
+        return self._entry.is_dir(follow_symlinks=follow_symlinks)
+
+    def is_file(self, *, follow_symlinks=True):
+        return self._entry.is_file(follow_symlinks=follow_symlinks)
+
+    def is_symlink(self):
+        return self._entry.is_symlink()
+
+    def inode(self):
+        return self._entry.inode()
+
+    def stat(self, *, follow_symlinks=True):
+        if self._stat is None:
+            self._injector.delay(self._injector.profile.stat)
+            self._stat = self._entry.stat(follow_symlinks=follow_symlinks)
+        return self._stat
+
+    def __fspath__(self):
+        return self._entry.path
+
+class _SlowScandir:
+    """Iterator of os.scandir results wrapped in _SlowDirEntry"""
+
+    def __init__(self, iterator, injector):
+        self._iterator = iterator
+        self._injector = injector
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return _SlowDirEntry(next(self._iterator), self._injector)
+
+    def close(self):
+        self._iterator.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class _SlowFile:
+    """Binary file whose reads pay the read latency and the shared bandwidth"""
+
+    def __init__(self, file, injector):
+        self._file = file
+        self._injector = injector
+
+    def read(self, size=-1):
+        data = self._file.read(size)
+        self._injector.transfer(len(data))
+        return data
+
+    def readinto(self, buffer):
+        count = self._file.readinto(buffer)
+        self._injector.transfer(count or 0)
+        return count
+
+    def __iter__(self):
+        return iter(self._file)
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self._file.close()
+
+class LatencyInjector:
+    """
+    Makes a local directory behave like a remote share for code running
+    in this process: directory listings, stat calls, opens and reads of
+    paths under root are delayed according to a LatencyProfile, while
+    everything else (staging directories, the archive cache) is left alone.
+
+    Used as a context manager, it patches os.scandir, os.listdir, os.stat
+    and open for the duration of the block. Sleeping releases the GIL, so
+    concurrent requests overlap their waits as they would on a real share.
+    """
+
+    def __init__(self, root, profile):
+        self.root = os.path.abspath(root)
+        self.profile = profile
+        self.calls = {'listdir': 0, 'stat': 0, 'open': 0, 'read': 0}
+        self.bytes_read = 0
+        self._link_free_at = 0.0
+        self._lock = threading.Lock()
+        self._originals = None
+
+    def covers(self, path):
+        """Return True if path (str, bytes or path-like) lies under the root"""
+        if isinstance(path, int):
+            return False
+        try:
+            path = os.fsdecode(os.fspath(path))
+        except TypeError:
+            return False
+        path = os.path.abspath(path)
+        return path == self.root or path.startswith(self.root + os.sep)
+
+    def delay(self, seconds):
+        if seconds:
+            time.sleep(seconds)
+
+    def transfer(self, size):
+        """Pay the read latency and reserve link time for size bytes"""
+        with self._lock:
+            self.calls['read'] += 1
+            self.bytes_read += size
+        self.delay(self.profile.read)
+
+        if self.profile.bandwidth and size:
+            with self._lock:
+                now = time.monotonic()
+                self._link_free_at = max(self._link_free_at, now) + size / self.profile.bandwidth
+                wait = self._link_free_at - now
+            self.delay(wait)
+
+    def _count(self, operation):
+        with self._lock:
+            self.calls[operation] += 1
+
+    def __enter__(self):
+        if self._originals is not None:
+            raise RuntimeError("LatencyInjector is already active")
+
+        original_scandir, original_listdir = os.scandir, os.listdir
+        original_stat, original_open = os.stat, builtins.open
+        profile = self.profile
+
+        def scandir(path='.'):
+            if self.covers(path):
+                self._count('listdir')
+                self.delay(profile.listdir)
+                return _SlowScandir(original_scandir(path), self)
+            return original_scandir(path)
+
+        def listdir(path='.'):
+            if self.covers(path):
+                self._count('listdir')
+                self.delay(profile.listdir)
+            return original_listdir(path)
+
+        def stat(path, *args, **kwargs):
+            if self.covers(path):
+                self._count('stat')
+                self.delay(profile.stat)
+            return original_stat(path, *args, **kwargs)
+
+        def open_file(file, mode='r', *args, **kwargs):
+            if not self.covers(file):
+                return original_open(file, mode, *args, **kwargs)
+            self._count('open')
+            self.delay(profile.open)
+            handle = original_open(file, mode, *args, **kwargs)
+            # Text reads are rare on the share; only binary reads are throttled
+            if 'b' in mode and 'r' in mode:
+                return _SlowFile(handle, self)
+            return handle
+
+        self._originals = {
+            'scandir': original_scandir,
+            'listdir': original_listdir,
+            'stat': original_stat,
+            'open': original_open,
+            'sendfile': shutil._USE_CP_SENDFILE
+        }
+        os.scandir, os.listdir, os.stat = scandir, listdir, stat
+        builtins.open = io.open = open_file
+        # shutil would copy with sendfile, bypassing the throttled reads
+        shutil._USE_CP_SENDFILE = False
+        return self
+
+    def __exit__(self, *exc_info):
+        originals, self._originals = self._originals, None
+        os.scandir = originals['scandir']
+        os.listdir = originals['listdir']
+        os.stat = originals['stat']
+        builtins.open = io.open = originals['open']
+        shutil._USE_CP_SENDFILE = originals['sendfile']
+
+    def stats(self):
+        """Return the number of delayed calls and bytes read"""
+        with self._lock:
+            return {'calls': dict(self.calls), 'bytes_read': self.bytes_read}
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from benchmark import LAYOUTS, generate_tree, percentile
+from latency_fs import LatencyInjector, LatencyProfile
+
+# Endpoints the load generator can hit, with the payload added to nas_path
+SCENARIOS = {
+    'list': ('/list-xlsx', {}),
+    'download': ('/download-xlsx', {}),
+    'download-stream': ('/download-xlsx', {'stream': True}),
+}
+
+class LocalTransport:
+    """Sends requests to the app in this process through the Flask test client"""
+
+    def __init__(self, app):
+        self.app = app
+        self._local = threading.local()
+
+    def post(self, endpoint, payload):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        response = client.post(endpoint, json=payload)
+        size = len(response.get_data())
+        response.close()
+        return response.status_code, size
+
+class HttpTransport:
+    """Sends requests to a running server"""
+
+    def __init__(self, server_url):
+        import requests
+        self.server_url = server_url.rstrip('/')
+        self._requests = requests
+        self._local = threading.local()
+
+    def post(self, endpoint, payload):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = self._requests.Session()
+        size = 0
+        with session.post(f"{self.server_url}{endpoint}", json=payload, stream=True) as response:
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                size += len(chunk)
+            return response.status_code, size
+
+def run_load(transport, nas_path, scenarios, clients, requests_per_client):
+    """
+    Run clients in parallel, each sending requests_per_client requests
+    that cycle through the scenarios
+
+    Returns:
+        dict: Results keyed by scenario name
+    """
+    samples = {name: [] for name in scenarios}
+    lock = threading.Lock()
+
+    def client(index):
+        for number in range(requests_per_client):
+            # Clients start at different scenarios so every mix is exercised
+            name = scenarios[(index + number) % len(scenarios)]
+            endpoint, extra = SCENARIOS[name]
+            started = time.perf_counter()
+            try:
+                status, size = transport.post(endpoint, dict(extra, nas_path=nas_path))
+            except Exception as e:
+                status, size = type(e).__name__, 0
+            elapsed = time.perf_counter() - started
+            with lock:
+                samples[name].append((elapsed, status, size))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients, thread_name_prefix="load-client") as pool:
+        list(pool.map(client, range(clients)))
+    wall_seconds = time.perf_counter() - started
+
+    results = {}
+    for name, observations in samples.items():
+        durations = [elapsed for elapsed, _, _ in observations]
+        ok = sum(1 for _, status, _ in observations if status == 200)
+        total_bytes = sum(size for _, _, size in observations)
+        results[name] = {
+            'requests': len(observations),
+            'errors': len(observations) - ok,
+            'p50_seconds': round(percentile(durations, 50) or 0, 6),
+            'p95_seconds': round(percentile(durations, 95) or 0, 6),
+            'p99_seconds': round(percentile(durations, 99) or 0, 6),
+            'requests_per_second': round(len(observations) / wall_seconds, 2),
+            'mb_per_second': round(total_bytes / 1024 ** 2 / wall_seconds, 2)
+        }
+    return {'clients': clients, 'wall_seconds': round(wall_seconds, 3), 'scenarios': results}
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Concurrent load test of /list-xlsx and /download-xlsx against a simulated remote share"
+    )
+    parser.add_argument("-c", "--clients", default="1,4,16",
+                        help="Comma-separated numbers of parallel clients, each run in turn (default: 1,4,16)")
+    parser.add_argument("-n", "--requests", type=int, default=10, help="Requests per client (default: 10)")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS),
+                        help="Request type, can be repeated (default: list and download)")
+    parser.add_argument("-l", "--layout", default="mixed", choices=sorted(LAYOUTS), help="Synthetic share layout")
+    parser.add_argument("-s", "--scale", type=float, default=1.0, help="Multiplier of the file sizes")
+    parser.add_argument("-w", "--workdir", default=os.path.join(tempfile.gettempdir(), "nas_xlsx_benchmark"),
+                        help="Where synthetic trees are generated and kept between runs")
+    parser.add_argument("--nas-path", help="Share to load instead of a synthetic tree")
+    parser.add_argument("--listdir-ms", type=float, default=1.0, help="Latency of a directory listing (default: 1)")
+    parser.add_argument("--stat-ms", type=float, default=1.0, help="Latency of a stat call (default: 1)")
+    parser.add_argument("--open-ms", type=float, default=1.0, help="Latency of opening a file (default: 1)")
+    parser.add_argument("--read-ms", type=float, default=0.0, help="Latency of every read (default: 0)")
+    parser.add_argument("--bandwidth-mbps", type=float, default=800.0,
+                        help="Link bandwidth in megabits per second, 0 for unlimited (default: 800)")
+    parser.add_argument("--warm-cache", action="store_true", help="Keep the scan and archive caches enabled")
+    parser.add_argument("--url", help="Load a running server instead; no latency is injected")
+    parser.add_argument("-o", "--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    try:
+        client_counts = [int(count) for count in args.clients.split(',')]
+    except ValueError:
+        parser.error("--clients must be comma-separated integers")
+
+    nas_path = args.nas_path
+    if not nas_path:
+        nas_path = os.path.join(args.workdir, args.layout)
+        generate_tree(nas_path, LAYOUTS[args.layout], args.scale)
+
+    profile = LatencyProfile(
+        listdir=args.listdir_ms / 1000,
+        stat=args.stat_ms / 1000,
+        open=args.open_ms / 1000,
+        read=args.read_ms / 1000,
+        bandwidth=args.bandwidth_mbps * 1000 ** 2 / 8 if args.bandwidth_mbps else None
+    )
+
+    injector = None
+    if args.url:
+        transport = HttpTransport(args.url)
+    else:
+        if not args.warm_cache:
+            os.environ['NAS_SCAN_CACHE_ENTRIES'] = '0'
+            os.environ['NAS_ARCHIVE_CACHE_MAX_BYTES'] = '0'
+        import nas_excel_downloader
+        logging.getLogger().setLevel(logging.WARNING)
+        transport = LocalTransport(nas_excel_downloader.app)
+        injector = LatencyInjector(nas_path, profile)
+        print(f"Simulating {profile}", file=sys.stderr)
+
+    scenarios = args.scenario or ['list', 'download']
+    runs = []
+    for clients in client_counts:
+        print(f"Running {clients} clients x {args.requests} requests against {nas_path}", file=sys.stderr)
+        if injector:
+            with injector:
+                runs.append(run_load(transport, nas_path, scenarios, clients, args.requests))
+        else:
+            runs.append(run_load(transport, nas_path, scenarios, clients, args.requests))
+
+    print(f"{'clients':>7} {'scenario':<16} {'requests':>8} {'errors':>6} {'p50 s':>9} {'p95 s':>9} "
+          f"{'p99 s':>9} {'req/s':>8} {'MB/s':>8}")
+    for run in runs:
+        for name, result in run['scenarios'].items():
+            print(
+                f"{run['clients']:>7} {name:<16} {result['requests']:>8} {result['errors']:>6} "
+                f"{result['p50_seconds']:>9.4f} {result['p95_seconds']:>9.4f} {result['p99_seconds']:>9.4f} "
+                f"{result['requests_per_second']:>8} {result['mb_per_second']:>8}"
+            )
+
+    if args.output:
+        report = {
+            'nas_path': nas_path,
+            'profile': None if args.url else vars(profile),
+            'filesystem_calls': injector.stats() if injector else None,
+            'runs': runs
+        }
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import abc
+import time
+import bisect
+import threading
+
+# Latency buckets in seconds, up to the duration of a large archive download
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+class Metric(abc.ABC):
+    """Base of a metric family with a fixed set of label names"""
+
+    type_name = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {', '.join(self.labelnames)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    @abc.abstractmethod
+    def _samples(self):
+        """Return the exposition lines of every labelled value"""
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(self._samples())
+        return lines
+
+class Counter(Metric):
+    """Monotonically increasing value"""
+
+    type_name = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in values]
+
+class Gauge(Counter):
+    """Value that can go up and down"""
+
+    type_name = 'gauge'
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+class Histogram(Metric):
+    """Distribution of observations over fixed buckets"""
+
+    type_name = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket counts (the last one is +Inf), sum
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def time(self, **labels):
+        """Context manager observing the duration of its block"""
+        return _Timer(self, labels)
+
+    def _samples(self):
+        with self._lock:
+            values = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+
+        lines = []
+        for key, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, f'le="{_format_value(float(bound))}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(round(total, 6))}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+
+class MetricsRegistry:
+    """
+    Process-local collection of metrics rendered in the Prometheus text
+    exposition format. Updates are a dict lookup under a lock, so metrics
+    can stay enabled in production.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._register(Counter(name, help_text, labelnames))
+
+    def gauge(self, name, help_text, labelnames=()):
+        return self._register(Gauge(name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help_text, labelnames, buckets))
+
+    def add_collector(self, collector):
+        """Register a callable run before rendering, to refresh gauges that are only sampled on scrape"""
+        self._collectors.append(collector)
+
+    def render(self):
+        """
+        Returns:
+            str: All metrics in the Prometheus text format
+        """
+        for collector in self._collectors:
+            collector()
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+class MetricsMiddleware:
+    """
+    WSGI middleware timing each request until the server has sent the
+    whole response body, which for archive downloads is most of the work.
+
+    The endpoint label is read from environ['nas.endpoint'], set by the
+    application once the URL is matched. File responses built with the
+    server's wsgi.file_wrapper are not wrapped, so servers that send them
+    with sendfile keep doing so; their size is taken from Content-Length.
+    """
+
+    ENDPOINT_KEY = 'nas.endpoint'
+
+    def __init__(self, wsgi_app, on_finish):
+        """
+        Args:
+            wsgi_app: Application to wrap
+            on_finish (callable): Called as on_finish(environ, status,
+                content_type, bytes_sent, seconds, send_seconds) once the
+                response has been sent or abandoned
+        """
+        self.wsgi_app = wsgi_app
+        self.on_finish = on_finish
+        self._wrapper_types = {}
+
+    def _file_wrapper_type(self, original):
+        wrapper_type = self._wrapper_types.get(original)
+        if wrapper_type is None:
+            class MeteredFileWrapper(original):
+                on_close = None
+
+                def close(self):
+                    try:
+                        super().close()
+                    finally:
+                        if self.on_close:
+                            self.on_close()
+
+            wrapper_type = self._wrapper_types[original] = MeteredFileWrapper
+        return wrapper_type
+
+    def __call__(self, environ, start_response):
+        started = time.perf_counter()
+        response = {'status': '500', 'content_type': None, 'content_length': None}
+
+        def metered_start_response(status, headers, exc_info=None):
+            response['status'] = status.split(' ', 1)[0]
+            for name, value in headers:
+                lowered = name.lower()
+                if lowered == 'content-type':
+                    response['content_type'] = value.split(';', 1)[0]
+                elif lowered == 'content-length':
+                    response['content_length'] = int(value)
+            return start_response(status, headers, exc_info)
+
+        wrapper_type = None
+        if isinstance(environ.get('wsgi.file_wrapper'), type):
+            wrapper_type = self._file_wrapper_type(environ['wsgi.file_wrapper'])
+            environ['wsgi.file_wrapper'] = wrapper_type
+
+        try:
+            iterable = self.wsgi_app(environ, metered_start_response)
+        except BaseException:
+            self.on_finish(environ, response['status'], None, 0, time.perf_counter() - started, 0.0)
+            raise
+
+        response_started = time.perf_counter()
+
+        def finish(bytes_sent):
+            now = time.perf_counter()
+            if bytes_sent is None:
+                bytes_sent = response['content_length'] or 0
+            self.on_finish(
+                environ, response['status'], response['content_type'],
+                bytes_sent, now - started, now - response_started
+            )
+
+        if wrapper_type is not None and isinstance(iterable, wrapper_type):
+            iterable.on_close = lambda: finish(None)
+            return iterable
+        return _MeteredIterable(iterable, finish)
+
+class _MeteredIterable:
+    """Response body that counts the bytes sent and reports when closed"""
+
+    def __init__(self, iterable, finish):
+        self.iterable = iterable
+        self.finish = finish
+        self.bytes_sent = 0
+
+    def __iter__(self):
+        for chunk in self.iterable:
+            self.bytes_sent += len(chunk)
+            yield chunk
+
+    def close(self):
+        try:
+            close = getattr(self.iterable, 'close', None)
+            if close:
+                close()
+        finally:
+            self.finish(self.bytes_sent)
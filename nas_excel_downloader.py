@@ -1,17 +1,43 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import io
 import os
+import atexit
+import re
+import base64
+import bisect
+import json
+import uuid
+import hashlib
 import sys
 import shutil
 import subprocess
-import zipfile
 import tempfile
 import logging
+import threading
+import multiprocessing
+import time
+import functools
 from pathlib import Path
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from flask import Flask, request, jsonify, send_file, abort
+from flask import Flask, request, jsonify, send_file, abort, Response, stream_with_context, url_for
 from werkzeug.exceptions import BadRequest
+from tree_walker import ParallelTreeWalker, ScanFilter, DEFAULT_SCAN_WORKERS
+from tree_index import WarmTreeIndex, find_mount
+from admission import AdmissionController, AdmissionRejected
+from zip_writer import ZipStreamWriter, CompressionPolicy, COMPRESSION_MODES, file_crc32
+from archive_jobs import ArchiveJobManager, JobQueueFull
+from metrics import MetricsRegistry, MetricsMiddleware
+from fast_copy import copy_file, write_checksum_manifest, format_checksum_manifest, CHECKSUM_MANIFEST_NAME
+from xlsx_reader import CellRange
+from workbook_index import WorkbookIndex
+from cell_search import CellSearchIndex
+from workbook_convert import (
+    WorkbookConverter, ConvertedTable, OUTPUT_FORMATS, MIMETYPES, FILE_EXTENSIONS, available_formats
+)
 
 # Configure logging
 logging.basicConfig(
@@ -22,6 +48,165 @@ logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
+# Process-local metrics served by /metrics in the Prometheus text format
+metrics = MetricsRegistry()
+REQUEST_SECONDS = metrics.histogram(
+    'nas_request_duration_seconds', 'Time from receiving a request until its response was sent',
+    ('endpoint', 'method', 'status')
+)
+STAGE_SECONDS = metrics.histogram(
+    'nas_stage_duration_seconds', 'Time spent in each stage of building and sending archives', ('stage',)
+)
+BYTES_READ = metrics.counter('nas_bytes_read_total', 'Bytes read from workbooks', ('stage',))
+BYTES_WRITTEN = metrics.counter('nas_bytes_written_total', 'Bytes written to staging, archives and responses', ('stage',))
+FILES_PROCESSED = metrics.counter('nas_files_total', 'Files found, copied and archived', ('stage',))
+FILES_SKIPPED = metrics.counter('nas_files_skipped_total', 'Files skipped because they could not be read', ('stage',))
+REQUESTS_IN_FLIGHT = metrics.gauge('nas_requests_in_flight', 'Requests being handled or sent', ('endpoint',))
+ERRORS = metrics.counter('nas_errors_total', 'Failed requests by exception type', ('endpoint', 'type'))
+TEMP_DISK_BYTES = metrics.gauge('nas_temp_disk_bytes', 'Disk space used by request workspaces and cached archives', ('area',))
+TEMP_DISK_FREE_BYTES = metrics.gauge('nas_temp_disk_free_bytes', 'Free space on the filesystem of the temporary directory')
+ADMISSION_WAIT_SECONDS = metrics.histogram(
+    'nas_admission_wait_seconds', 'Time heavy requests waited in the admission queue before running', ('endpoint',)
+)
+ADMISSION_ACTIVE = metrics.gauge('nas_admission_active', 'Heavy requests running', ('endpoint',))
+ADMISSION_WAITING = metrics.gauge('nas_admission_waiting', 'Heavy requests waiting in the admission queue', ('endpoint',))
+ADMISSION_REJECTED = metrics.counter(
+    'nas_admission_rejected_total', 'Heavy requests turned away by admission control', ('endpoint', 'reason')
+)
+WARM_INDEX_FILES = metrics.gauge('nas_warm_index_files', 'Files held in the warm tree index', ('root',))
+WARM_INDEX_FRESHNESS = metrics.gauge(
+    'nas_warm_index_freshness_seconds', 'Age of the least recently checked directory of a warm root', ('root',)
+)
+WARM_INDEX_RESCAN_SECONDS = metrics.gauge(
+    'nas_warm_index_rescan_seconds', 'Seconds spent listing directories of a warm root again since startup', ('root',)
+)
+
+# Read size used when hashing workbooks
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+# Buffer used when copying workbooks to staging with checksums enabled
+COPY_BUFFER_SIZE = int(os.getenv('NAS_COPY_BUFFER_SIZE', 8 * 1024 * 1024))
+
+# Add a SHA256SUMS entry with the hash of every workbook to archives,
+# computed while the workbooks are read
+ARCHIVE_CHECKSUMS = os.getenv('NAS_ARCHIVE_CHECKSUMS', '0').lower() not in ('0', 'false', 'no')
+
+# Default compression of archive entries ('auto', 'stored' or 'deflate'),
+# deflate level and number of threads compressing in parallel
+ZIP_COMPRESSION = os.getenv('NAS_ZIP_COMPRESSION', 'auto')
+ZIP_COMPRESSION_LEVEL = int(os.getenv('NAS_ZIP_COMPRESSION_LEVEL', 6))
+ZIP_COMPRESS_WORKERS = int(os.getenv('NAS_ZIP_COMPRESS_WORKERS', os.cpu_count() or 1))
+
+# Concurrency and depth limits of the directory walker (unset depth = unlimited)
+SCAN_WORKERS = int(os.getenv('NAS_SCAN_WORKERS', DEFAULT_SCAN_WORKERS))
+SCAN_MAX_DEPTH = int(os.environ['NAS_SCAN_MAX_DEPTH']) if os.getenv('NAS_SCAN_MAX_DEPTH') else None
+
+# Files returned when a request doesn't ask for other patterns or extensions
+DEFAULT_SCAN_PATTERNS = ("*.xlsx",)
+
+# Hot NAS paths kept in an in-memory tree index (separated like PATH
+# entries), how changes to them are noticed (auto, inotify or poll), and
+# the bounds in seconds of the adaptive interval each directory is polled at
+WARM_ROOTS = [root for root in os.getenv('NAS_WARM_ROOTS', '').split(os.pathsep) if root.strip()]
+WARM_WATCH_MODE = os.getenv('NAS_WARM_WATCH', 'auto')
+WARM_POLL_MIN = float(os.getenv('NAS_WARM_POLL_MIN', 2))
+WARM_POLL_MAX = float(os.getenv('NAS_WARM_POLL_MAX', 60))
+
+# Admission control of heavy endpoints: requests running at once per
+# endpoint (NAS_ADMISSION_LIMITS overrides entries, e.g.
+# "download-xlsx=4,convert-xlsx=1"; 0 = no limit), per share root and in
+# total, and how many may wait, for how many seconds, for a free slot
+DEFAULT_ADMISSION_LIMITS = {
+    'download-xlsx': 2,
+    'download-xlsx-delta': 2,
+    'download-xlsx-batch': 1,
+    'convert-xlsx': 2,
+    'workbook-index': 1,
+    'search-index': 1,
+    'jobs': 2
+}
+ADMISSION_LIMITS = {
+    **DEFAULT_ADMISSION_LIMITS,
+    **{
+        name.strip(): int(limit)
+        for name, _, limit in (item.partition('=') for item in os.getenv('NAS_ADMISSION_LIMITS', '').split(','))
+        if name.strip()
+    }
+}
+ADMISSION_ROOT_LIMIT = int(os.getenv('NAS_ADMISSION_ROOT_LIMIT', 2))
+ADMISSION_MAX_ACTIVE = int(os.getenv('NAS_ADMISSION_MAX_ACTIVE', 4))
+ADMISSION_QUEUE_SIZE = int(os.getenv('NAS_ADMISSION_QUEUE_SIZE', 8))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv('NAS_ADMISSION_QUEUE_TIMEOUT', 30))
+
+# Scan result cache: results younger than the TTL are reused as they are,
+# older ones are revalidated against directory mtimes until MAX_AGE
+SCAN_CACHE_ENTRIES = int(os.getenv('NAS_SCAN_CACHE_ENTRIES', 128))
+SCAN_CACHE_MAX_FILES = int(os.getenv('NAS_SCAN_CACHE_MAX_FILES', 1000000))
+SCAN_CACHE_TTL = float(os.getenv('NAS_SCAN_CACHE_TTL', 10))
+SCAN_CACHE_MAX_AGE = float(os.getenv('NAS_SCAN_CACHE_MAX_AGE', 300))
+
+# Also stat every cached file when revalidating, to catch files edited in
+# place; costs one round trip per file over SMB
+SCAN_CACHE_STAT_FILES = os.getenv('NAS_SCAN_CACHE_STAT_FILES', '0').lower() not in ('0', 'false', 'no')
+
+# On-disk cache of built archives, keyed by the fingerprint of their file set
+ARCHIVE_CACHE_DIR = os.getenv(
+    'NAS_ARCHIVE_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'nas_xlsx_archive_cache')
+)
+ARCHIVE_CACHE_MAX_BYTES = int(os.getenv('NAS_ARCHIVE_CACHE_MAX_BYTES', 5 * 1024 ** 3))
+
+# Archives used within this many seconds are never evicted, so interrupted
+# downloads can be resumed from GET /archives/<archive_id>
+ARCHIVE_RETENTION_SECONDS = float(os.getenv('NAS_ARCHIVE_RETENTION_SECONDS', 3600))
+
+# Archive ids are SHA-256 fingerprints
+ARCHIVE_ID_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+# Background archive jobs: concurrent builds, waiting jobs, and where job
+# state is shared between server processes
+JOB_WORKERS = int(os.getenv('NAS_JOB_WORKERS', 4))
+JOB_QUEUE_SIZE = int(os.getenv('NAS_JOB_QUEUE_SIZE', 32))
+JOB_STATE_DIR = os.getenv('NAS_JOB_STATE_DIR', os.path.join(ARCHIVE_CACHE_DIR, 'jobs'))
+JOB_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+# Bump when the archive layout changes so old cached archives are not reused
+ARCHIVE_FORMAT_VERSION = "3"
+
+# Name of the summary file added to delta archives
+DELTA_MANIFEST_NAME = "nas_xlsx_delta.json"
+
+# Batch downloads: most NAS paths per request, roots scanned at the same
+# time, and the per-root status file added to batch archives
+BATCH_MAX_PATHS = int(os.getenv('NAS_BATCH_MAX_PATHS', 100))
+BATCH_SCAN_ROOTS = int(os.getenv('NAS_BATCH_SCAN_ROOTS', 4))
+BATCH_MANIFEST_NAME = "nas_xlsx_batch.json"
+
+# Worker processes parsing workbooks for /convert-xlsx
+CONVERT_WORKERS = int(os.getenv('NAS_CONVERT_WORKERS', os.cpu_count() or 1))
+
+# SQLite index of workbook metadata, shared by server processes, and the
+# number of workbooks read at the same time while it is updated
+INDEX_PATH = os.getenv('NAS_INDEX_PATH', os.path.join(ARCHIVE_CACHE_DIR, 'workbook_index.sqlite'))
+INDEX_WORKERS = int(os.getenv('NAS_INDEX_WORKERS', 8))
+
+# Most workbooks returned by one index query
+INDEX_QUERY_MAX_LIMIT = 1000
+
+# Full-text index of cell text, and the NAS paths POST /search-index
+# updates when no path is given (separated like PATH entries)
+SEARCH_INDEX_PATH = os.getenv('NAS_SEARCH_INDEX_PATH', os.path.join(ARCHIVE_CACHE_DIR, 'cell_search.sqlite'))
+SEARCH_ROOTS = [root for root in os.getenv('NAS_SEARCH_ROOTS', '').split(os.pathsep) if root.strip()]
+
+# Most cells returned by one search
+SEARCH_MAX_LIMIT = 1000
+
+# WSGI environ key of a request's admission ticket
+ADMISSION_KEY = 'nas.admission'
+
+# Default allowed difference between client and server mtimes, in seconds,
+# to absorb timestamp rounding of SMB and FAT filesystems
+DELTA_MTIME_TOLERANCE = 1.0
+
 def parse_request_data(request):
     """
     Parse request data with robust handling for various formats
@@ -87,9 +272,555 @@ def parse_request_data(request):
         f"3) Ensure proper JSON structure. Raw data received: {request.data[:500]}"
     )
 
-class NASExcelDownloader:
+def file_info(entry):
+    """Describe a scanned file for the /list-xlsx response"""
+    return {
+        'filename': entry.path.name,
+        'relative_path': entry.relative_path,
+        'size': entry.size,
+        'modified_time': datetime.fromtimestamp(entry.mtime).isoformat()
+    }
+
+def encode_list_cursor(relative_path):
+    """Encode the last relative path of a page as an opaque cursor"""
+    return base64.urlsafe_b64encode(relative_path.encode('utf-8', 'surrogateescape')).decode('ascii')
+
+def decode_list_cursor(cursor):
+    """Decode a cursor returned by encode_list_cursor"""
+    try:
+        return base64.b64decode(cursor.encode('ascii'), altchars=b'-_', validate=True).decode('utf-8', 'surrogateescape')
+    except (AttributeError, ValueError) as e:
+        raise BadRequest(f"Invalid cursor: {str(e)}")
+
+def set_archive_location(response, archive_id):
+    """
+    Point the client at the retained copy of an archive, which can be
+    fetched again with GET and resumed with Range requests
+    """
+    response.headers['X-Archive-Id'] = archive_id
+    response.headers['Content-Location'] = url_for('get_archive', archive_id=archive_id)
+    return response
+
+def count_error(error):
+    """Count a failed request of the current endpoint by exception type"""
+    ERRORS.inc(endpoint=request.endpoint or 'unknown', type=type(error).__name__)
+
+def default_compression_policy():
+    """Return the compression policy configured for the server"""
+    return CompressionPolicy(ZIP_COMPRESSION, ZIP_COMPRESSION_LEVEL, ZIP_COMPRESS_WORKERS)
+
+def parse_compression_policy(data):
+    """
+    Read the compression policy of a download request
+
+    Args:
+        data (dict): Request payload with optional "compression" (auto,
+            stored or deflate) and "compression_level" (0-9)
+
+    Returns:
+        CompressionPolicy: Requested policy, server defaults for missing keys
+    """
+    mode = data.get('compression', ZIP_COMPRESSION)
+    if mode not in COMPRESSION_MODES:
+        raise BadRequest(f"compression must be one of: {', '.join(COMPRESSION_MODES)}")
+
+    try:
+        level = int(data.get('compression_level', ZIP_COMPRESSION_LEVEL))
+        return CompressionPolicy(mode, level, ZIP_COMPRESS_WORKERS)
+    except (TypeError, ValueError) as e:
+        raise BadRequest(f"Invalid compression_level: {str(e)}")
+
+def parse_filter_time(value, name):
+    """Read a timestamp given as epoch seconds or in ISO format"""
+    if isinstance(value, bool):
+        raise BadRequest(f"{name} must be epoch seconds or an ISO timestamp")
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return datetime.fromisoformat(str(value)).timestamp()
+    except ValueError:
+        raise BadRequest(f"{name} must be epoch seconds or an ISO timestamp")
+
+def parse_filter_list(data, name):
+    """Read a filter option given as a string or a list of strings"""
+    value = data.get(name) or []
+    if isinstance(value, str):
+        value = [value]
+    if not isinstance(value, list) or not all(isinstance(item, str) and item for item in value):
+        raise BadRequest(f"{name} must be a string or a list of strings")
+    return value
+
+def parse_scan_filter(data):
+    """
+    Read the file filter of a list or download request. Filters are
+    applied while the share is walked, so excluded directories are never
+    listed and filtered files are never copied.
+
+    Args:
+        data (dict): Request payload with any of "patterns" (globs),
+            "extensions" (such as ".xlsm"), "modified_since" and
+            "modified_before" (epoch seconds or ISO format), "min_size"
+            and "max_size" (bytes), "max_depth" (0 = top directory only)
+            and "exclude_dirs" (globs of directory names or relative paths)
+
+    Returns:
+        ScanFilter: Requested filter, or None when no option is given
+    """
+    patterns = parse_filter_list(data, 'patterns')
+    for extension in parse_filter_list(data, 'extensions'):
+        patterns.append('*' + (extension if extension.startswith('.') else '.' + extension))
+    exclude_dirs = [pattern.replace('\\', '/').strip('/') for pattern in parse_filter_list(data, 'exclude_dirs')]
+
+    limits = {}
+    for name in ('min_size', 'max_size', 'max_depth'):
+        value = data.get(name)
+        if value is None:
+            continue
+        if not isinstance(value, int) or isinstance(value, bool) or value < 0:
+            raise BadRequest(f"{name} must be a non-negative integer")
+        limits[name] = value
+
+    modified_after = parse_filter_time(data['modified_since'], 'modified_since') if data.get('modified_since') is not None else None
+    modified_before = parse_filter_time(data['modified_before'], 'modified_before') if data.get('modified_before') is not None else None
+
+    if not (patterns or exclude_dirs or limits or modified_after is not None or modified_before is not None):
+        return None
+
+    try:
+        return ScanFilter(
+            patterns or DEFAULT_SCAN_PATTERNS,
+            exclude_dirs=exclude_dirs,
+            modified_after=modified_after,
+            modified_before=modified_before,
+            **limits
+        )
+    except ValueError as e:
+        raise BadRequest(f"Invalid filter: {str(e)}")
+
+def parse_sheet_selectors(value):
+    """
+    Read the "sheets" option of a convert request
+
+    Returns:
+        list: Sheet names and 0-based positions, or None for all sheets
+    """
+    if value is None:
+        return None
+    if not isinstance(value, list):
+        value = [value]
+    for selector in value:
+        if isinstance(selector, bool) or not isinstance(selector, (str, int)) or selector == '':
+            raise BadRequest("sheets must be sheet names or 0-based sheet positions")
+    return value
+
+def parse_delta_manifest(manifest):
+    """
+    Validate the manifest of a delta download request
+
+    Args:
+        manifest (list): Entries with relative_path and any of size,
+            mtime (epoch seconds), modified_time (ISO format) and sha256
+
+    Returns:
+        dict: Entries keyed by relative path with '/' separators, each a
+            dict with 'size', 'mtime' and 'sha256' (None when not given)
+    """
+    if not isinstance(manifest, list):
+        raise BadRequest("manifest must be a list of file entries")
+
+    parsed = {}
+    for item in manifest:
+        if not isinstance(item, dict) or not item.get('relative_path'):
+            raise BadRequest("Every manifest entry needs a relative_path")
+
+        relative_path = str(item['relative_path']).replace('\\', '/').strip('/')
+        try:
+            size = int(item['size']) if item.get('size') is not None else None
+            if item.get('mtime') is not None:
+                mtime = float(item['mtime'])
+            elif item.get('modified_time'):
+                mtime = datetime.fromisoformat(item['modified_time']).timestamp()
+            else:
+                mtime = None
+        except (TypeError, ValueError) as e:
+            raise BadRequest(f"Invalid manifest entry for {relative_path}: {str(e)}")
+
+        sha256 = item.get('sha256')
+        if size is None and mtime is None and not sha256:
+            raise BadRequest(f"Manifest entry for {relative_path} needs size, mtime or sha256")
+
+        parsed[relative_path] = {
+            'size': size,
+            'mtime': mtime,
+            'sha256': sha256.lower() if sha256 else None
+        }
+
+    return parsed
+
+class RequestWorkspace:
+    """
+    Temporary files owned by a single download request.
+    Every workspace lives in its own mkdtemp directory, so concurrent
+    requests (threads or worker processes) never share staging files.
+    """
+
     def __init__(self):
-        self.temp_dir = None
+        self.root = tempfile.mkdtemp(prefix="nas_xlsx_")
+        self.staging_dir = os.path.join(self.root, "files")
+        self.archive_path = os.path.join(self.root, "nas_xlsx_files.zip")
+        self.skipped_files = []
+        # Bytes staged and archived in the workspace, reported by /metrics
+        self.bytes_used = 0
+        os.mkdir(self.staging_dir)
+
+    def cleanup(self):
+        """Remove the workspace directory and everything in it"""
+        if os.path.exists(self.root):
+            try:
+                shutil.rmtree(self.root)
+                logger.info(f"Cleaned up workspace: {self.root}")
+            except Exception as e:
+                logger.warning(f"Failed to cleanup workspace {self.root}: {str(e)}")
+
+class ProgressReader:
+    """Binary reader that reports the number of bytes read to a callback"""
+
+    def __init__(self, source, progress):
+        self._source = source
+        self._progress = progress
+
+    def read(self, size=-1):
+        data = self._source.read(size)
+        if data:
+            self._progress(bytes_read=len(data))
+        return data
+
+class HashingReader:
+    """Binary reader that feeds everything read into a hash object"""
+
+    def __init__(self, source, digest):
+        self._source = source
+        self._digest = digest
+
+    def read(self, size=-1):
+        data = self._source.read(size)
+        self._digest.update(data)
+        return data
+
+class ClosingFile(io.FileIO):
+    """
+    Read-only file that runs a callback once it is closed.
+    The WSGI server closes the file after the last byte is sent, which
+    makes it a reliable place to release per-request resources.
+    """
+
+    def __init__(self, path, on_close):
+        super().__init__(path, 'rb')
+        self._on_close = on_close
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            super().close()
+        finally:
+            self._on_close()
+
+class CachedScan:
+    """Scan result stored in the ScanCache"""
+
+    def __init__(self, files, directories):
+        self.files = files
+        self.directories = directories
+        self.created = time.monotonic()
+        self.validated = self.created
+
+class ScanCache:
+    """
+    In-process LRU cache of scan results keyed by normalized path.
+    Memory is bounded both by the number of cached scans and by the total
+    number of files they hold.
+    """
+
+    def __init__(self, max_entries=SCAN_CACHE_ENTRIES, max_files=SCAN_CACHE_MAX_FILES,
+                 ttl=SCAN_CACHE_TTL, max_age=SCAN_CACHE_MAX_AGE, stat_files=SCAN_CACHE_STAT_FILES):
+        self.max_entries = max_entries
+        self.stat_files = stat_files
+        self.max_files = max_files
+        self.ttl = ttl
+        self.max_age = max_age
+        self._entries = OrderedDict()
+        self._files = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.revalidations = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._files -= len(entry.files)
+        return entry
+
+    def get(self, key, walker):
+        """
+        Look up a scan result
+
+        Args:
+            key (str): Cache key
+            walker (ParallelTreeWalker): Walker used to revalidate results
+                older than the TTL
+
+        Returns:
+            list: Cached WalkEntry list, or None on a miss
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            now = time.monotonic()
+            if now - entry.validated <= self.ttl:
+                self.hits += 1
+                return entry.files
+            if now - entry.created > self.max_age:
+                self._remove(key)
+                self.misses += 1
+                return None
+
+        # Stale but not expired: reuse the result if no directory changed
+        # (and, when enabled, no file was edited in place)
+        if not walker.directories_changed(entry.directories) and not (
+                self.stat_files and walker.files_changed(entry.files)):
+            with self._lock:
+                entry.validated = time.monotonic()
+                self.revalidations += 1
+            logger.debug(f"Revalidated cached scan of {key}")
+            return entry.files
+
+        with self._lock:
+            if self._entries.get(key) is entry:
+                self._remove(key)
+            self.misses += 1
+        return None
+
+    def put(self, key, files, directories):
+        """Store a scan result, evicting least recently used ones as needed"""
+        if self.max_entries <= 0 or len(files) > self.max_files:
+            return
+
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = CachedScan(files, directories)
+            self._files += len(files)
+
+            while len(self._entries) > self.max_entries or self._files > self.max_files:
+                evicted_key, evicted = self._entries.popitem(last=False)
+                self._files -= len(evicted.files)
+                self.evictions += 1
+                logger.debug(f"Evicted cached scan of {evicted_key}")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._files = 0
+
+    def stats(self):
+        """Return cache counters"""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'files': self._files,
+                'max_entries': self.max_entries,
+                'max_files': self.max_files,
+                'ttl_seconds': self.ttl,
+                'max_age_seconds': self.max_age,
+                'stat_files': self.stat_files,
+                'hits': self.hits,
+                'revalidations': self.revalidations,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+class ArchiveCache:
+    """
+    Size-bounded on-disk cache of built zip archives keyed by fingerprint.
+    Archives are moved into place with an atomic rename, so several worker
+    processes can share one cache directory. The least recently used
+    archives are removed once the total size exceeds max_bytes, except
+    those used within the retention window, which may temporarily push
+    the cache over its limit.
+    """
+
+    def __init__(self, cache_dir=ARCHIVE_CACHE_DIR, max_bytes=ARCHIVE_CACHE_MAX_BYTES,
+                 retention=ARCHIVE_RETENTION_SECONDS):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.retention = retention
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def path_for(self, fingerprint):
+        return os.path.join(self.cache_dir, f"{fingerprint}.zip")
+
+    def get(self, fingerprint):
+        """
+        Look up a cached archive
+
+        Args:
+            fingerprint (str): Fingerprint of the file set
+
+        Returns:
+            str: Path of the cached archive, or None on a miss
+        """
+        if not self.enabled:
+            return None
+
+        archive_path = self.path_for(fingerprint)
+        try:
+            # The mtime doubles as last-access time for LRU eviction
+            os.utime(archive_path)
+        except OSError:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return archive_path
+
+    def create_temp_path(self):
+        """Return a unique path inside the cache directory to build an archive in"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        return os.path.join(self.cache_dir, f".{uuid.uuid4().hex}.tmp")
+
+    def store(self, fingerprint, archive_path):
+        """
+        Move a finished archive into the cache
+
+        Args:
+            fingerprint (str): Fingerprint of the file set
+            archive_path (str): Archive to move; it no longer exists afterwards
+
+        Returns:
+            str: Path of the cached archive
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        cached_path = self.path_for(fingerprint)
+        try:
+            os.replace(archive_path, cached_path)
+        except OSError:
+            # Different filesystem: copy next to the target, then rename
+            temp_path = self.create_temp_path()
+            shutil.move(archive_path, temp_path)
+            os.replace(temp_path, cached_path)
+
+        logger.info(f"Cached archive {fingerprint} ({os.path.getsize(cached_path)} bytes)")
+        self.evict(keep=cached_path)
+        return cached_path
+
+    def evict(self, keep=None):
+        """Remove least recently used archives until the cache fits in max_bytes"""
+        archives = []
+        total_size = 0
+        try:
+            with os.scandir(self.cache_dir) as entries:
+                for entry in entries:
+                    if not entry.name.endswith('.zip'):
+                        continue
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    archives.append((stat.st_mtime, stat.st_size, entry.path))
+                    total_size += stat.st_size
+        except FileNotFoundError:
+            return
+
+        archives.sort()
+        retained_since = time.time() - self.retention
+        for last_used, size, archive_path in archives:
+            if total_size <= self.max_bytes or last_used >= retained_since:
+                break
+            if archive_path == keep:
+                continue
+            try:
+                os.remove(archive_path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                # Still being sent on a platform that can't unlink open files
+                logger.warning(f"Failed to evict cached archive {archive_path}: {str(e)}")
+                continue
+            total_size -= size
+            self.evictions += 1
+            logger.info(f"Evicted cached archive: {archive_path}")
+
+    def size_bytes(self):
+        """Return the total size of the archives in the cache directory"""
+        total_size = 0
+        try:
+            with os.scandir(self.cache_dir) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_file():
+                            total_size += entry.stat().st_size
+                    except OSError:
+                        continue
+        except FileNotFoundError:
+            pass
+        return total_size
+
+    def stats(self):
+        """Return cache counters"""
+        return {
+            'cache_dir': self.cache_dir,
+            'max_bytes': self.max_bytes,
+            'retention_seconds': self.retention,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions
+        }
+
+class NASExcelDownloader:
+    def __init__(self, scan_workers=SCAN_WORKERS, scan_max_depth=SCAN_MAX_DEPTH):
+        self.walker = ParallelTreeWalker(
+            patterns=DEFAULT_SCAN_PATTERNS,
+            max_workers=scan_workers,
+            max_depth=scan_max_depth
+        )
+        self.scan_cache = ScanCache()
+        self.warm_index = WarmTreeIndex(
+            self.walker, self.root_key, WARM_WATCH_MODE, WARM_POLL_MIN, WARM_POLL_MAX
+        )
+        self.archive_cache = ArchiveCache()
+        self._workspaces = set()
+        self._workspaces_lock = threading.Lock()
+
+    def create_workspace(self):
+        """
+        Create a workspace for one request
+
+        Returns:
+            RequestWorkspace: New workspace, tracked until released
+        """
+        workspace = RequestWorkspace()
+        with self._workspaces_lock:
+            self._workspaces.add(workspace)
+        logger.debug(f"Created workspace: {workspace.root}")
+        return workspace
+
+    def release_workspace(self, workspace):
+        """Clean up a workspace and stop tracking it"""
+        with self._workspaces_lock:
+            self._workspaces.discard(workspace)
+        workspace.cleanup()
 
     def normalize_path(self, path_str):
         """
@@ -162,44 +893,167 @@ class NASExcelDownloader:
         
         return path_str
 
-    def find_xlsx_files(self, nas_path):
+    def find_xlsx_files(self, nas_path, scan_filter=None):
         """
         Find all xlsx files in the NAS path
         
         Args:
             nas_path (str): NAS path to search
+            scan_filter (ScanFilter): Files to find instead of all xlsx files
         
         Returns:
             list: List of xlsx file paths
         """
+        return [entry.path for entry in self.scan_xlsx_files(nas_path, scan_filter=scan_filter)]
+
+    def scan_cache_key(self, normalized_path, scan_filter):
+        """Cache key of a scan; filtered scans are cached apart from full ones"""
+        if scan_filter is None:
+            return normalized_path
+        return f"{normalized_path}\0{scan_filter.cache_key}"
+
+    def check_scan_root(self, normalized_path):
+        """
+        Make sure a normalized NAS path is an existing directory
+
+        Args:
+            normalized_path (str): Path returned by normalize_path
+
+        Returns:
+            Path: The directory to scan
+        """
+        nas_dir = Path(normalized_path)
+        
+        # Check if path exists
+        if not nas_dir.exists():
+            logger.error(f"Path does not exist: '{normalized_path}'")
+            # Try to provide more helpful error message
+            if normalized_path.startswith('\\\\'):
+                logger.error("This appears to be a UNC path. Ensure the network share is accessible.")
+            raise FileNotFoundError(f"Path does not exist: {normalized_path}")
+        
+        # Check if it's a directory
+        if not nas_dir.is_dir():
+            logger.error(f"Path is not a directory: '{normalized_path}'")
+            raise NotADirectoryError(f"Path is not a directory: {normalized_path}")
+
+        return nas_dir
+
+    def lookup_xlsx_files(self, normalized_path, scan_filter=None, fresh=False):
+        """
+        Answer a scan without walking the share: from the warm index, or
+        from a cached scan of the same path that is still valid
+
+        Args:
+            normalized_path (str): Path returned by normalize_path
+            scan_filter (ScanFilter): Files to find instead of all xlsx files
+            fresh (bool): Only answer from the warm index, which keeps up
+                with files edited in place, and not from the scan cache
+
+        Returns:
+            list: WalkEntry objects sorted by relative path (read-only), or
+                None when the share has to be walked
+        """
+        warm_files = self.warm_index.lookup(normalized_path, scan_filter)
+        if warm_files is not None:
+            logger.info(f"Using warm index of '{normalized_path}' ({len(warm_files)} xlsx files)")
+            return warm_files
+        if fresh:
+            return None
+
+        cached_files = self.scan_cache.get(self.scan_cache_key(normalized_path, scan_filter), self.walker)
+        if cached_files is not None:
+            logger.info(f"Using cached scan of '{normalized_path}' ({len(cached_files)} xlsx files)")
+        return cached_files
+
+    def iter_xlsx_files(self, nas_path, scan_filter=None, use_cache=True, fresh=False):
+        """
+        Yield xlsx files in the NAS path as soon as the walker finds them.
+        The path is validated before this returns, so errors about the
+        path itself are raised here rather than while iterating.
+        
+        Args:
+            nas_path (str): NAS path to search
+            scan_filter (ScanFilter): Files to find instead of all xlsx files
+            use_cache (bool): Answer from the warm index, or reuse a cached
+                scan of the same path if still valid
+            fresh (bool): Sizes and mtimes must be current, so skip the
+                scan cache (see lookup_xlsx_files)
+        
+        Returns:
+            iterator: WalkEntry objects, in no particular order
+        """
+        normalized_path = self.normalize_path(nas_path)
+        cache_key = self.scan_cache_key(normalized_path, scan_filter)
+
+        if use_cache:
+            cached_files = self.lookup_xlsx_files(normalized_path, scan_filter, fresh)
+            if cached_files is not None:
+                return iter(cached_files)
+
+        nas_dir = self.check_scan_root(normalized_path)
+        logger.info(f"Streaming xlsx files found in: '{normalized_path}'")
+
+        def generate():
+            directories = {}
+            xlsx_files = []
+            started = time.perf_counter()
+            for entry in self.walker.iter_files(nas_dir, directories, scan_filter):
+                xlsx_files.append(entry)
+                yield entry
+
+            # Only a complete walk is worth caching (or measuring)
+            STAGE_SECONDS.observe(time.perf_counter() - started, stage='scan')
+            FILES_PROCESSED.inc(len(xlsx_files), stage='scan')
+            xlsx_files.sort(key=lambda entry: entry.relative_path)
+            logger.info(f"Found {len(xlsx_files)} xlsx files in {normalized_path}")
+            self.scan_cache.put(cache_key, xlsx_files, directories)
+
+        return generate()
+
+    def scan_xlsx_files(self, nas_path, use_cache=True, scan_filter=None, fresh=False):
+        """
+        Find all xlsx files in the NAS path together with the size and
+        modification time collected during the walk
+        
+        Args:
+            nas_path (str): NAS path to search
+            use_cache (bool): Answer from the warm index, or reuse a cached
+                scan of the same path if still valid
+            scan_filter (ScanFilter): Files to find instead of all xlsx files
+            fresh (bool): Sizes and mtimes must be current, so skip the
+                scan cache (see lookup_xlsx_files)
+        
+        Returns:
+            list: List of WalkEntry objects sorted by relative path; treat as
+                read-only since it may be shared with the scan cache
+        """
         xlsx_files = []
         try:
             # Normalize the path first
             normalized_path = self.normalize_path(nas_path)
+            cache_key = self.scan_cache_key(normalized_path, scan_filter)
+
+            if use_cache:
+                cached_files = self.lookup_xlsx_files(normalized_path, scan_filter, fresh)
+                if cached_files is not None:
+                    return cached_files
+
             logger.info(f"Searching for xlsx files in: '{normalized_path}'")
             
-            nas_dir = Path(normalized_path)
-            
-            # Check if path exists
-            if not nas_dir.exists():
-                logger.error(f"Path does not exist: '{normalized_path}'")
-                # Try to provide more helpful error message
-                if normalized_path.startswith('\\\\'):
-                    logger.error("This appears to be a UNC path. Ensure the network share is accessible.")
-                raise FileNotFoundError(f"Path does not exist: {normalized_path}")
+            nas_dir = self.check_scan_root(normalized_path)
             
-            # Check if it's a directory
-            if not nas_dir.is_dir():
-                logger.error(f"Path is not a directory: '{normalized_path}'")
-                raise NotADirectoryError(f"Path is not a directory: {normalized_path}")
-            
-            # Find all .xlsx files recursively
-            xlsx_files = list(nas_dir.rglob("*.xlsx"))
+            # Find all .xlsx files recursively, listing directories in parallel
+            directories = {}
+            with STAGE_SECONDS.time(stage='scan'):
+                xlsx_files = self.walker.walk(nas_dir, directories, scan_filter)
+            FILES_PROCESSED.inc(len(xlsx_files), stage='scan')
             logger.info(f"Found {len(xlsx_files)} xlsx files in {normalized_path}")
+            self.scan_cache.put(cache_key, xlsx_files, directories)
             
             # Log first few files for debugging
             if xlsx_files:
-                logger.debug(f"First few files found: {[str(f) for f in xlsx_files[:3]]}")
+                logger.debug(f"First few files found: {[str(f.path) for f in xlsx_files[:3]]}")
             
         except Exception as e:
             logger.error(f"Error finding xlsx files: {str(e)}")
@@ -208,27 +1062,29 @@ class NASExcelDownloader:
             
         return xlsx_files
 
-    def copy_xlsx_files(self, xlsx_files, nas_path):
+    def copy_xlsx_files(self, xlsx_files, nas_path, workspace):
         """
-        Copy xlsx files to temporary directory
+        Copy xlsx files to the staging directory of a workspace
         
         Args:
             xlsx_files (list): List of xlsx file paths
             nas_path (str): Original NAS path
+            workspace (RequestWorkspace): Workspace of the current request
         
         Returns:
-            str: Path to temporary directory containing copied files
+            str: Path to staging directory containing copied files
         """
         try:
-            # Create temporary directory
-            self.temp_dir = tempfile.mkdtemp(prefix="nas_xlsx_")
-            temp_path = Path(self.temp_dir)
+            temp_path = Path(workspace.staging_dir)
             
             # Normalize the NAS path for consistent comparison
             normalized_nas_path = self.normalize_path(nas_path)
             nas_base = Path(normalized_nas_path)
             
             files_copied = 0
+            bytes_copied = 0
+            checksums = {}
+            started = time.perf_counter()
             
             for xlsx_file in xlsx_files:
                 try:
@@ -239,146 +1095,1750 @@ class NASExcelDownloader:
                     # Create parent directory for target file
                     target_file.parent.mkdir(parents=True, exist_ok=True)
                     
-                    # Copy file
-                    shutil.copy2(xlsx_file, target_file)
-                    logger.debug(f"Copied: {relative_path}")
+                    # Copy file, hashing it on the way when checksums are enabled
+                    result = copy_file(xlsx_file, target_file, COPY_BUFFER_SIZE, ARCHIVE_CHECKSUMS)
+                    logger.debug(f"Copied: {relative_path} ({result.method})")
                     files_copied += 1
+                    bytes_copied += result.bytes_copied
+                    workspace.bytes_used += result.bytes_copied
+                    if result.sha256:
+                        checksums[relative_path.as_posix()] = result.sha256
                     
                 except Exception as e:
                     logger.warning(f"Failed to copy {xlsx_file}: {str(e)}")
+                    workspace.skipped_files.append(xlsx_file)
+                    FILES_SKIPPED.inc(stage='copy')
                     continue
             
-            logger.info(f"Successfully copied {files_copied} xlsx files to {self.temp_dir}")
-            return self.temp_dir
+            if ARCHIVE_CHECKSUMS:
+                write_checksum_manifest(os.path.join(workspace.staging_dir, CHECKSUM_MANIFEST_NAME), checksums)
+            
+            STAGE_SECONDS.observe(time.perf_counter() - started, stage='copy')
+            FILES_PROCESSED.inc(files_copied, stage='copy')
+            BYTES_READ.inc(bytes_copied, stage='copy')
+            BYTES_WRITTEN.inc(bytes_copied, stage='copy')
+            logger.info(f"Successfully copied {files_copied} xlsx files to {workspace.staging_dir}")
+            return workspace.staging_dir
             
         except Exception as e:
             logger.error(f"Error copying xlsx files: {str(e)}")
-            self.cleanup_temp_dir()
             raise
 
-    def create_zip_archive(self, temp_dir):
+    def create_zip_archive(self, temp_dir, zip_path=None, policy=None, stats=None):
         """
         Create zip archive from temporary directory
         
         Args:
             temp_dir (str): Path to temporary directory
+            zip_path (str): Where to write the archive; a uniquely named
+                temporary file is created when omitted
+            policy (CompressionPolicy): How entries are compressed
+            stats (dict): When given, updated with compression statistics
         
         Returns:
             str: Path to zip archive
         """
         try:
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            zip_path = os.path.join(tempfile.gettempdir(), f"nas_xlsx_files_{timestamp}.zip")
+            if zip_path is None:
+                fd, zip_path = tempfile.mkstemp(prefix="nas_xlsx_files_", suffix=".zip")
+                os.close(fd)
+            
+            writer = ZipStreamWriter(policy or default_compression_policy())
+            started = time.perf_counter()
+            try:
+                with open(zip_path, 'wb') as zipf:
+                    temp_path = Path(temp_dir)
+                    
+                    for file_path in sorted(temp_path.rglob("*")):
+                        if file_path.is_file():
+                            # Calculate relative path for archive
+                            arcname = file_path.relative_to(temp_path).as_posix()
+                            with open(file_path, 'rb') as source:
+                                mtime = os.fstat(source.fileno()).st_mtime
+                                measure = functools.partial(file_crc32, file_path)
+                                for data in writer.add_file(arcname, source, mtime, measure):
+                                    zipf.write(data)
+                            logger.debug(f"Added to zip: {arcname}")
+                    
+                    for data in writer.close():
+                        zipf.write(data)
+            finally:
+                writer.shutdown()
             
-            with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                temp_path = Path(temp_dir)
-                
-                for file_path in temp_path.rglob("*"):
-                    if file_path.is_file():
-                        # Calculate relative path for archive
-                        arcname = file_path.relative_to(temp_path)
-                        zipf.write(file_path, arcname)
-                        logger.debug(f"Added to zip: {arcname}")
+            seconds = time.perf_counter() - started
+            archive_stats = writer.stats()
+            archive_stats['seconds'] = round(seconds, 3)
+            if stats is not None:
+                stats.update(archive_stats)
             
-            logger.info(f"Created zip archive: {zip_path}")
+            STAGE_SECONDS.observe(seconds, stage='zip')
+            FILES_PROCESSED.inc(len(writer.entries), stage='zip')
+            BYTES_READ.inc(writer.bytes_in, stage='zip')
+            BYTES_WRITTEN.inc(writer.offset, stage='zip')
+            logger.info(f"Created zip archive: {zip_path} {archive_stats}")
             return zip_path
             
         except Exception as e:
             logger.error(f"Error creating zip archive: {str(e)}")
             raise
 
-    def cleanup_temp_dir(self):
-        """Clean up temporary directory"""
-        if self.temp_dir and os.path.exists(self.temp_dir):
-            try:
-                shutil.rmtree(self.temp_dir)
-                logger.info(f"Cleaned up temporary directory: {self.temp_dir}")
-            except Exception as e:
-                logger.warning(f"Failed to cleanup temp directory: {str(e)}")
-            finally:
-                self.temp_dir = None
+    def fingerprint_files(self, xlsx_files, policy=None):
+        """
+        Fingerprint a set of scanned files by relative path, size and mtime.
+        Equal fingerprints mean an identical archive would be built.
 
-    def cleanup_all(self):
-        """Clean up all resources"""
-        # Clean up temporary directory
-        self.cleanup_temp_dir()
+        Args:
+            xlsx_files (list): List of WalkEntry objects
+            policy (CompressionPolicy): Compression the archive is built with
 
-# Global instance
-downloader = NASExcelDownloader()
+        Returns:
+            str: Hex digest identifying the file set
+        """
+        policy = policy or default_compression_policy()
+        digest = hashlib.sha256(
+            f"nas-xlsx-archive-v{ARCHIVE_FORMAT_VERSION}:{policy.cache_key}:checksums={ARCHIVE_CHECKSUMS}\n".encode()
+        )
+        for entry in sorted(xlsx_files, key=lambda entry: entry.relative_path):
+            relative_path = entry.relative_path.replace(os.sep, '/')
+            digest.update(f"{relative_path}\0{entry.size}\0{entry.mtime!r}\n".encode('utf-8', 'surrogateescape'))
+        return digest.hexdigest()
 
-@app.route('/health', methods=['GET'])
-def health_check():
-    """Health check endpoint"""
-    return jsonify({
-        'status': 'healthy',
-        'timestamp': datetime.now().isoformat(),
-        'service': 'NAS Excel Downloader'
-    })
+    def file_sha256(self, file_path, chunk_size=STREAM_CHUNK_SIZE):
+        """Return the SHA-256 hex digest of a file"""
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                digest.update(chunk)
+        return digest.hexdigest()
 
-@app.route('/test-json', methods=['POST'])
-def test_json():
-    """Test JSON parsing endpoint for debugging"""
-    try:
-        data = parse_request_data(request)
-        return jsonify({
-            'success': True,
-            'message': 'JSON parsed successfully',
-            'received_data': data,
-            'timestamp': datetime.now().isoformat()
-        })
-    except Exception as e:
-        return jsonify({
+    def compute_delta(self, xlsx_files, manifest, mtime_tolerance=DELTA_MTIME_TOLERANCE):
+        """
+        Compare scanned files against a client manifest
+
+        A file is unchanged when every attribute the client sent matches:
+        size exactly, mtime within the tolerance, and SHA-256 content hash.
+        Hashes are only computed for files whose size still matches.
+
+        Args:
+            xlsx_files (list): List of WalkEntry objects
+            manifest (dict): Entries returned by parse_delta_manifest
+            mtime_tolerance (float): Allowed mtime difference in seconds
+
+        Returns:
+            tuple: (list of new or modified WalkEntry objects,
+                sorted list of relative paths deleted since the manifest)
+        """
+        changed = []
+        to_hash = []
+        seen = set()
+
+        for entry in xlsx_files:
+            relative_path = entry.relative_path.replace(os.sep, '/')
+            seen.add(relative_path)
+            known = manifest.get(relative_path)
+
+            if known is None:
+                changed.append(entry)
+            elif known['size'] is not None and known['size'] != entry.size:
+                changed.append(entry)
+            elif known['mtime'] is not None and abs(known['mtime'] - entry.mtime) > mtime_tolerance:
+                changed.append(entry)
+            elif known['sha256']:
+                to_hash.append((entry, known['sha256']))
+
+        # Hashing reads whole files, so overlap the reads on the walker's pool size
+        if to_hash:
+            def differs(item):
+                entry, sha256 = item
+                try:
+                    return self.file_sha256(entry.path) != sha256
+                except OSError as e:
+                    logger.warning(f"Failed to hash {entry.path}: {str(e)}")
+                    return True
+
+            with ThreadPoolExecutor(max_workers=self.walker.max_workers) as pool:
+                for (entry, _), is_changed in zip(to_hash, pool.map(differs, to_hash)):
+                    if is_changed:
+                        changed.append(entry)
+
+        changed.sort(key=lambda entry: entry.relative_path)
+        deleted = sorted(path for path in manifest if path not in seen)
+        return changed, deleted
+
+    def root_key(self, normalized_path):
+        """
+        Comparable form of a normalized path: '/' separated, and case
+        folded for UNC paths since SMB shares are case-insensitive
+        """
+        key = os.path.normcase(normalized_path)
+        if normalized_path.startswith('\\\\'):
+            key = key.casefold()
+        return key.replace('\\', '/')
+
+    def share_root(self, normalized_path):
+        """
+        Comparable form of the share a normalized path is on: \\\\server\\share
+        for UNC paths, otherwise the mount point (or drive) holding it
+        """
+        if normalized_path.startswith('\\\\'):
+            server_and_share = normalized_path[2:].split('\\')[:2]
+            return self.root_key('\\\\' + '\\'.join(server_and_share))
+        mount_point, _ = find_mount(normalized_path)
+        if mount_point is None:
+            mount_point = os.path.splitdrive(os.path.abspath(normalized_path))[0] or os.sep
+        return self.root_key(mount_point)
+
+    def plan_batch(self, nas_paths, scan_filter=None):
+        """
+        Normalize the roots of a batch request and drop the ones whose
+        files another root already includes
+
+        Args:
+            nas_paths (list): NAS paths as sent by the client
+            scan_filter (ScanFilter): Filter the roots will be scanned with;
+                nested roots are only folded into their parent when the
+                filter can't leave out the folders between them
+
+        Returns:
+            list: One status dict per requested path, in request order;
+                roots to scan have status 'pending'
+        """
+        roots = []
+        for nas_path in nas_paths:
+            root = {'nas_path': nas_path}
+            try:
+                root['normalized_path'] = self.normalize_path(nas_path)
+                root['status'] = 'pending'
+            except ValueError as e:
+                root.update(status='error', message=str(e))
+            roots.append(root)
+
+        self.fold_batch_roots([root for root in roots if root['status'] == 'pending'], scan_filter)
+        return roots
+
+    def fold_batch_roots(self, candidates, scan_filter=None):
+        """
+        Mark roots that repeat, or lie below, another of the candidates as
+        'duplicate' or 'covered' by it; the others stay 'pending'
+
+        Args:
+            candidates (list): Pending root dicts of a batch plan, updated in place
+            scan_filter (ScanFilter): See plan_batch
+        """
+        # Parents sort before their subfolders, so each root only needs
+        # checking against the roots kept before it
+        pending = sorted(candidates, key=lambda root: self.root_key(root['normalized_path']))
+        foldable = scan_filter is None or (scan_filter.max_depth is None and not scan_filter.exclude_dirs)
+        kept = []
+        for root in pending:
+            key = self.root_key(root['normalized_path'])
+            for parent in kept:
+                parent_key = self.root_key(parent['normalized_path'])
+                if key == parent_key:
+                    root.update(status='duplicate', covered_by=parent['nas_path'])
+                    break
+                if foldable and key.startswith(parent_key.rstrip('/') + '/'):
+                    root.update(status='covered', covered_by=parent['nas_path'])
+                    break
+            else:
+                kept.append(root)
+
+    def scan_batch(self, roots, scan_filter=None):
+        """
+        Scan the pending roots of a batch plan concurrently. A root that
+        can't be scanned gets an error status instead of failing the batch,
+        and the roots it covered are scanned on their own instead, while
+        its duplicates share its status. Scanned roots get the archive
+        folder ('prefix') their files go under, named after the last
+        component of their path.
+
+        Args:
+            roots (list): Plan returned by plan_batch, updated in place
+            scan_filter (ScanFilter): Files to find instead of all xlsx files
+
+        Returns:
+            list: (WalkEntry, archive name) pairs of every root, sorted by
+                archive name
+        """
+        def scan(root):
+            try:
+                entries = self.scan_xlsx_files(root['normalized_path'], scan_filter=scan_filter)
+            except FileNotFoundError as e:
+                root.update(status='not_found', message=str(e))
+            except PermissionError as e:
+                root.update(status='permission_denied', message=str(e))
+            except (NotADirectoryError, OSError, ValueError) as e:
+                root.update(status='error', message=str(e))
+            else:
+                root.update(status='ok', files_found=len(entries))
+                return entries
+            return []
+
+        scanned = []
+        pending = [root for root in roots if root['status'] == 'pending']
+        while pending:
+            with ThreadPoolExecutor(max_workers=min(BATCH_SCAN_ROOTS, len(pending)),
+                                    thread_name_prefix="batch-scan") as pool:
+                scanned.extend(zip(pending, pool.map(scan, pending)))
+
+            # Roots folded into a parent that failed contributed nothing yet
+            failed = {root['nas_path']: root for root in pending if root['status'] != 'ok'}
+            orphans = []
+            for root in roots:
+                parent = failed.get(root.get('covered_by'))
+                if parent is None:
+                    continue
+                del root['covered_by']
+                if root['status'] == 'duplicate':
+                    root.update(status=parent['status'], message=parent['message'])
+                else:
+                    root['status'] = 'pending'
+                    orphans.append(root)
+            self.fold_batch_roots(orphans, scan_filter)
+            pending = [root for root in orphans if root['status'] == 'pending']
+
+        files = []
+        prefixes = set()
+        for root, entries in scanned:
+            if root['status'] != 'ok':
+                continue
+            name = re.split(r'[\\/]', root['normalized_path'])[-1].replace(':', '') or 'root'
+            prefix, number = name, 1
+            while prefix.casefold() in prefixes:
+                number += 1
+                prefix = f"{name}_{number}"
+            prefixes.add(prefix.casefold())
+            root['prefix'] = prefix
+            files.extend((entry, f"{prefix}/{entry.relative_path.replace(os.sep, '/')}") for entry in entries)
+
+        files.sort(key=lambda item: item[1])
+        return files
+
+    def stream_zip_archive(self, xlsx_files, nas_path, policy=None, skipped=None,
+                           extra_entries=None, stats=None, progress=None, names=None):
+        """
+        Build a zip archive of the xlsx files and yield it chunk by chunk,
+        reading each workbook straight from the NAS without a staging copy
+
+        Args:
+            xlsx_files (list): List of xlsx file paths
+            nas_path (str): Original NAS path, only used for logging when
+                names are given
+            policy (CompressionPolicy): How entries are compressed
+            skipped (list): When given, unreadable files are appended to it
+            extra_entries (dict): Additional in-memory entries (name -> bytes)
+                written after the workbooks
+            stats (dict): When given, updated with compression statistics
+                once the archive is complete
+            progress (callable): When given, called with bytes_read=<n> as
+                workbooks are read and files_done=1 after each workbook;
+                an exception raised by it aborts the archive
+            names (list): Archive names ('/' separated) of the xlsx files,
+                instead of their paths relative to nas_path
+
+        Yields:
+            bytes: Next piece of the zip archive
+        """
+        if names is None:
+            nas_base = Path(self.normalize_path(nas_path))
+            names = [xlsx_file.relative_to(nas_base).as_posix() for xlsx_file in xlsx_files]
+        writer = ZipStreamWriter(policy or default_compression_policy())
+        started = time.perf_counter()
+        waited = 0.0
+        files_added = 0
+        checksums = {}
+
+        def build():
+            nonlocal files_added
+            for xlsx_file, name in zip(xlsx_files, names):
+                # Open the source before starting the entry so an unreadable
+                # file is skipped instead of leaving a half-written entry
+                try:
+                    source = open(xlsx_file, 'rb')
+                    mtime = os.fstat(source.fileno()).st_mtime
+                except OSError as e:
+                    logger.warning(f"Failed to read {xlsx_file}: {str(e)}")
+                    FILES_SKIPPED.inc(stage='zip')
+                    if skipped is not None:
+                        skipped.append(xlsx_file)
+                    continue
+
+                with source:
+                    reader = ProgressReader(source, progress) if progress else source
+                    if ARCHIVE_CHECKSUMS:
+                        digest = hashlib.sha256()
+                        reader = HashingReader(reader, digest)
+                    # Stored entries get their CRC from a separate read, as
+                    # the reader can only be consumed once
+                    measure = functools.partial(file_crc32, xlsx_file)
+                    yield from writer.add_file(name, reader, mtime, measure)
+                if ARCHIVE_CHECKSUMS:
+                    checksums[name] = digest.hexdigest()
+
+                logger.debug(f"Streamed to zip: {name}")
+                files_added += 1
+                if progress:
+                    progress(files_done=1)
+
+            if ARCHIVE_CHECKSUMS:
+                yield from writer.add_bytes(CHECKSUM_MANIFEST_NAME, format_checksum_manifest(checksums).encode('utf-8'))
+
+            for name, content in (extra_entries or {}).items():
+                yield from writer.add_bytes(name, content.encode('utf-8') if isinstance(content, str) else content)
+
+            # Closing the archive writes the central directory
+            yield from writer.close()
+
+        try:
+            for chunk in build():
+                # Time spent waiting for the consumer (usually the network)
+                # is not part of the zip stage
+                suspended = time.perf_counter()
+                yield chunk
+                waited += time.perf_counter() - suspended
+        finally:
+            writer.shutdown()
+
+        seconds = time.perf_counter() - started
+        archive_stats = writer.stats()
+        archive_stats['seconds'] = round(seconds, 3)
+        if stats is not None:
+            stats.update(archive_stats)
+
+        STAGE_SECONDS.observe(seconds - waited, stage='zip')
+        FILES_PROCESSED.inc(files_added, stage='zip')
+        BYTES_READ.inc(writer.bytes_in, stage='zip')
+        BYTES_WRITTEN.inc(writer.offset, stage='zip')
+        logger.info(
+            f"Streamed {files_added} xlsx files ({writer.offset} bytes) from {nas_path}: "
+            f"{archive_stats}"
+        )
+
+    def build_archive(self, xlsx_files, nas_path, fingerprint, policy=None, progress=None):
+        """
+        Build an archive straight into the archive cache
+
+        An archive missing unreadable files is not stored under the
+        fingerprint, since it doesn't match the file set; it gets a random
+        id instead so it can still be downloaded.
+
+        Args:
+            xlsx_files (list): List of xlsx file paths
+            nas_path (str): Original NAS path
+            fingerprint (str): Fingerprint of the file set
+            policy (CompressionPolicy): How entries are compressed
+            progress (callable): Progress callback, see stream_zip_archive
+
+        Returns:
+            tuple: (archive id, path of the archive in the cache, list of skipped files)
+        """
+        temp_path = self.archive_cache.create_temp_path()
+        skipped = []
+        try:
+            with open(temp_path, 'wb') as f:
+                for chunk in self.stream_zip_archive(xlsx_files, nas_path, policy,
+                                                     skipped=skipped, progress=progress):
+                    f.write(chunk)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+        archive_id = fingerprint if not skipped else uuid.uuid4().hex + uuid.uuid4().hex
+        return archive_id, self.archive_cache.store(archive_id, temp_path), skipped
+
+    def workspace_bytes(self):
+        """Return the disk space used by workspaces of requests in flight"""
+        with self._workspaces_lock:
+            return sum(workspace.bytes_used for workspace in self._workspaces)
+
+    def cleanup_all(self):
+        """Clean up all resources"""
+        # Clean up workspaces of requests that are still in flight
+        with self._workspaces_lock:
+            workspaces = list(self._workspaces)
+            self._workspaces.clear()
+        for workspace in workspaces:
+            workspace.cleanup()
+
+# Global instance
+downloader = NASExcelDownloader()
+workbook_converter = WorkbookConverter(CONVERT_WORKERS)
+workbook_index = WorkbookIndex(INDEX_PATH, INDEX_WORKERS)
+cell_search_index = CellSearchIndex(SEARCH_INDEX_PATH, workbook_converter)
+# Converter workers re-import this module when it is run as a script;
+# only the serving process watches the warm roots
+if multiprocessing.parent_process() is None:
+    downloader.warm_index.start([downloader.normalize_path(root) for root in WARM_ROOTS])
+admission = AdmissionController(
+    ADMISSION_LIMITS,
+    root_limit=ADMISSION_ROOT_LIMIT,
+    max_active=ADMISSION_MAX_ACTIVE,
+    queue_size=ADMISSION_QUEUE_SIZE,
+    queue_timeout=ADMISSION_QUEUE_TIMEOUT
+)
+
+def admit_request(endpoint, nas_paths):
+    """
+    Wait for a slot to run a heavy request (see AdmissionController).
+    The slot is held until the response has been sent, or until the
+    returned ticket is released.
+
+    Args:
+        endpoint (str): Name the endpoint's limit is configured under
+        nas_paths (list): NAS paths the request reads
+
+    Returns:
+        AdmissionTicket: Granted ticket
+
+    Raises:
+        AdmissionRejected: The request has to be retried later
+    """
+    roots = [downloader.share_root(downloader.normalize_path(path)) for path in nas_paths]
+    try:
+        ticket = admission.acquire(endpoint, roots)
+    except AdmissionRejected as e:
+        ADMISSION_REJECTED.inc(endpoint=endpoint, reason=e.reason)
+        raise
+    ADMISSION_WAIT_SECONDS.observe(ticket.wait_seconds, endpoint=endpoint)
+    request.environ[ADMISSION_KEY] = ticket
+    return ticket
+
+def admit_job(nas_path, check):
+    """
+    Wait for a slot to build the archive of a background job. Jobs are
+    bounded by their own worker pool, so they wait for as long as it
+    takes instead of being rejected.
+
+    Args:
+        nas_path (str): NAS path the job archives
+        check (callable): Raises once the job has been cancelled
+
+    Returns:
+        AdmissionTicket: Granted ticket, to be released by the job
+    """
+    roots = [downloader.share_root(downloader.normalize_path(nas_path))]
+    ticket = admission.acquire('jobs', roots, background=True, check=check)
+    ADMISSION_WAIT_SECONDS.observe(ticket.wait_seconds, endpoint='jobs')
+    return ticket
+
+job_manager = ArchiveJobManager(
+    downloader,
+    max_workers=JOB_WORKERS,
+    queue_size=JOB_QUEUE_SIZE,
+    state_dir=JOB_STATE_DIR,
+    retention=ARCHIVE_RETENTION_SECONDS,
+    admit=admit_job
+)
+
+def rejection_response(error):
+    """429 (queue full) or 503 (wait timed out) response for AdmissionRejected"""
+    response = jsonify({
+        'error': 'Too Many Requests' if error.status_code == 429 else 'Service Unavailable',
+        'message': str(error),
+        'retry_after': error.retry_after
+    })
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response, error.status_code
+
+def refresh_workbook_index(nas_path, scan_filter=None):
+    """
+    Scan a NAS path and update its entries in the workbook index
+
+    Returns:
+        dict: Update statistics of WorkbookIndex.update
+    """
+    normalized_path = downloader.normalize_path(nas_path)
+    # A cached scan is reused unchecked within its TTL; a fresh walk makes
+    # the size/mtime check reliable
+    scanned_files = downloader.scan_xlsx_files(nas_path, use_cache=False, scan_filter=scan_filter)
+    with STAGE_SECONDS.time(stage='index'):
+        stats = workbook_index.update(normalized_path, scanned_files)
+    FILES_PROCESSED.inc(stats['indexed'], stage='index')
+    FILES_SKIPPED.inc(stats['failed'], stage='index')
+    return stats
+
+def refresh_search_index(nas_path, scan_filter=None):
+    """
+    Scan a NAS path and update its entries in the cell search index
+
+    Returns:
+        dict: Update statistics of CellSearchIndex.update
+    """
+    normalized_path = downloader.normalize_path(nas_path)
+    # Like the metadata index, rely on fresh sizes and mtimes
+    scanned_files = downloader.scan_xlsx_files(nas_path, use_cache=False, scan_filter=scan_filter)
+    with STAGE_SECONDS.time(stage='search_index'):
+        stats = cell_search_index.update(normalized_path, scanned_files)
+    FILES_PROCESSED.inc(stats['indexed'], stage='search_index')
+    FILES_SKIPPED.inc(stats['failed'], stage='search_index')
+    return stats
+
+def collect_disk_usage():
+    """Sample temporary disk usage when /metrics is scraped"""
+    TEMP_DISK_BYTES.set(downloader.workspace_bytes(), area='workspaces')
+    TEMP_DISK_BYTES.set(downloader.archive_cache.size_bytes(), area='archive_cache')
+    TEMP_DISK_BYTES.set(os.path.getsize(INDEX_PATH) if os.path.exists(INDEX_PATH) else 0, area='workbook_index')
+    TEMP_DISK_BYTES.set(
+        os.path.getsize(SEARCH_INDEX_PATH) if os.path.exists(SEARCH_INDEX_PATH) else 0, area='search_index'
+    )
+    try:
+        TEMP_DISK_FREE_BYTES.set(shutil.disk_usage(tempfile.gettempdir()).free)
+    except OSError as e:
+        logger.warning(f"Failed to read temporary disk usage: {str(e)}")
+
+def collect_warm_index():
+    """Sample the size, freshness and rescan cost of warm roots when /metrics is scraped"""
+    for root in downloader.warm_index.stats()['roots']:
+        WARM_INDEX_FILES.set(root['files'], root=root['nas_path'])
+        WARM_INDEX_FRESHNESS.set(
+            root['freshness_seconds'] if root['freshness_seconds'] is not None else float('inf'),
+            root=root['nas_path']
+        )
+        WARM_INDEX_RESCAN_SECONDS.set(root['rescan_seconds'], root=root['nas_path'])
+
+def collect_admission():
+    """Sample running and waiting heavy requests when /metrics is scraped"""
+    for endpoint, stats in admission.stats()['endpoints'].items():
+        ADMISSION_ACTIVE.set(stats['active'], endpoint=endpoint)
+        ADMISSION_WAITING.set(stats['waiting'], endpoint=endpoint)
+
+metrics.add_collector(collect_disk_usage)
+metrics.add_collector(collect_warm_index)
+metrics.add_collector(collect_admission)
+
+def record_response(environ, status, content_type, bytes_sent, seconds, send_seconds):
+    """
+    Update request metrics and release the request's admission slot once
+    its response has been sent (see MetricsMiddleware)
+    """
+    ticket = environ.get(ADMISSION_KEY)
+    if ticket is not None:
+        ticket.release()
+    endpoint = environ.get(MetricsMiddleware.ENDPOINT_KEY)
+    if endpoint is not None:
+        REQUESTS_IN_FLIGHT.dec(endpoint=endpoint)
+    REQUEST_SECONDS.observe(
+        seconds, endpoint=endpoint or 'unknown', method=environ.get('REQUEST_METHOD', ''), status=status
+    )
+    BYTES_WRITTEN.inc(bytes_sent, stage='send')
+    if content_type == 'application/zip':
+        STAGE_SECONDS.observe(send_seconds, stage='send')
+
+app.wsgi_app = MetricsMiddleware(app.wsgi_app, record_response)
+
+@app.before_request
+def track_request():
+    """Label the request with its endpoint and count it as in flight"""
+    if request.endpoint and MetricsMiddleware.ENDPOINT_KEY not in request.environ:
+        request.environ[MetricsMiddleware.ENDPOINT_KEY] = request.endpoint
+        REQUESTS_IN_FLIGHT.inc(endpoint=request.endpoint)
+
+@app.route('/health', methods=['GET'])
+def health_check():
+    """Health check endpoint"""
+    return jsonify({
+        'status': 'healthy',
+        'timestamp': datetime.now().isoformat(),
+        'service': 'NAS Excel Downloader'
+    })
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Metrics of this server process in the Prometheus text format"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/scan-cache', methods=['GET'])
+def scan_cache_stats():
+    """Scan cache statistics endpoint"""
+    return jsonify({
+        'scan_cache': downloader.scan_cache.stats(),
+        'archive_cache': downloader.archive_cache.stats(),
+        'timestamp': datetime.now().isoformat()
+    })
+
+@app.route('/admission', methods=['GET'])
+def admission_stats():
+    """Admission control limits, queue depth and wait time endpoint"""
+    return jsonify({
+        'admission': admission.stats(),
+        'timestamp': datetime.now().isoformat()
+    })
+
+@app.route('/warm-index', methods=['GET'])
+def warm_index_stats():
+    """Warm tree index freshness and rescan cost endpoint"""
+    return jsonify({
+        'warm_index': downloader.warm_index.stats(),
+        'timestamp': datetime.now().isoformat()
+    })
+
+@app.route('/workbook-index', methods=['GET'])
+def workbook_index_stats():
+    """Workbook metadata index statistics endpoint"""
+    return jsonify({
+        'workbook_index': workbook_index.stats(),
+        'timestamp': datetime.now().isoformat()
+    })
+
+@app.route('/workbook-index', methods=['POST'])
+def update_workbook_index():
+    """
+    Index the metadata of the xlsx files in a NAS path
+    
+    Expected JSON payload:
+    {
+        "nas_path": "\\\\server\\share\\folder"
+    }
+
+    Only workbooks whose size or mtime changed since the last update are
+    read, and only the XML parts holding sheets, their used ranges and
+    defined names. Workbooks no longer found are dropped from the index.
+    Filter options (see parse_scan_filter) select the workbooks.
+    
+    Returns:
+        JSON with the number of indexed, unchanged, removed and failed workbooks
+    """
+    try:
+        # Parse request data with fallback handling
+        data = parse_request_data(request)
+        
+        # Validate required parameters
+        nas_path = data.get('nas_path')
+        
+        if not nas_path:
+            raise BadRequest("nas_path is required")
+        
+        scan_filter = parse_scan_filter(data)
+        
+        logger.info(f"Updating workbook index of: {nas_path}")
+        
+        admit_request('workbook-index', [nas_path])
+        stats = refresh_workbook_index(nas_path, scan_filter)
+        
+        return jsonify({
+            'success': True,
+            'nas_path': nas_path,
+            'update': stats,
+            'timestamp': datetime.now().isoformat()
+        })
+        
+    except BadRequest as e:
+        logger.warning(f"Bad request: {str(e)}")
+        count_error(e)
+        return jsonify({
+            'error': 'Bad Request',
+            'message': str(e)
+        }), 400
+        
+    except FileNotFoundError as e:
+        logger.error(f"File not found: {str(e)}")
+        count_error(e)
+        return jsonify({
+            'error': 'Path not found',
+            'message': str(e)
+        }), 404
+        
+    except PermissionError as e:
+        logger.error(f"Permission error: {str(e)}")
+        count_error(e)
+        return jsonify({
+            'error': 'Permission denied',
+            'message': 'Access denied to the specified path'
+        }), 403
+        
+    except AdmissionRejected as e:
+        logger.warning(f"Request rejected: {str(e)}")
+        count_error(e)
+        return rejection_response(e)
+        
+    except Exception as e:
+        logger.error(f"Unexpected error: {str(e)}")
+        count_error(e)
+        return jsonify({
+            'error': 'Internal server error',
+            'message': 'An unexpected error occurred'
+        }), 500
+
+@app.route('/workbook-index/query', methods=['POST'])
+def query_workbook_index():
+    """
+    Find indexed workbooks by sheet name, defined name or path
+    
+    Expected JSON payload:
+    {
+        "nas_path": "\\\\server\\share\\folder",
+        "sheet": "Q3 PnL",
+        "defined_name": "Total*",
+        "path": "reports/*",
+        "min_rows": 10,
+        "limit": 100,
+        "offset": 0,
+        "refresh": false
+    }
+
+    Every key is optional; patterns are case-insensitive globs. Without
+    nas_path every indexed path is searched. With "refresh": true the
+    index of nas_path is updated first.
+    
+    Returns:
+        JSON with the matching workbooks, their sheets and defined names
+    """
+    try:
+        # Parse request data with fallback handling
+        data = parse_request_data(request)
+        
+        nas_path = data.get('nas_path')
+        root = downloader.normalize_path(nas_path) if nas_path else None
+        
+        patterns = {}
+        for name in ('sheet', 'defined_name', 'path'):
+            value = data.get(name)
+            if value is not None and (not isinstance(value, str) or not value):
+                raise BadRequest(f"{name} must be a non-empty string")
+            patterns[name] = value
+        
+        limits = {}
+        for name, default in (('min_rows', None), ('limit', 100), ('offset', 0)):
+            value = data.get(name, default)
+            if value is not None and (not isinstance(value, int) or isinstance(value, bool) or value < 0):
+                raise BadRequest(f"{name} must be a non-negative integer")
+            limits[name] = value
+        if not 1 <= limits['limit'] <= INDEX_QUERY_MAX_LIMIT:
+            raise BadRequest(f"limit must be between 1 and {INDEX_QUERY_MAX_LIMIT}")
+        
+        update = None
+        if data.get('refresh'):
+            if not nas_path:
+                raise BadRequest("refresh needs a nas_path")
+            scan_filter = parse_scan_filter(data)
+            # Refreshing is an index update like POST /workbook-index and
+            # waits for the same slot; the query itself is light
+            ticket = admit_request('workbook-index', [nas_path])
+            update = refresh_workbook_index(nas_path, scan_filter)
+            ticket.release()
+        
+        workbooks = workbook_index.query(root=root, **patterns, **limits)
+        
+        result = {
+            'success': True,
+            'nas_path': nas_path,
+            'workbooks_found': len(workbooks),
+            'workbooks': workbooks,
+            'timestamp': datetime.now().isoformat()
+        }
+        if update is not None:
+            result['update'] = update
+        return jsonify(result)
+        
+    except (BadRequest, ValueError) as e:
+        logger.warning(f"Bad request: {str(e)}")
+        count_error(e)
+        return jsonify({
+            'error': 'Bad Request',
+            'message': str(e)
+        }), 400
+        
+    except FileNotFoundError as e:
+        logger.error(f"File not found: {str(e)}")
+        count_error(e)
+        return jsonify({
+            'error': 'Path not found',
+            'message': str(e)
+        }), 404
+        
+    except PermissionError as e:
+        logger.error(f"Permission error: {str(e)}")
+        count_error(e)
+        return jsonify({
+            'error': 'Permission denied',
+            'message': 'Access denied to the specified path'
+        }), 403
+        
+    except AdmissionRejected as e:
+        logger.warning(f"Request rejected: {str(e)}")
+        count_error(e)
+        return rejection_response(e)
+        
+    except Exception as e:
+        logger.error(f"Unexpected error: {str(e)}")
+        count_error(e)
+        return jsonify({
+            'error': 'Internal server error',
+            'message': 'An unexpected error occurred'
+        }), 500
+
+@app.route('/search-index', methods=['GET'])
+def search_index_stats():
+    """Cell search index statistics endpoint"""
+    return jsonify({
+        'search_index': cell_search_index.stats(),
+        'configured_roots': SEARCH_ROOTS,
+        'timestamp': datetime.now().isoformat()
+    })
+
+@app.route('/search-index', methods=['POST'])
+def update_search_index():
+    """
+    Index the text cells of the xlsx files in a NAS path, or in every
+    path of NAS_SEARCH_ROOTS
+    
+    Expected JSON payload:
+    {
+        "nas_path": "\\\\server\\share\\folder"
+    }
+
+    Only workbooks whose size or mtime changed since the last update are
+    parsed, several at once on the workbook process pool. A path that
+    can't be scanned is reported without failing the others. Filter
+    options (see parse_scan_filter) select the workbooks.
+    
+    Returns:
+        JSON with the update statistics of every path
+    """
+    try:
+        # Parse request data with fallback handling
+        data = parse_request_data(request) if request.data else {}
+        
+        nas_path = data.get('nas_path')
+        nas_paths = [nas_path] if nas_path else SEARCH_ROOTS
+        
+        if not nas_paths:
+            raise BadRequest("nas_path is required when NAS_SEARCH_ROOTS is not configured")
+        
+        scan_filter = parse_scan_filter(data)
+        
+        admit_request('search-index', nas_paths)
+        
+        roots = []
+        for path in nas_paths:
+            logger.info(f"Updating cell search index of: {path}")
+            root = {'nas_path': path}
+            try:
+                root.update(status='ok', update=refresh_search_index(path, scan_filter))
+            except FileNotFoundError as e:
+                root.update(status='not_found', message=str(e))
+            except PermissionError as e:
+                root.update(status='permission_denied', message=str(e))
+            except (NotADirectoryError, OSError, ValueError) as e:
+                root.update(status='error', message=str(e))
+            roots.append(root)
+        
+        if nas_path and roots[0]['status'] != 'ok':
+            status_code = {'not_found': 404, 'permission_denied': 403}.get(roots[0]['status'], 400)
+            return jsonify({
+                'error': 'Index update failed',
+                'message': roots[0]['message'],
+                'roots': roots
+            }), status_code
+        
+        return jsonify({
+            'success': True,
+            'roots': roots,
+            'timestamp': datetime.now().isoformat()
+        })
+        
+    except BadRequest as e:
+        logger.warning(f"Bad request: {str(e)}")
+        count_error(e)
+        return jsonify({
+            'error': 'Bad Request',
+            'message': str(e)
+        }), 400
+        
+    except AdmissionRejected as e:
+        logger.warning(f"Request rejected: {str(e)}")
+        count_error(e)
+        return rejection_response(e)
+        
+    except Exception as e:
+        logger.error(f"Unexpected error: {str(e)}")
+        count_error(e)
+        return jsonify({
+            'error': 'Internal server error',
+            'message': 'An unexpected error occurred'
+        }), 500
+
+@app.route('/search', methods=['POST'])
+def search_cells():
+    """
+    Find the cells of indexed workbooks that contain some text
+    
+    Expected JSON payload:
+    {
+        "query": "TRD-2024-0042",
+        "nas_path": "\\\\server\\share\\folder",
+        "limit": 100,
+        "prefix": false,
+        "exact": false
+    }
+
+    The words of the query must appear next to each other in a cell,
+    regardless of case and accents. "prefix" lets the last word match the
+    start of a word; "exact" only returns cells whose whole text equals
+    the query. Without nas_path every indexed path is searched.
+    
+    Returns:
+        JSON with the file, sheet, cell reference and text of every match
+    """
+    try:
+        # Parse request data with fallback handling
+        data = parse_request_data(request)
+        
+        query = data.get('query')
+        if not isinstance(query, str) or not query.strip():
+            raise BadRequest("query is required")
+        
+        nas_path = data.get('nas_path')
+        root = downloader.normalize_path(nas_path) if nas_path else None
+        
+        limit = data.get('limit', 100)
+        if not isinstance(limit, int) or isinstance(limit, bool) or not 1 <= limit <= SEARCH_MAX_LIMIT:
+            raise BadRequest(f"limit must be between 1 and {SEARCH_MAX_LIMIT}")
+        
+        started = time.perf_counter()
+        matches = cell_search_index.search(
+            query.strip(), root=root, limit=limit, prefix=bool(data.get('prefix')), exact=bool(data.get('exact'))
+        )
+        took = time.perf_counter() - started
+        STAGE_SECONDS.observe(took, stage='search')
+        
+        return jsonify({
+            'success': True,
+            'query': query,
+            'nas_path': nas_path,
+            'matches_found': len(matches),
+            'matches': matches,
+            'took_ms': round(took * 1000, 3),
+            'timestamp': datetime.now().isoformat()
+        })
+        
+    except (BadRequest, ValueError) as e:
+        logger.warning(f"Bad request: {str(e)}")
+        count_error(e)
+        return jsonify({
+            'error': 'Bad Request',
+            'message': str(e)
+        }), 400
+        
+    except Exception as e:
+        logger.error(f"Unexpected error: {str(e)}")
+        count_error(e)
+        return jsonify({
+            'error': 'Internal server error',
+            'message': 'An unexpected error occurred'
+        }), 500
+
+@app.route('/test-json', methods=['POST'])
+def test_json():
+    """Test JSON parsing endpoint for debugging"""
+    try:
+        data = parse_request_data(request)
+        return jsonify({
+            'success': True,
+            'message': 'JSON parsed successfully',
+            'received_data': data,
+            'timestamp': datetime.now().isoformat()
+        })
+    except Exception as e:
+        return jsonify({
             'success': False,
             'error': str(e),
             'timestamp': datetime.now().isoformat()
         }), 400
 
-@app.route('/test-path', methods=['POST'])
-def test_path():
-    """Test path normalization endpoint for debugging"""
+@app.route('/test-path', methods=['POST'])
+def test_path():
+    """Test path normalization endpoint for debugging"""
+    try:
+        data = parse_request_data(request)
+        nas_path = data.get('nas_path')
+        
+        if not nas_path:
+            raise BadRequest("nas_path is required")
+        
+        # Test path normalization
+        normalized = downloader.normalize_path(nas_path)
+        
+        # Test if path exists
+        path_obj = Path(normalized)
+        exists = path_obj.exists()
+        is_dir = path_obj.is_dir() if exists else False
+        
+        return jsonify({
+            'success': True,
+            'original_path': nas_path,
+            'normalized_path': normalized,
+            'path_exists': exists,
+            'is_directory': is_dir,
+            'timestamp': datetime.now().isoformat()
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'error_type': type(e).__name__,
+            'timestamp': datetime.now().isoformat()
+        }), 400
+
+@app.route('/download-xlsx', methods=['POST'])
+def download_xlsx_files():
+    """
+    Download all xlsx files from specified NAS path
+    
+    Expected JSON payload:
+    {
+        "nas_path": "\\\\server\\share\\folder",
+        "stream": false,
+        "compression": "auto",
+        "compression_level": 6,
+        "extensions": [".xlsx", ".xlsm"],
+        "exclude_dirs": ["Archive", "backup*"]
+    }
+
+    With "stream": true the archive is written into the response while it
+    is being built, without staging copies or a temporary zip on disk.
+    "compression" is one of auto, stored or deflate; auto stores entries
+    that don't shrink, such as .xlsx files which are compressed already.
+    Filter options (see parse_scan_filter) select other files than all
+    .xlsx files and are applied while the share is walked.
+    
+    Returns:
+        ZIP file containing all xlsx files or error message
+    """
+    try:
+        # Parse request data with fallback handling
+        data = parse_request_data(request)
+        
+        # Validate required parameters
+        nas_path = data.get('nas_path')
+        
+        if not nas_path:
+            raise BadRequest("nas_path is required")
+        
+        policy = parse_compression_policy(data)
+        scan_filter = parse_scan_filter(data)
+        
+        logger.info(f"Starting xlsx download from: {nas_path} ({policy}, {scan_filter})")
+        
+        # Walking the share is heavy already, so it waits for a slot too
+        ticket = admit_request('download-xlsx', [nas_path])
+        
+        # Find all xlsx files; the fingerprint below is the ETag and the
+        # archive cache key, so it needs current sizes and mtimes rather
+        # than a cached scan
+        scanned_files = downloader.scan_xlsx_files(nas_path, scan_filter=scan_filter, fresh=True)
+        xlsx_files = [entry.path for entry in scanned_files]
+        
+        if not xlsx_files:
+            ticket.release()
+            return jsonify({
+                'error': 'No xlsx files found',
+                'message': f'No Excel files found in {nas_path}',
+                'files_found': 0
+            }), 404
+        
+        # The fingerprint of the file set is the ETag of the archive
+        fingerprint = downloader.fingerprint_files(scanned_files, policy)
+        if request.if_none_match.contains(fingerprint):
+            logger.info(f"Archive {fingerprint} not modified, skipping download")
+            ticket.release()
+            response = Response(status=304)
+            response.set_etag(fingerprint)
+            return response
+        
+        # Generate download filename
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        download_filename = f"nas_xlsx_files_{timestamp}.zip"
+
+        archive_cache = downloader.archive_cache
+        cached_path = archive_cache.get(fingerprint)
+        if cached_path:
+            logger.info(f"Serving {len(xlsx_files)} xlsx files from cached archive {fingerprint}")
+            # Sending a cached archive needs neither the share nor staging space
+            ticket.release()
+            response = send_file(
+                cached_path,
+                as_attachment=True,
+                download_name=download_filename,
+                mimetype='application/zip',
+                etag=fingerprint,
+                conditional=False
+            )
+            response.headers['X-Archive-Cache'] = 'hit'
+            return set_archive_location(response, fingerprint)
+
+        if data.get('stream'):
+            logger.info(f"Streaming {len(xlsx_files)} xlsx files for download")
+
+            def generate():
+                # Keep a copy of the streamed archive for the cache, and only
+                # commit it if every file made it in
+                temp_path = archive_cache.create_temp_path() if archive_cache.enabled else None
+                cache_file = open(temp_path, 'wb') if temp_path else None
+                skipped = []
+                completed = False
+                try:
+                    for chunk in downloader.stream_zip_archive(xlsx_files, nas_path, policy, skipped=skipped):
+                        if cache_file:
+                            cache_file.write(chunk)
+                        yield chunk
+                    completed = True
+                finally:
+                    if cache_file:
+                        cache_file.close()
+                        if completed and not skipped:
+                            archive_cache.store(fingerprint, temp_path)
+                        else:
+                            os.remove(temp_path)
+
+            response = Response(
+                stream_with_context(generate()),
+                mimetype='application/zip',
+                headers={
+                    'Content-Disposition': f'attachment; filename={download_filename}',
+                    'X-Archive-Cache': 'miss'
+                }
+            )
+            response.set_etag(fingerprint)
+            if archive_cache.enabled:
+                # Only retrievable once the stream has completed
+                set_archive_location(response, fingerprint)
+            return response
+
+        # Staging files and the archive live in a workspace owned by this request
+        workspace = downloader.create_workspace()
+        try:
+            # Copy files to temporary directory
+            temp_dir = downloader.copy_xlsx_files(xlsx_files, nas_path, workspace)
+            
+            # Create zip archive
+            archive_stats = {}
+            zip_path = downloader.create_zip_archive(temp_dir, workspace.archive_path, policy, archive_stats)
+            workspace.bytes_used += os.path.getsize(zip_path)
+            
+            logger.info(f"Successfully prepared {len(xlsx_files)} xlsx files for download")
+
+            # Complete archives move to the cache and the workspace can go
+            # right away; a file opened for sending survives eviction
+            cached = archive_cache.enabled and not workspace.skipped_files
+            if cached:
+                zip_path = archive_cache.store(fingerprint, zip_path)
+                zip_file = open(zip_path, 'rb')
+                downloader.release_workspace(workspace)
+                # Sending a cached archive needs neither the share nor staging space
+                ticket.release()
+            else:
+                # The workspace is removed once the server closes the archive
+                # after sending it (call_on_close is skipped for passthrough files)
+                zip_file = ClosingFile(zip_path, lambda: downloader.release_workspace(workspace))
+
+            response = send_file(
+                zip_file,
+                as_attachment=True,
+                download_name=download_filename,
+                mimetype='application/zip'
+            )
+            response.content_length = os.path.getsize(zip_path)
+            response.set_etag(fingerprint)
+            response.headers['X-Archive-Cache'] = 'miss'
+            response.headers['X-Archive-Compression'] = policy.mode
+            response.headers['X-Archive-Bytes-Saved'] = str(archive_stats['bytes_saved'])
+            response.headers['X-Archive-Compress-Seconds'] = str(archive_stats['compress_seconds'])
+            response.headers['X-Archive-Build-Seconds'] = str(archive_stats['seconds'])
+            if cached:
+                set_archive_location(response, fingerprint)
+            return response
+        except Exception:
+            downloader.release_workspace(workspace)
+            raise
+        
+    except BadRequest as e:
+        logger.warning(f"Bad request: {str(e)}")
+        count_error(e)
+        return jsonify({
+            'error': 'Bad Request',
+            'message': str(e)
+        }), 400
+        
+    except FileNotFoundError as e:
+        logger.error(f"File not found: {str(e)}")
+        count_error(e)
+        return jsonify({
+            'error': 'Path not found',
+            'message': str(e)
+        }), 404
+        
+    except PermissionError as e:
+        logger.error(f"Permission error: {str(e)}")
+        count_error(e)
+        return jsonify({
+            'error': 'Permission denied',
+            'message': 'Access denied to the specified path'
+        }), 403
+        
+    except AdmissionRejected as e:
+        logger.warning(f"Request rejected: {str(e)}")
+        count_error(e)
+        return rejection_response(e)
+        
+    except Exception as e:
+        logger.error(f"Unexpected error: {str(e)}")
+        count_error(e)
+        return jsonify({
+            'error': 'Internal server error',
+            'message': 'An unexpected error occurred'
+        }), 500
+
+@app.route('/archives/<archive_id>', methods=['GET'])
+def get_archive(archive_id):
+    """
+    Fetch a retained archive by the id returned in X-Archive-Id
+
+    Supports Range and If-Range, so an interrupted download can be resumed
+    from the last byte received, and If-None-Match.
+    
+    Returns:
+        ZIP file (or the requested byte range) or error message
+    """
+    if not ARCHIVE_ID_PATTERN.match(archive_id):
+        return jsonify({
+            'error': 'Bad Request',
+            'message': 'Invalid archive id'
+        }), 400
+
+    archive_path = downloader.archive_cache.get(archive_id)
+    if not archive_path:
+        return jsonify({
+            'error': 'Archive not found',
+            'message': f'Archive {archive_id} does not exist or has expired'
+        }), 404
+
+    logger.info(f"Serving retained archive {archive_id} (Range: {request.headers.get('Range')})")
+    return send_file(
+        archive_path,
+        as_attachment=True,
+        download_name=f"nas_xlsx_files_{archive_id[:12]}.zip",
+        mimetype='application/zip',
+        etag=archive_id,
+        conditional=True
+    )
+
+def job_response(state, status_code=200):
+    """Render a job state with links to its status and artifact"""
+    state = dict(state)
+    state.pop('archive_path', None)
+    state['status_url'] = url_for('get_job', job_id=state['job_id'])
+    if state['status'] == 'completed':
+        state['download_url'] = url_for('download_job', job_id=state['job_id'])
+    return jsonify(state), status_code
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    """
+    Submit a background archive build and return immediately
+    
+    Expected JSON payload:
+    {
+        "nas_path": "\\\\server\\share\\folder",
+        "compression": "auto"
+    }
+    
+    Returns:
+        202 with the job id and status URL, 404 when the path doesn't
+        exist, or 503 when the queue is full
+    """
     try:
         data = parse_request_data(request)
+        
         nas_path = data.get('nas_path')
         
         if not nas_path:
             raise BadRequest("nas_path is required")
         
-        # Test path normalization
-        normalized = downloader.normalize_path(nas_path)
+        policy = parse_compression_policy(data)
         
-        # Test if path exists
-        path_obj = Path(normalized)
-        exists = path_obj.exists()
-        is_dir = path_obj.is_dir() if exists else False
+        # Reject bad and missing paths now rather than in the background
+        downloader.check_scan_root(downloader.normalize_path(nas_path))
+        
+        job = job_manager.submit(nas_path, policy)
+        response, status_code = job_response(job.to_dict(), 202)
+        response.headers['Location'] = url_for('get_job', job_id=job.job_id)
+        return response, status_code
+        
+    except BadRequest as e:
+        logger.warning(f"Bad request: {str(e)}")
+        count_error(e)
+        return jsonify({
+            'error': 'Bad Request',
+            'message': str(e)
+        }), 400
         
+    except ValueError as e:
+        logger.warning(f"Invalid path: {str(e)}")
+        count_error(e)
         return jsonify({
-            'success': True,
-            'original_path': nas_path,
-            'normalized_path': normalized,
-            'path_exists': exists,
-            'is_directory': is_dir,
-            'timestamp': datetime.now().isoformat()
+            'error': 'Bad Request',
+            'message': str(e)
+        }), 400
+        
+    except JobQueueFull as e:
+        logger.warning(f"Job rejected: {str(e)}")
+        count_error(e)
+        response = jsonify({
+            'error': 'Service Unavailable',
+            'message': str(e)
         })
+        response.headers['Retry-After'] = '30'
+        return response, 503
+        
+    except FileNotFoundError as e:
+        logger.error(f"File not found: {str(e)}")
+        count_error(e)
+        return jsonify({
+            'error': 'Path not found',
+            'message': str(e)
+        }), 404
+        
+    except PermissionError as e:
+        logger.error(f"Permission error: {str(e)}")
+        count_error(e)
+        return jsonify({
+            'error': 'Permission denied',
+            'message': 'Access denied to the specified path'
+        }), 403
+        
     except Exception as e:
+        logger.error(f"Unexpected error: {str(e)}")
+        count_error(e)
         return jsonify({
-            'success': False,
-            'error': str(e),
-            'error_type': type(e).__name__,
+            'error': 'Internal server error',
+            'message': 'An unexpected error occurred'
+        }), 500
+
+@app.route('/jobs', methods=['GET'])
+def list_jobs():
+    """List background archive jobs of this server process"""
+    return jsonify({
+        'jobs': job_manager.list(),
+        'queued': job_manager.queued_count(),
+        'running': job_manager.running_count(),
+        'timestamp': datetime.now().isoformat()
+    })
+
+def find_job(job_id):
+    """Return the state of a job, or an error response"""
+    state = job_manager.get(job_id) if JOB_ID_PATTERN.match(job_id) else None
+    if state is None:
+        return None, (jsonify({
+            'error': 'Job not found',
+            'message': f'Job {job_id} does not exist or has expired'
+        }), 404)
+    return state, None
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Status and progress (files scanned, bytes archived, ETA) of a job"""
+    state, error = find_job(job_id)
+    if error:
+        return error
+    return job_response(state)
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    """Cancel a queued or running job"""
+    if not JOB_ID_PATTERN.match(job_id) or job_manager.get(job_id) is None:
+        return find_job(job_id)[1]
+    return job_response(job_manager.cancel(job_id))
+
+@app.route('/jobs/<job_id>/download', methods=['GET'])
+def download_job(job_id):
+    """
+    Download the archive built by a completed job.
+    Supports Range and If-Range like /archives/<archive_id>.
+    """
+    state, error = find_job(job_id)
+    if error:
+        return error
+
+    if state['status'] != 'completed':
+        return jsonify({
+            'error': 'Job not completed',
+            'message': f"Job {job_id} is {state['status']}",
+            'status': state['status']
+        }), 409
+
+    archive_path = state.get('archive_path')
+    if not archive_path or not os.path.exists(archive_path):
+        return jsonify({
+            'error': 'Archive expired',
+            'message': f'The archive of job {job_id} is no longer available'
+        }), 410
+
+    return send_file(
+        archive_path,
+        as_attachment=True,
+        download_name=f"nas_xlsx_files_{job_id[:12]}.zip",
+        mimetype='application/zip',
+        etag=state['archive_id'],
+        conditional=True
+    )
+
+@app.route('/download-xlsx-delta', methods=['POST'])
+def download_xlsx_delta():
+    """
+    Download only the xlsx files that changed since a client manifest
+    
+    Expected JSON payload:
+    {
+        "nas_path": "\\\\server\\share\\folder",
+        "manifest": [
+            {"relative_path": "reports/report.xlsx", "size": 2048576,
+             "modified_time": "2023-12-07T09:15:30", "sha256": "..."}
+        ],
+        "mtime_tolerance": 1.0
+    }
+
+    Each manifest entry needs a relative_path and at least one of size,
+    mtime (epoch seconds), modified_time (ISO format) or sha256; the file
+    list returned by /list-xlsx can be posted back as it is, together with
+    the filter options it was listed with (files outside the filter are
+    reported as deleted).
+    
+    Returns:
+        ZIP file streamed with new and modified xlsx files, plus a
+        nas_xlsx_delta.json entry listing changed and deleted paths
+    """
+    try:
+        # Parse request data with fallback handling
+        data = parse_request_data(request)
+        
+        # Validate required parameters
+        nas_path = data.get('nas_path')
+        
+        if not nas_path:
+            raise BadRequest("nas_path is required")
+        
+        manifest = parse_delta_manifest(data.get('manifest', []))
+        policy = parse_compression_policy(data)
+        try:
+            mtime_tolerance = float(data.get('mtime_tolerance', DELTA_MTIME_TOLERANCE))
+        except (TypeError, ValueError):
+            raise BadRequest("mtime_tolerance must be a number")
+        scan_filter = parse_scan_filter(data)
+        
+        logger.info(f"Starting delta download from: {nas_path} ({len(manifest)} files in manifest)")
+        
+        # Walking and hashing are the heavy part, so they wait for a slot too
+        admit_request('download-xlsx-delta', [nas_path])
+        
+        # A cached scan could hide files edited in place since the manifest;
+        # the warm index and a walk both see them
+        scanned_files = downloader.scan_xlsx_files(nas_path, scan_filter=scan_filter, fresh=True)
+        changed, deleted = downloader.compute_delta(scanned_files, manifest, mtime_tolerance)
+        
+        logger.info(
+            f"Delta for {nas_path}: {len(changed)} changed, {len(deleted)} deleted, "
+            f"{len(scanned_files) - len(changed)} unchanged"
+        )
+        
+        summary = {
+            'nas_path': nas_path,
+            'changed': [entry.relative_path.replace(os.sep, '/') for entry in changed],
+            'deleted': deleted,
+            'unchanged_count': len(scanned_files) - len(changed),
             'timestamp': datetime.now().isoformat()
+        }
+        
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        download_filename = f"nas_xlsx_delta_{timestamp}.zip"
+        
+        archive = downloader.stream_zip_archive(
+            [entry.path for entry in changed],
+            nas_path,
+            policy,
+            extra_entries={DELTA_MANIFEST_NAME: json.dumps(summary, indent=2)}
+        )
+        return Response(
+            stream_with_context(archive),
+            mimetype='application/zip',
+            headers={
+                'Content-Disposition': f'attachment; filename={download_filename}',
+                'X-Delta-Changed': str(len(changed)),
+                'X-Delta-Deleted': str(len(deleted))
+            }
+        )
+        
+    except BadRequest as e:
+        logger.warning(f"Bad request: {str(e)}")
+        count_error(e)
+        return jsonify({
+            'error': 'Bad Request',
+            'message': str(e)
         }), 400
+        
+    except FileNotFoundError as e:
+        logger.error(f"File not found: {str(e)}")
+        count_error(e)
+        return jsonify({
+            'error': 'Path not found',
+            'message': str(e)
+        }), 404
+        
+    except PermissionError as e:
+        logger.error(f"Permission error: {str(e)}")
+        count_error(e)
+        return jsonify({
+            'error': 'Permission denied',
+            'message': 'Access denied to the specified path'
+        }), 403
+        
+    except AdmissionRejected as e:
+        logger.warning(f"Request rejected: {str(e)}")
+        count_error(e)
+        return rejection_response(e)
+        
+    except Exception as e:
+        logger.error(f"Unexpected error: {str(e)}")
+        count_error(e)
+        return jsonify({
+            'error': 'Internal server error',
+            'message': 'An unexpected error occurred'
+        }), 500
 
-@app.route('/download-xlsx', methods=['POST'])
-def download_xlsx_files():
+@app.route('/download-xlsx-batch', methods=['POST'])
+def download_xlsx_batch():
     """
-    Download all xlsx files from specified NAS path
+    Download the xlsx files of several NAS paths as a single archive
     
     Expected JSON payload:
     {
-        "nas_path": "\\\\server\\share\\folder"
+        "nas_paths": ["\\\\server\\share\\reports", "\\\\server\\share\\finance"],
+        "compression": "auto"
     }
+
+    Paths are normalized and de-duplicated, and paths inside another
+    requested path are left out since their files are already included.
+    The remaining roots are scanned concurrently and each one goes under
+    its own folder in the archive, named after its last path component.
+    A root that can't be scanned doesn't fail the batch; the status of
+    every requested path is written to a nas_xlsx_batch.json entry.
+    Filter options (see parse_scan_filter) apply to every root.
     
     Returns:
-        ZIP file containing all xlsx files or error message
+        ZIP file streamed with the files of every root, or a JSON error
+        with the per-root status when no files were found
+    """
+    try:
+        # Parse request data with fallback handling
+        data = parse_request_data(request)
+        
+        # Validate required parameters
+        nas_paths = data.get('nas_paths')
+        
+        if not nas_paths or not isinstance(nas_paths, list) or not all(isinstance(path, str) for path in nas_paths):
+            raise BadRequest("nas_paths must be a non-empty list of paths")
+        if len(nas_paths) > BATCH_MAX_PATHS:
+            raise BadRequest(f"At most {BATCH_MAX_PATHS} nas_paths can be requested at once")
+        
+        policy = parse_compression_policy(data)
+        scan_filter = parse_scan_filter(data)
+        
+        logger.info(f"Starting batch download of {len(nas_paths)} paths ({policy}, {scan_filter})")
+        
+        roots = downloader.plan_batch(nas_paths, scan_filter)
+        admit_request('download-xlsx-batch', [root['normalized_path'] for root in roots if root['status'] == 'pending'])
+        with STAGE_SECONDS.time(stage='scan'):
+            files = downloader.scan_batch(roots, scan_filter)
+        failed = [root for root in roots if root['status'] not in ('ok', 'duplicate', 'covered')]
+        
+        for root in failed:
+            logger.warning(f"Batch root {root['nas_path']} failed: {root['status']} {root.get('message', '')}")
+        
+        if not files:
+            return jsonify({
+                'error': 'No xlsx files found',
+                'message': f'No Excel files found in {len(nas_paths)} requested paths',
+                'files_found': 0,
+                'roots': roots
+            }), 404
+        
+        summary = {
+            'roots': roots,
+            'files_found': len(files),
+            'timestamp': datetime.now().isoformat()
+        }
+        
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        download_filename = f"nas_xlsx_batch_{timestamp}.zip"
+        
+        archive = downloader.stream_zip_archive(
+            [entry.path for entry, _ in files],
+            f"{len(roots) - len(failed)} batch roots",
+            policy,
+            extra_entries={BATCH_MANIFEST_NAME: json.dumps(summary, indent=2)},
+            names=[name for _, name in files]
+        )
+        return Response(
+            stream_with_context(archive),
+            mimetype='application/zip',
+            headers={
+                'Content-Disposition': f'attachment; filename={download_filename}',
+                'X-Batch-Roots': str(sum(1 for root in roots if root['status'] == 'ok')),
+                'X-Batch-Failed-Roots': str(len(failed)),
+                'X-Batch-Files': str(len(files))
+            }
+        )
+        
+    except BadRequest as e:
+        logger.warning(f"Bad request: {str(e)}")
+        count_error(e)
+        return jsonify({
+            'error': 'Bad Request',
+            'message': str(e)
+        }), 400
+        
+    except AdmissionRejected as e:
+        logger.warning(f"Request rejected: {str(e)}")
+        count_error(e)
+        return rejection_response(e)
+        
+    except Exception as e:
+        logger.error(f"Unexpected error: {str(e)}")
+        count_error(e)
+        return jsonify({
+            'error': 'Internal server error',
+            'message': 'An unexpected error occurred'
+        }), 500
+
+@app.route('/convert-xlsx', methods=['POST'])
+def convert_xlsx_files():
+    """
+    Parse the xlsx files of a NAS path on the server and return their cells
+    as one table
+    
+    Expected JSON payload:
+    {
+        "nas_path": "\\\\server\\share\\folder",
+        "format": "csv",
+        "sheets": ["Data", 0],
+        "range": "A1:F500",
+        "header": true
+    }
+
+    Workbooks are parsed in read-only streaming mode on a pool of worker
+    processes. Every output row starts with source_file (relative path),
+    sheet and row (Excel row number), followed by one column per
+    spreadsheet column of the range, named after the column letter or,
+    with "header", after the first row of the first sheet. "format" is csv,
+    arrow (Arrow IPC stream) or parquet; arrow and parquet need pyarrow.
+    CSV is streamed while workbooks are parsed when the range ends at a
+    column. Filter options (see parse_scan_filter) select the workbooks.
+    
+    Returns:
+        CSV, Arrow or Parquet data, or error message
     """
     try:
         # Parse request data with fallback handling
@@ -390,55 +2850,119 @@ def download_xlsx_files():
         if not nas_path:
             raise BadRequest("nas_path is required")
         
-        logger.info(f"Starting xlsx download from: {nas_path}")
+        output_format = data.get('format', 'csv')
+        if output_format not in OUTPUT_FORMATS:
+            raise BadRequest(f"format must be one of: {', '.join(OUTPUT_FORMATS)}")
+        if output_format not in available_formats():
+            return jsonify({
+                'error': 'Format not available',
+                'message': f'{output_format} output needs pyarrow, which is not installed on the server'
+            }), 501
+        
+        sheets = parse_sheet_selectors(data.get('sheets'))
+        try:
+            cell_range = CellRange.parse(str(data['range'])) if data.get('range') else None
+        except ValueError as e:
+            raise BadRequest(str(e))
+        scan_filter = parse_scan_filter(data)
         
-        # Find all xlsx files
-        xlsx_files = downloader.find_xlsx_files(nas_path)
+        logger.info(f"Converting xlsx files from: {nas_path} to {output_format} ({sheets}, {cell_range})")
         
-        if not xlsx_files:
+        # A scan that misses the caches walks the share, so it waits for a slot too
+        ticket = admit_request('convert-xlsx', [nas_path])
+        
+        scanned_files = downloader.scan_xlsx_files(nas_path, scan_filter=scan_filter)
+        
+        if not scanned_files:
+            ticket.release()
             return jsonify({
                 'error': 'No xlsx files found',
                 'message': f'No Excel files found in {nas_path}',
                 'files_found': 0
             }), 404
         
-        # Copy files to temporary directory
-        temp_dir = downloader.copy_xlsx_files(xlsx_files, nas_path)
-        
-        # Create zip archive
-        zip_path = downloader.create_zip_archive(temp_dir)
-        
-        # Generate download filename
+        table = ConvertedTable(
+            first_column=(cell_range.min_col or 1) if cell_range else 1,
+            width=cell_range.width if cell_range else None,
+            header=bool(data.get('header'))
+        )
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        download_filename = f"nas_xlsx_files_{timestamp}.zip"
-        
-        logger.info(f"Successfully prepared {len(xlsx_files)} xlsx files for download")
+        download_filename = f"nas_xlsx_{timestamp}.{FILE_EXTENSIONS[output_format]}"
+        results = workbook_converter.iter_results(scanned_files, sheets, cell_range)
+
+        def converted(result):
+            if 'error' in result:
+                logger.warning(f"Failed to convert {result['relative_path']}: {result['error']}")
+                FILES_SKIPPED.inc(stage='convert')
+                return False
+            FILES_PROCESSED.inc(stage='convert')
+            return True
         
-        # Send file and cleanup after sending
-        def cleanup_after_send():
-            try:
-                if os.path.exists(zip_path):
-                    os.remove(zip_path)
-                downloader.cleanup_temp_dir()
-            except Exception as e:
-                logger.warning(f"Cleanup error: {str(e)}")
+        if output_format == 'csv' and table.width is not None:
+            # Every column is known up front, so rows go out as workbooks are parsed
+            def generate():
+                started = time.perf_counter()
+                header_written = False
+                for result in results:
+                    if not converted(result):
+                        continue
+                    rows = list(table.rows(result))
+                    yield table.csv_chunk(rows, header_row=not header_written)
+                    header_written = True
+                if not header_written:
+                    yield table.csv_chunk([], header_row=True)
+                STAGE_SECONDS.observe(time.perf_counter() - started, stage='convert')
+            
+            return Response(
+                stream_with_context(generate()),
+                mimetype=MIMETYPES['csv'],
+                headers={
+                    'Content-Disposition': f'attachment; filename={download_filename}',
+                    'X-Convert-Files': str(len(scanned_files))
+                }
+            )
         
-        response = send_file(
-            zip_path,
-            as_attachment=True,
-            download_name=download_filename,
-            mimetype='application/zip'
-        )
+        # The widest row decides the columns, so every workbook is parsed first
+        with STAGE_SECONDS.time(stage='convert'):
+            completed = [result for result in results if converted(result)]
+        if table.width is None:
+            table.widest(completed)
+        headers = {
+            'X-Convert-Files': str(len(scanned_files)),
+            'X-Convert-Failed-Files': str(len(scanned_files) - len(completed))
+        }
         
-        # Schedule cleanup (note: this is basic cleanup, for production use consider background task)
-        @response.call_on_close
-        def cleanup_files():
-            cleanup_after_send()
+        if output_format == 'csv':
+            def generate():
+                yield table.csv_chunk([], header_row=True)
+                for result in completed:
+                    yield table.csv_chunk(table.rows(result))
+            
+            headers['Content-Disposition'] = f'attachment; filename={download_filename}'
+            return Response(stream_with_context(generate()), mimetype=MIMETYPES['csv'], headers=headers)
         
-        return response
+        # Arrow and Parquet output is written to the request's workspace
+        workspace = downloader.create_workspace()
+        try:
+            output_path = os.path.join(workspace.root, download_filename)
+            table.write(completed, output_format, output_path)
+            workspace.bytes_used += os.path.getsize(output_path)
+            response = send_file(
+                ClosingFile(output_path, lambda: downloader.release_workspace(workspace)),
+                as_attachment=True,
+                download_name=download_filename,
+                mimetype=MIMETYPES[output_format]
+            )
+            response.content_length = os.path.getsize(output_path)
+            response.headers.update(headers)
+            return response
+        except Exception:
+            downloader.release_workspace(workspace)
+            raise
         
     except BadRequest as e:
         logger.warning(f"Bad request: {str(e)}")
+        count_error(e)
         return jsonify({
             'error': 'Bad Request',
             'message': str(e)
@@ -446,6 +2970,7 @@ def download_xlsx_files():
         
     except FileNotFoundError as e:
         logger.error(f"File not found: {str(e)}")
+        count_error(e)
         return jsonify({
             'error': 'Path not found',
             'message': str(e)
@@ -453,13 +2978,20 @@ def download_xlsx_files():
         
     except PermissionError as e:
         logger.error(f"Permission error: {str(e)}")
+        count_error(e)
         return jsonify({
             'error': 'Permission denied',
             'message': 'Access denied to the specified path'
         }), 403
         
+    except AdmissionRejected as e:
+        logger.warning(f"Request rejected: {str(e)}")
+        count_error(e)
+        return rejection_response(e)
+        
     except Exception as e:
         logger.error(f"Unexpected error: {str(e)}")
+        count_error(e)
         return jsonify({
             'error': 'Internal server error',
             'message': 'An unexpected error occurred'
@@ -472,8 +3004,20 @@ def list_xlsx_files():
     
     Expected JSON payload:
     {
-        "nas_path": "\\\\server\\share\\folder"
+        "nas_path": "\\\\server\\share\\folder",
+        "format": "json",
+        "limit": 1000,
+        "cursor": null,
+        "patterns": ["*.xlsx", "*.xlsm"],
+        "modified_since": "2024-01-01T00:00:00",
+        "max_depth": 3
     }
+
+    "format": "ndjson" streams one JSON object per file while the share is
+    still being scanned, followed by a summary line. With "limit", files
+    are returned in pages ordered by relative path; pass the returned
+    "next_cursor" as "cursor" to get the next page. Filter options (see
+    parse_scan_filter) are applied while the share is walked.
     
     Returns:
         JSON with list of xlsx files
@@ -488,38 +3032,87 @@ def list_xlsx_files():
         if not nas_path:
             raise BadRequest("nas_path is required")
         
+        response_format = data.get('format', 'json')
+        if response_format not in ('json', 'ndjson'):
+            raise BadRequest("format must be json or ndjson")
+        
+        limit = data.get('limit')
+        if limit is not None:
+            if not isinstance(limit, int) or isinstance(limit, bool) or limit < 1:
+                raise BadRequest("limit must be a positive integer")
+        after = decode_list_cursor(data['cursor']) if data.get('cursor') else None
+        paginated = limit is not None or after is not None
+        scan_filter = parse_scan_filter(data)
+        
         logger.info(f"Listing xlsx files from: {nas_path}")
         
-        # Find all xlsx files (find_xlsx_files will normalize the path)
-        xlsx_files = downloader.find_xlsx_files(nas_path)
-        
-        # Convert paths to relative paths for response
-        normalized_nas_path = downloader.normalize_path(nas_path)
-        nas_base = Path(normalized_nas_path)
-        file_list = []
-        
-        for xlsx_file in xlsx_files:
-            relative_path = xlsx_file.relative_to(nas_base)
-            file_info = {
-                'filename': xlsx_file.name,
-                'relative_path': str(relative_path),
-                'size': xlsx_file.stat().st_size if xlsx_file.exists() else 0,
-                'modified_time': datetime.fromtimestamp(
-                    xlsx_file.stat().st_mtime
-                ).isoformat() if xlsx_file.exists() else None
-            }
-            file_list.append(file_info)
+        if response_format == 'ndjson' and not paginated:
+            # Stream files as the walker finds them
+            xlsx_files = downloader.iter_xlsx_files(nas_path, scan_filter)
+            
+            def generate():
+                files_found = 0
+                try:
+                    for entry in xlsx_files:
+                        files_found += 1
+                        yield json.dumps(file_info(entry)) + '\n'
+                except Exception as e:
+                    logger.error(f"Error while streaming file list: {str(e)}")
+                    count_error(e)
+                    yield json.dumps({'error': type(e).__name__, 'message': str(e)}) + '\n'
+                    return
+                yield json.dumps({
+                    'success': True,
+                    'nas_path': nas_path,
+                    'files_found': files_found,
+                    'timestamp': datetime.now().isoformat()
+                }) + '\n'
+            
+            return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
         
-        return jsonify({
+        # Find all xlsx files (scan_xlsx_files will normalize the path);
+        # size and mtime come from the walk, so no file is stat'ed again
+        xlsx_files = downloader.scan_xlsx_files(nas_path, scan_filter=scan_filter)
+        total_files = len(xlsx_files)
+        next_cursor = None
+        
+        if paginated:
+            relative_paths = [entry.relative_path for entry in xlsx_files]
+            start = bisect.bisect_right(relative_paths, after) if after is not None else 0
+            end = start + limit if limit is not None else total_files
+            xlsx_files = xlsx_files[start:end]
+            if end < total_files:
+                next_cursor = encode_list_cursor(xlsx_files[-1].relative_path)
+        
+        file_list = [file_info(entry) for entry in xlsx_files]
+        
+        if response_format == 'ndjson':
+            lines = [json.dumps(info) + '\n' for info in file_list]
+            lines.append(json.dumps({
+                'success': True,
+                'nas_path': nas_path,
+                'files_found': len(file_list),
+                'total_files': total_files,
+                'next_cursor': next_cursor,
+                'timestamp': datetime.now().isoformat()
+            }) + '\n')
+            return Response(lines, mimetype='application/x-ndjson')
+        
+        result = {
             'success': True,
             'nas_path': nas_path,
             'files_found': len(file_list),
             'files': file_list,
             'timestamp': datetime.now().isoformat()
-        })
+        }
+        if paginated:
+            result['total_files'] = total_files
+            result['next_cursor'] = next_cursor
+        return jsonify(result)
         
     except BadRequest as e:
         logger.warning(f"Bad request: {str(e)}")
+        count_error(e)
         return jsonify({
             'error': 'Bad Request',
             'message': str(e)
@@ -527,6 +3120,7 @@ def list_xlsx_files():
         
     except FileNotFoundError as e:
         logger.error(f"File not found: {str(e)}")
+        count_error(e)
         return jsonify({
             'error': 'Path not found',
             'message': str(e)
@@ -534,6 +3128,7 @@ def list_xlsx_files():
         
     except PermissionError as e:
         logger.error(f"Permission error: {str(e)}")
+        count_error(e)
         return jsonify({
             'error': 'Permission denied',
             'message': 'Access denied to the specified path'
@@ -541,6 +3136,7 @@ def list_xlsx_files():
         
     except Exception as e:
         logger.error(f"Unexpected error: {str(e)}")
+        count_error(e)
         return jsonify({
             'error': 'Internal server error',
             'message': 'An unexpected error occurred'
@@ -567,12 +3163,28 @@ def internal_error(error):
         'message': 'An internal server error occurred'
     }), 500
 
+_cleanup_lock = threading.Lock()
+_cleaned_up = False
+
 def cleanup_on_exit():
-    """Cleanup function to be called on exit"""
+    """
+    Cleanup function to be called when the serving process exits: by the
+    development server below, by the worker_exit hook of every gunicorn
+    worker (see gunicorn.conf.py), and at interpreter exit for any other
+    way of serving the app. Only the first call does anything.
+    """
+    global _cleaned_up
+    with _cleanup_lock:
+        if _cleaned_up:
+            return
+        _cleaned_up = True
     logger.info("Cleaning up resources...")
+    job_manager.shutdown()
+    downloader.warm_index.shutdown()
+    workbook_converter.shutdown()
     downloader.cleanup_all()
 
-import atexit
+# Servers without an exit hook (waitress, uWSGI, tests) rely on this
 atexit.register(cleanup_on_exit)
 
 if __name__ == '__main__':
@@ -599,12 +3211,32 @@ if __name__ == '__main__':
     args = parser.parse_args()
     
     logger.info(f"Starting NAS Excel Downloader Server on {args.host}:{args.port}")
+    logger.info("This is the development server; use 'gunicorn -c gunicorn.conf.py nas_excel_downloader:app' in production")
     logger.info("Available endpoints:")
     logger.info("  GET  /health - Health check")
+    logger.info("  GET  /scan-cache - Scan cache statistics")
+    logger.info("  GET  /warm-index - Warm tree index freshness")
+    logger.info("  GET  /admission - Admission control queue and limits")
+    logger.info("  GET  /metrics - Prometheus metrics")
     logger.info("  POST /test-json - Test JSON parsing")
     logger.info("  POST /test-path - Test path normalization")
     logger.info("  POST /list-xlsx - List xlsx files")
     logger.info("  POST /download-xlsx - Download xlsx files as zip")
+    logger.info("  GET  /archives/<archive_id> - Fetch or resume a retained archive")
+    logger.info("  POST /jobs - Submit a background archive job")
+    logger.info("  GET  /jobs - List background archive jobs")
+    logger.info("  GET  /jobs/<job_id> - Job status and progress")
+    logger.info("  DELETE /jobs/<job_id> - Cancel a job")
+    logger.info("  GET  /jobs/<job_id>/download - Download a job's archive")
+    logger.info("  POST /download-xlsx-delta - Download xlsx files changed since a manifest")
+    logger.info("  POST /download-xlsx-batch - Download xlsx files of several paths as one zip")
+    logger.info("  POST /convert-xlsx - Convert workbook cells to CSV, Arrow or Parquet")
+    logger.info("  GET  /workbook-index - Workbook metadata index statistics")
+    logger.info("  POST /workbook-index - Update the workbook metadata index of a path")
+    logger.info("  POST /workbook-index/query - Query workbook metadata")
+    logger.info("  GET  /search-index - Cell search index statistics")
+    logger.info("  POST /search-index - Update the cell search index of a path")
+    logger.info("  POST /search - Search cell text")
     
     try:
         app.run(
@@ -4,6 +4,7 @@
 import requests
 import json
 import os
+import hashlib
 from datetime import datetime
 
 class NASExcelClient:
@@ -48,31 +49,99 @@ class NASExcelClient:
             print(f"Request failed: {str(e)}")
             return None
     
+    def _partial_download_paths(self, nas_path, download_path):
+        """Return the partial file and its state file for a NAS path"""
+        key = hashlib.sha1(nas_path.encode('utf-8')).hexdigest()[:12]
+        partial_path = os.path.join(download_path, f"nas_xlsx_files_{key}.zip.part")
+        return partial_path, partial_path + ".json"
+
+    def _resume_download(self, partial_path, state_path):
+        """
+        Try to resume an interrupted download from the retained archive
+
+        Returns:
+            bool: True if the partial file is now complete
+        """
+        try:
+            with open(state_path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return False
+
+        offset = os.path.getsize(partial_path)
+        print(f"Resuming download from byte {offset}")
+
+        headers = {'Range': f'bytes={offset}-'}
+        if state.get('etag'):
+            headers['If-Range'] = state['etag']
+
+        response = self.session.get(
+            f"{self.server_url}{state['archive_url']}",
+            headers=headers,
+            stream=True
+        )
+        if response.status_code == 416:
+            # Nothing left to fetch, the partial file is already complete
+            return True
+        if response.status_code not in (200, 206):
+            print(f"Cannot resume download (HTTP {response.status_code}), starting over")
+            return False
+
+        # 200 means the archive changed or ranges aren't honoured: start over
+        mode = 'ab' if response.status_code == 206 else 'wb'
+        with open(partial_path, mode) as f:
+            for chunk in response.iter_content(chunk_size=8192):
+                if chunk:
+                    f.write(chunk)
+        return True
+
     def download_xlsx_files(self, nas_path, download_path="."):
-        """Download all xlsx files from NAS path as a zip file"""
+        """
+        Download all xlsx files from NAS path as a zip file.
+        An interrupted download is resumed automatically on the next call
+        for the same NAS path, as long as the server still retains the archive.
+        """
+        partial_path, state_path = self._partial_download_paths(nas_path, download_path)
         try:
-            payload = {
-                "nas_path": nas_path
-            }
-            
-            response = self.session.post(
-                f"{self.server_url}/download-xlsx",
-                json=payload,
-                headers={'Content-Type': 'application/json'},
-                stream=True
-            )
-            response.raise_for_status()
+            completed = False
+            if os.path.exists(partial_path) and os.path.exists(state_path):
+                completed = self._resume_download(partial_path, state_path)
+
+            if not completed:
+                payload = {
+                    "nas_path": nas_path
+                }
+                
+                response = self.session.post(
+                    f"{self.server_url}/download-xlsx",
+                    json=payload,
+                    headers={'Content-Type': 'application/json'},
+                    stream=True
+                )
+                response.raise_for_status()
+
+                # Remember where the archive can be fetched again before
+                # writing anything, so a broken transfer can be resumed
+                archive_url = response.headers.get('Content-Location')
+                if archive_url:
+                    with open(state_path, 'w') as f:
+                        json.dump({'archive_url': archive_url, 'etag': response.headers.get('ETag')}, f)
+                elif os.path.exists(state_path):
+                    os.remove(state_path)
+                
+                # Download file
+                with open(partial_path, 'wb') as f:
+                    for chunk in response.iter_content(chunk_size=8192):
+                        if chunk:
+                            f.write(chunk)
             
             # Generate filename
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             filename = f"nas_xlsx_files_{timestamp}.zip"
             filepath = os.path.join(download_path, filename)
-            
-            # Download file
-            with open(filepath, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    if chunk:
-                        f.write(chunk)
+            os.replace(partial_path, filepath)
+            if os.path.exists(state_path):
+                os.remove(state_path)
             
             file_size = os.path.getsize(filepath)
             print(f"Successfully downloaded: {filename}")
@@ -91,6 +160,8 @@ class NASExcelClient:
                 return None
         except Exception as e:
             print(f"Download failed: {str(e)}")
+            if os.path.exists(partial_path):
+                print(f"Partial download kept at {partial_path}; run again to resume")
             return None
 
 def main():
@@ -0,0 +1,653 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import logging
+import threading
+from datetime import datetime
+from functools import partial
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from tree_walker import ScanFilter, WalkEntry
+
+logger = logging.getLogger(__name__)
+
+WATCH_MODES = ('auto', 'inotify', 'poll')
+
+# Filesystems where inotify only sees changes made by this machine, so
+# changes made through other clients of the share would be missed
+NETWORK_FILESYSTEMS = ('cifs', 'smb3', 'smbfs', 'nfs', 'nfs4', '9p', 'afs', 'ceph', 'glusterfs', 'fuse.')
+
+# Filtered file lists kept per root, reused until the tree changes
+SELECTION_CACHE_ENTRIES = 32
+
+# Pause after an inotify event so a burst of events costs one listing
+WATCH_SETTLE_SECONDS = 0.1
+
+# Event bits of linux/inotify.h
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+WATCH_MASK = (
+    IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+)
+
+# struct inotify_event: wd, mask, cookie, len, followed by the name
+_EVENT_HEADER = struct.Struct('iIII')
+
+def find_mount(path):
+    """
+    Mount holding path, read from /proc/self/mountinfo
+
+    Returns:
+        tuple: (mount point, filesystem type such as 'ext4' or 'cifs'),
+            both None when unknown
+    """
+    try:
+        with open('/proc/self/mountinfo', encoding='utf-8', errors='replace') as mountinfo:
+            mounts = mountinfo.readlines()
+    except OSError:
+        return None, None
+
+    path = os.path.realpath(path)
+    best_mount, best_type = None, None
+    for line in mounts:
+        fields, _, rest = line.partition(' - ')
+        fields = fields.split()
+        if len(fields) < 5 or not rest:
+            continue
+        # Spaces and other special characters of mount points are octal escapes
+        mount_point = re.sub(r'\\([0-7]{3})', lambda match: chr(int(match.group(1), 8)), fields[4])
+        inside = path == mount_point or path.startswith(mount_point.rstrip('/') + '/')
+        # Later lines are mounted over earlier ones at the same point
+        if inside and (best_mount is None or len(mount_point) >= len(best_mount)):
+            best_mount, best_type = mount_point, rest.split()[0]
+    return best_mount, best_type
+
+def filesystem_type(path):
+    """Type of the filesystem holding path, None when unknown"""
+    return find_mount(path)[1]
+
+def is_network_filesystem(filesystem):
+    return filesystem is not None and any(
+        filesystem == name or (name.endswith('.') and filesystem.startswith(name)) for name in NETWORK_FILESYSTEMS
+    )
+
+def _timestamp(value):
+    return datetime.fromtimestamp(value).isoformat() if value is not None else None
+
+class Inotify:
+    """Minimal inotify binding through ctypes; raises OSError where Linux inotify is missing"""
+
+    def __init__(self):
+        libc_name = ctypes.util.find_library('c')
+        libc = ctypes.CDLL(libc_name, use_errno=True) if libc_name else None
+        if libc is None or not hasattr(libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, "inotify is not available")
+        self._libc = libc
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+
+    def add_watch(self, path, mask=WATCH_MASK):
+        """Watch a directory; returns the watch descriptor"""
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error), path)
+        return wd
+
+    def remove_watch(self, wd):
+        # Fails harmlessly when the kernel already dropped the watch
+        self._libc.inotify_rm_watch(self.fd, wd)
+
+    def read_events(self, timeout):
+        """
+        Wait up to timeout seconds for events
+
+        Returns:
+            list: (watch descriptor, mask, name) of every queued event
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        events = []
+        while readable:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset + _EVENT_HEADER.size <= len(data):
+                wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+                offset += _EVENT_HEADER.size
+                events.append((wd, mask, os.fsdecode(data[offset:offset + length].rstrip(b'\0'))))
+                offset += length
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+class IndexedDirectory:
+    """A directory of a warm root with its files, subdirectories and poll schedule"""
+
+    __slots__ = ('path', 'relative_path', 'key', 'depth', 'files', 'subdirs',
+                 'listed_at', 'interval', 'next_poll', 'watch')
+
+    def __init__(self, path, relative_path, key, depth):
+        self.path = path
+        self.relative_path = relative_path
+        self.key = key
+        self.depth = depth
+        # WalkEntry by file name, and IndexedDirectory by directory name
+        self.files = {}
+        self.subdirs = {}
+        self.listed_at = None
+        self.interval = None
+        self.next_poll = 0.0
+        self.watch = None
+
+class WarmRoot:
+    """
+    Resident tree of one hot root: every file and directory the walker
+    would visit, so file lists are answered without touching the share
+    """
+
+    def __init__(self, path, key, walker, mode):
+        self.path = path
+        self.key = key
+        self.walker = walker
+        self.mode = mode
+        self.fold_case = path.startswith('\\\\')
+        # Every file is kept so any request filter can be answered
+        self.scan_filter = ScanFilter(("*",), max_depth=walker.max_depth)
+        self.lock = threading.Lock()
+        self.directories = {}
+        self.state = 'pending'
+        self.error = None
+        self.retry_at = 0.0
+        self.version = 0
+        self.built_at = None
+        self.build_seconds = None
+        self.changed_at = None
+        self.rescans = 0
+        self.directories_listed = 0
+        self.rescan_seconds = 0.0
+        self.last_rescan = None
+        self._selections = OrderedDict()
+
+    def directory_key(self, relative_path):
+        """Comparable form of a relative directory path, like root_key of the downloader"""
+        key = os.path.normcase(relative_path)
+        if self.fold_case:
+            key = key.casefold()
+        return key.replace('\\', '/')
+
+    def reset(self):
+        """Start over with an unlisted root directory; returns the dropped directories"""
+        dropped = list(self.directories.values())
+        self.directories = {'': IndexedDirectory(self.path, '', '', 0)}
+        self._selections.clear()
+        return dropped
+
+    def apply_listing(self, node, files, subdirs, now):
+        """
+        Replace what is known about a directory with a new listing of it
+
+        Returns:
+            tuple: (whether anything changed, new IndexedDirectory objects
+                to list, IndexedDirectory objects that are gone)
+        """
+        files = {entry.path.name: entry for entry in files}
+        changed = files.keys() != node.files.keys() or any(
+            (entry.size, entry.mtime) != (node.files[name].size, node.files[name].mtime)
+            for name, entry in files.items()
+        )
+        node.files = files
+
+        found = {os.path.basename(path): (path, relative_path, depth) for path, relative_path, depth in subdirs}
+        removed = []
+        for name in [name for name in node.subdirs if name not in found]:
+            removed.extend(self._drop(node.subdirs.pop(name)))
+        added = []
+        for name, (path, relative_path, depth) in found.items():
+            if name not in node.subdirs:
+                child = IndexedDirectory(path, relative_path, self.directory_key(relative_path), depth)
+                node.subdirs[name] = child
+                self.directories[child.key] = child
+                added.append(child)
+
+        node.listed_at = now
+        changed = changed or bool(added) or bool(removed)
+        if changed:
+            self.version += 1
+            self.changed_at = time.time()
+        return changed, added, removed
+
+    def _drop(self, node):
+        dropped = [node]
+        self.directories.pop(node.key, None)
+        for child in node.subdirs.values():
+            dropped.extend(self._drop(child))
+        return dropped
+
+    def select(self, relative_key, scan_filter):
+        """
+        Files below a directory of the tree that a walk of it with
+        scan_filter would return
+
+        Args:
+            relative_key (str): directory_key of the directory, '' for the root
+            scan_filter (ScanFilter): Filter with the walker's limits applied
+
+        Returns:
+            list: WalkEntry objects sorted by relative path, or None when
+                the tree can't answer for that directory
+        """
+        with self.lock:
+            if self.state != 'ready':
+                return None
+            start = self.directories.get(relative_key)
+            # Depth limits count from the requested directory, which the
+            # tree of a deeper subdirectory may not reach
+            if start is None or (relative_key and self.walker.max_depth is not None):
+                return None
+
+            cache_key = (relative_key, scan_filter.cache_key)
+            cached = self._selections.get(cache_key)
+            if cached is not None and cached[0] == self.version:
+                self._selections.move_to_end(cache_key)
+                return cached[1]
+
+            entries = []
+            prefix_length = len(start.relative_path) + 1 if start.relative_path else 0
+            stack = [start]
+            while stack:
+                node = stack.pop()
+                depth = node.depth - start.depth
+                for name, entry in node.files.items():
+                    if scan_filter.matches_name(name) and scan_filter.matches_stat(entry.size, entry.mtime):
+                        if prefix_length:
+                            entry = WalkEntry(
+                                entry.path, entry.relative_path[prefix_length:], entry.size, entry.mtime, depth
+                            )
+                        entries.append(entry)
+                for name, child in node.subdirs.items():
+                    if (scan_filter.descends_into(depth + 1)
+                            and not scan_filter.excludes_dir(name, child.relative_path[prefix_length:])):
+                        stack.append(child)
+            entries.sort(key=lambda entry: entry.relative_path)
+
+            self._selections[cache_key] = (self.version, entries)
+            while len(self._selections) > SELECTION_CACHE_ENTRIES:
+                self._selections.popitem(last=False)
+            return entries
+
+    def stats(self, watch_checked_at):
+        """Size, freshness and rescan cost of the tree"""
+        now = time.monotonic()
+        with self.lock:
+            directories = list(self.directories.values())
+            checked = [
+                watch_checked_at if node.watch is not None and watch_checked_at is not None else node.listed_at
+                for node in directories
+            ]
+            checked = [value for value in checked if value is not None]
+            return {
+                'nas_path': self.path,
+                'mode': self.mode,
+                'state': self.state,
+                'error': self.error,
+                'directories': len(directories),
+                'files': sum(len(node.files) for node in directories),
+                'watched_directories': sum(node.watch is not None for node in directories),
+                'built_at': _timestamp(self.built_at),
+                'build_seconds': self.build_seconds,
+                'last_change_at': _timestamp(self.changed_at),
+                # Changes older than this are guaranteed to be in the tree
+                'freshness_seconds': round(now - min(checked), 3) if checked and self.state == 'ready' else None,
+                'due_directories': sum(node.next_poll <= now for node in directories),
+                'rescans': self.rescans,
+                'directories_listed': self.directories_listed,
+                'rescan_seconds': round(self.rescan_seconds, 3),
+                'last_rescan': self.last_rescan
+            }
+
+class WarmTreeIndex:
+    """
+    In-memory tree index of a few hot roots, so listing them needs no
+    walk of the share on the request path.
+
+    A background thread builds each tree with the walker's rules and keeps
+    it current. Roots on local filesystems are watched with inotify, and
+    the directories named by events are listed again right away. Other
+    roots (SMB and NFS mounts, where inotify misses changes made by other
+    clients) are polled: every directory is listed again on its own
+    schedule, which shrinks to the minimum interval after a change and
+    doubles up to the maximum while nothing changes. Watched directories
+    are still polled at the maximum interval as a safety net.
+    """
+
+    def __init__(self, walker, key_function, watch_mode='auto', poll_min=2.0, poll_max=60.0):
+        """
+        Args:
+            walker (ParallelTreeWalker): Walker whose rules the trees follow
+            key_function (callable): Comparable form of a normalized path
+            watch_mode (str): 'auto', 'inotify' or 'poll'
+            poll_min (float): Shortest seconds between listings of a directory
+            poll_max (float): Longest seconds between listings of a directory
+        """
+        if watch_mode not in WATCH_MODES:
+            raise ValueError(f"watch_mode must be one of {', '.join(WATCH_MODES)}")
+        if poll_min <= 0 or poll_max < poll_min:
+            raise ValueError("poll intervals must be positive, with poll_max at least poll_min")
+
+        self.walker = walker
+        self.key_function = key_function
+        self.watch_mode = watch_mode
+        self.poll_min = poll_min
+        self.poll_max = poll_max
+        self.roots = []
+        self.hits = 0
+        self.fallbacks = 0
+        self._inotify = None
+        self._watches = {}
+        self._watch_checked_at = None
+        self._watch_limit_logged = False
+        self._pool = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._counter_lock = threading.Lock()
+
+    def start(self, paths):
+        """
+        Index normalized paths in the background and keep them current
+
+        Args:
+            paths (list): Normalized NAS paths of the hot roots
+        """
+        if self._thread is not None or not paths:
+            return
+
+        if self.watch_mode != 'poll':
+            try:
+                self._inotify = Inotify()
+            except OSError as e:
+                logger.warning(f"inotify unavailable, polling warm roots instead: {str(e)}")
+
+        for path in paths:
+            mode = 'poll'
+            if self._inotify is not None:
+                filesystem = filesystem_type(path)
+                if self.watch_mode == 'inotify' or not is_network_filesystem(filesystem):
+                    mode = 'inotify'
+                logger.info(f"Warm root {path} is on {filesystem or 'an unknown filesystem'}; using {mode}")
+            self.roots.append(WarmRoot(path, self.key_function(path), self.walker, mode))
+
+        self._pool = ThreadPoolExecutor(max_workers=self.walker.max_workers, thread_name_prefix="warm-index")
+        self._thread = threading.Thread(target=self._run, name="warm-index", daemon=True)
+        self._thread.start()
+
+    def lookup(self, normalized_path, scan_filter=None):
+        """
+        Answer a scan of a hot root, or of a directory below it, from memory
+
+        Args:
+            normalized_path (str): Path returned by normalize_path
+            scan_filter (ScanFilter): Files to find instead of the walker's patterns
+
+        Returns:
+            list: WalkEntry objects sorted by relative path (read-only), or
+                None when the path isn't covered by a ready tree
+        """
+        if not self.roots:
+            return None
+
+        key = self.key_function(normalized_path)
+        entries = None
+        for root in self.roots:
+            prefix = root.key.rstrip('/') + '/'
+            if key == root.key or key.startswith(prefix):
+                relative_key = key[len(prefix):] if key != root.key else ''
+                entries = root.select(relative_key, self.walker.effective_filter(scan_filter))
+                break
+
+        with self._counter_lock:
+            if entries is None:
+                self.fallbacks += 1
+            else:
+                self.hits += 1
+        return entries
+
+    def _run(self):
+        for root in self.roots:
+            if self._stop.is_set():
+                return
+            self._build(root)
+
+        tick = min(self.poll_min, 1.0)
+        while not self._stop.is_set():
+            try:
+                dirty = self._wait(tick)
+                now = time.monotonic()
+                for root in self.roots:
+                    if root.state != 'ready':
+                        if now >= root.retry_at:
+                            self._build(root)
+                        continue
+                    with root.lock:
+                        due = {node for node in root.directories.values() if node.next_poll <= now}
+                    due.update(dirty.get(root, ()))
+                    if due:
+                        self._rescan(root, due)
+            except Exception as e:
+                # Keep the trees current even after an unexpected failure
+                logger.error(f"Warm index watcher error: {str(e)}")
+                self._stop.wait(tick)
+
+    def _wait(self, timeout):
+        """Sleep until the next tick or inotify event; returns the directories events named, by root"""
+        if self._inotify is None:
+            self._stop.wait(timeout)
+            return {}
+
+        events = self._inotify.read_events(timeout)
+        if events:
+            self._stop.wait(WATCH_SETTLE_SECONDS)
+            events.extend(self._inotify.read_events(0))
+        self._watch_checked_at = time.monotonic()
+
+        dirty = {}
+        for wd, mask, name in events:
+            if mask & IN_Q_OVERFLOW:
+                logger.warning("inotify queue overflowed; listing every warm directory again")
+                for root in self.roots:
+                    with root.lock:
+                        for node in root.directories.values():
+                            node.next_poll = 0.0
+                continue
+            watched = self._watches.get(wd)
+            if watched is None:
+                continue
+            root, node = watched
+            if mask & IN_IGNORED:
+                # The directory is gone or unmounted; polling takes over
+                del self._watches[wd]
+                node.watch = None
+            dirty.setdefault(root, set()).add(node)
+        return dirty
+
+    def _build(self, root):
+        with root.lock:
+            dropped = root.reset()
+            root.state = 'building'
+        for node in dropped:
+            self._unwatch(node)
+
+        logger.info(f"Building warm index of {root.path} ({root.mode})")
+        started = time.perf_counter()
+        try:
+            self._refresh(root, [root.directories['']])
+        except OSError as e:
+            with root.lock:
+                root.state = 'error'
+                root.error = str(e)
+            root.retry_at = time.monotonic() + self.poll_max
+            logger.error(f"Failed to build warm index of {root.path}: {str(e)}")
+            return
+
+        with root.lock:
+            root.state = 'ready'
+            root.error = None
+            root.built_at = time.time()
+            root.build_seconds = round(time.perf_counter() - started, 3)
+            files = sum(len(node.files) for node in root.directories.values())
+        logger.info(
+            f"Warm index of {root.path} ready: {len(root.directories)} directories, "
+            f"{files} files in {root.build_seconds}s"
+        )
+
+    def _rescan(self, root, nodes):
+        try:
+            listed, changed, seconds = self._refresh(root, nodes)
+        except OSError as e:
+            # The root itself can't be listed; requests walk it until it's back
+            with root.lock:
+                root.state = 'error'
+                root.error = str(e)
+            root.retry_at = time.monotonic() + self.poll_min
+            logger.error(f"Warm root {root.path} became unavailable: {str(e)}")
+            return
+
+        with root.lock:
+            root.rescans += 1
+            root.directories_listed += listed
+            root.rescan_seconds += seconds
+            root.last_rescan = {
+                'at': datetime.now().isoformat(),
+                'directories': listed,
+                'changed_directories': changed,
+                'seconds': round(seconds, 3)
+            }
+        if changed:
+            logger.debug(f"Warm index of {root.path}: {changed} of {listed} directories changed")
+
+    def _refresh(self, root, nodes):
+        """
+        List directories in parallel, then the subdirectories that
+        appeared in them, until the tree below them is complete
+
+        Returns:
+            tuple: (directories listed, directories changed, seconds taken)
+        """
+        started = time.perf_counter()
+        listed = changed = 0
+        frontier = list(nodes)
+        while frontier:
+            if root.mode == 'inotify':
+                # Watch before listing, so nothing created in between is missed
+                for node in frontier:
+                    if node.watch is None:
+                        self._watch(root, node)
+
+            listings = list(self._pool.map(partial(self._list, root), frontier))
+            now = time.monotonic()
+            added = []
+            with root.lock:
+                for node, listing in zip(frontier, listings):
+                    if root.directories.get(node.key) is not node:
+                        # Dropped along with a parent listed in this round
+                        continue
+                    if listing is None:
+                        # Listed again soon; the parent's listing drops it if it's gone
+                        node.next_poll = now + self.poll_min
+                        continue
+
+                    node_changed, new_nodes, removed_nodes = root.apply_listing(node, *listing, now)
+                    if node.watch is not None:
+                        node.interval = self.poll_max
+                    elif node_changed or node.interval is None:
+                        node.interval = self.poll_min
+                    else:
+                        node.interval = min(self.poll_max, node.interval * 2)
+                    node.next_poll = now + node.interval
+
+                    listed += 1
+                    changed += node_changed
+                    added.extend(new_nodes)
+                    for removed in removed_nodes:
+                        self._unwatch(removed)
+            frontier = added
+        return listed, changed, time.perf_counter() - started
+
+    def _list(self, root, node):
+        try:
+            files, subdirs, _ = self.walker.scan_directory(
+                node.path, node.relative_path, node.depth, root.scan_filter, strict=True
+            )
+            return files, subdirs
+        except OSError as e:
+            if node.depth == 0:
+                raise
+            # A directory that vanished is dropped by the listing of its parent
+            log = logger.debug if isinstance(e, FileNotFoundError) else logger.warning
+            log(f"Failed to list warm directory {node.path}: {str(e)}")
+            return None
+
+    def _watch(self, root, node):
+        try:
+            node.watch = self._inotify.add_watch(node.path)
+            self._watches[node.watch] = (root, node)
+        except OSError as e:
+            if e.errno == errno.ENOSPC:
+                if not self._watch_limit_logged:
+                    logger.warning("inotify watch limit reached; polling the remaining warm directories")
+                    self._watch_limit_logged = True
+            else:
+                logger.debug(f"Failed to watch {node.path}: {str(e)}")
+
+    def _unwatch(self, node):
+        if node.watch is not None:
+            self._watches.pop(node.watch, None)
+            self._inotify.remove_watch(node.watch)
+            node.watch = None
+
+    def stats(self):
+        """Freshness and rescan cost of every warm root"""
+        with self._counter_lock:
+            hits, fallbacks = self.hits, self.fallbacks
+        return {
+            'watch_mode': self.watch_mode,
+            'inotify': self._inotify is not None,
+            'poll_min_seconds': self.poll_min,
+            'poll_max_seconds': self.poll_max,
+            'hits': hits,
+            'fallbacks': fallbacks,
+            'roots': [root.stats(self._watch_checked_at) for root in self.roots]
+        }
+
+    def shutdown(self):
+        """Stop the watcher thread and release the inotify descriptor"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+        if self._inotify is not None and (self._thread is None or not self._thread.is_alive()):
+            self._inotify.close()
+            self._inotify = None
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import fnmatch
+import logging
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+logger = logging.getLogger(__name__)
+
+# Default number of directories listed at the same time
+DEFAULT_SCAN_WORKERS = 16
+
+class WalkEntry:
+    """
+    A file found by the walker, carrying the metadata of its DirEntry
+    so callers don't have to stat it again
+    """
+
+    __slots__ = ('path', 'relative_path', 'size', 'mtime', 'depth')
+
+    def __init__(self, path, relative_path, size, mtime, depth):
+        self.path = path
+        self.relative_path = relative_path
+        self.size = size
+        self.mtime = mtime
+        self.depth = depth
+
+    def __repr__(self):
+        return f"WalkEntry({self.relative_path!r}, size={self.size}, mtime={self.mtime})"
+
+class ScanFilter:
+    """
+    Which files a walk returns and which directories it descends into.
+    Everything is checked while listing, so excluded subtrees are never
+    listed and non-matching files are never returned.
+    """
+
+    def __init__(self, patterns=("*",), exclude_dirs=(), min_size=None, max_size=None,
+                 modified_after=None, modified_before=None, max_depth=None):
+        """
+        Args:
+            patterns (iterable): Glob patterns a file name must match (any of)
+            exclude_dirs (iterable): Glob patterns of directories to skip with
+                everything below them, matched against the directory name and
+                against its '/' separated path relative to the root
+            min_size (int): Smallest file size in bytes
+            max_size (int): Largest file size in bytes
+            modified_after (float): Only files modified at or after this time
+            modified_before (float): Only files modified before this time
+            max_depth (int): Deepest directory level to descend into, where
+                0 means only the root directory; None means unlimited
+        """
+        if max_depth is not None and max_depth < 0:
+            raise ValueError("max_depth cannot be negative")
+        if min_size is not None and max_size is not None and min_size > max_size:
+            raise ValueError("min_size cannot be larger than max_size")
+
+        self.patterns = tuple(patterns)
+        self.exclude_dirs = tuple(exclude_dirs)
+        self.min_size = min_size
+        self.max_size = max_size
+        self.modified_after = modified_after
+        self.modified_before = modified_before
+        self.max_depth = max_depth
+
+    @property
+    def cache_key(self):
+        """Identifies the set of files this filter selects"""
+        return repr((
+            self.patterns, self.exclude_dirs, self.min_size, self.max_size,
+            self.modified_after, self.modified_before, self.max_depth
+        ))
+
+    def matches_name(self, name):
+        return any(fnmatch.fnmatch(name, pattern) for pattern in self.patterns)
+
+    def excludes_dir(self, name, relative_path):
+        relative_path = relative_path.replace(os.sep, '/')
+        return any(
+            fnmatch.fnmatch(name, pattern) or fnmatch.fnmatch(relative_path, pattern)
+            for pattern in self.exclude_dirs
+        )
+
+    def descends_into(self, depth):
+        return self.max_depth is None or depth <= self.max_depth
+
+    def matches_stat(self, size, mtime):
+        if self.min_size is not None and size < self.min_size:
+            return False
+        if self.max_size is not None and size > self.max_size:
+            return False
+        if self.modified_after is not None and mtime < self.modified_after:
+            return False
+        if self.modified_before is not None and mtime >= self.modified_before:
+            return False
+        return True
+
+    def __repr__(self):
+        return f"ScanFilter{self.cache_key}"
+
+class ParallelTreeWalker:
+    """
+    Recursive directory walker that lists many directories concurrently.
+    Over SMB every directory listing is a network round trip, so listing
+    them on a thread pool hides most of the latency of a deep share.
+    """
+
+    def __init__(self, patterns=("*",), max_workers=DEFAULT_SCAN_WORKERS, max_depth=None):
+        """
+        Args:
+            patterns (iterable): Glob patterns a file name must match (any of)
+            max_workers (int): Maximum number of directories listed at once
+            max_depth (int): Deepest directory level to descend into, where
+                0 means only the root directory; None means unlimited
+        """
+        if max_workers < 1:
+            raise ValueError("max_workers must be at least 1")
+
+        self.default_filter = ScanFilter(patterns, max_depth=max_depth)
+        self.patterns = self.default_filter.patterns
+        self.max_workers = max_workers
+        self.max_depth = max_depth
+
+    def scan_directory(self, directory, relative_dir, depth, scan_filter, record_mtime=False, strict=False):
+        """
+        List a single directory. A directory that can't be listed is
+        skipped with a warning, unless it is the root or strict is set.
+
+        Returns:
+            tuple: (matching WalkEntry list, list of (path, relative path, depth)
+                of subdirectories, directory mtime in ns or None)
+        """
+        files = []
+        subdirs = []
+        mtime = None
+
+        try:
+            # Taken before listing, so changes made during the listing are
+            # caught by a later comparison
+            if record_mtime:
+                mtime = os.stat(directory).st_mtime_ns
+
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    relative_path = os.path.join(relative_dir, entry.name) if relative_dir else entry.name
+                    try:
+                        # Like Path.rglob, don't descend into symlinked directories
+                        if entry.is_dir() and not entry.is_symlink():
+                            if (scan_filter.descends_into(depth + 1)
+                                    and not scan_filter.excludes_dir(entry.name, relative_path)):
+                                subdirs.append((entry.path, relative_path, depth + 1))
+                        elif entry.is_file() and scan_filter.matches_name(entry.name):
+                            stat = entry.stat()
+                            if scan_filter.matches_stat(stat.st_size, stat.st_mtime):
+                                files.append(WalkEntry(
+                                    Path(entry.path), relative_path, stat.st_size, stat.st_mtime, depth
+                                ))
+                    except OSError as e:
+                        # The entry vanished or can't be inspected; skip just this one
+                        logger.warning(f"Skipping {entry.path}: {str(e)}")
+        except (PermissionError, FileNotFoundError) as e:
+            if depth == 0 or strict:
+                raise
+            logger.warning(f"Skipping directory {directory}: {str(e)}")
+
+        return files, subdirs, mtime
+
+    def iter_files(self, root, directories=None, scan_filter=None):
+        """
+        Walk the tree under root and yield matching files as soon as the
+        directory containing them has been listed. Order is not defined.
+
+        Args:
+            root (str or Path): Directory to walk
+            directories (dict): When given, filled with the mtime (ns) of
+                every directory listed, keyed by directory path
+            scan_filter (ScanFilter): Files and directories to include,
+                instead of the walker's patterns; the walker's max_depth
+                still applies
+
+        Yields:
+            WalkEntry: Matching file
+        """
+        scan_filter = self.effective_filter(scan_filter)
+        record_mtime = directories is not None
+        pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="tree-walker")
+        try:
+            root = str(root)
+            pending = {pool.submit(self.scan_directory, root, "", 0, scan_filter, record_mtime): root}
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    scanned_dir = pending.pop(future)
+                    files, subdirs, mtime = future.result()
+                    for directory, relative_dir, depth in subdirs:
+                        future = pool.submit(self.scan_directory, directory, relative_dir, depth, scan_filter, record_mtime)
+                        pending[future] = directory
+                    if mtime is not None:
+                        directories[scanned_dir] = mtime
+                    yield from files
+        finally:
+            # Stop listing if the caller gave up or a listing failed
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def effective_filter(self, scan_filter):
+        """Apply the walker's depth limit to a caller's filter"""
+        if scan_filter is None:
+            return self.default_filter
+        if self.max_depth is None or (scan_filter.max_depth is not None and scan_filter.max_depth <= self.max_depth):
+            return scan_filter
+        return ScanFilter(
+            scan_filter.patterns, scan_filter.exclude_dirs, scan_filter.min_size, scan_filter.max_size,
+            scan_filter.modified_after, scan_filter.modified_before, self.max_depth
+        )
+
+    def walk(self, root, directories=None, scan_filter=None):
+        """
+        Walk the tree under root
+
+        Args:
+            root (str or Path): Directory to walk
+            directories (dict): When given, filled with directory mtimes,
+                see iter_files
+            scan_filter (ScanFilter): See iter_files
+
+        Returns:
+            list: Matching WalkEntry objects sorted by relative path
+        """
+        entries = list(self.iter_files(root, directories, scan_filter))
+        entries.sort(key=lambda entry: entry.relative_path)
+        return entries
+
+    def directories_changed(self, directories):
+        """
+        Check whether any directory recorded by a previous walk has changed.
+        Adding, removing or renaming an entry updates the mtime of its parent,
+        so unchanged mtimes mean the set of files is the same. Files edited
+        in place are not detected.
+
+        Args:
+            directories (dict): Directory mtimes recorded by iter_files
+
+        Returns:
+            bool: True if any directory was modified or can no longer be read
+        """
+        def changed(item):
+            directory, mtime = item
+            try:
+                return os.stat(directory).st_mtime_ns != mtime
+            except OSError:
+                return True
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="tree-walker") as pool:
+            return any(pool.map(changed, directories.items()))
+
+    def files_changed(self, entries):
+        """
+        Check whether any file found by a previous walk was edited in
+        place, which directories_changed can't see. Costs one stat per file.
+
+        Args:
+            entries (list): WalkEntry objects of a previous walk
+
+        Returns:
+            bool: True if any file's size or mtime changed or it can no
+                longer be read
+        """
+        def changed(entry):
+            try:
+                stat = os.stat(entry.path)
+            except OSError:
+                return True
+            return stat.st_size != entry.size or stat.st_mtime != entry.mtime
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="tree-walker") as pool:
+            return any(pool.map(changed, entries))
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import csv
+import logging
+import threading
+import multiprocessing
+from datetime import datetime
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from xlsx_reader import read_workbook_rows, column_letters
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+logger = logging.getLogger(__name__)
+
+OUTPUT_FORMATS = ('csv', 'arrow', 'parquet')
+
+MIMETYPES = {
+    'csv': 'text/csv',
+    'arrow': 'application/vnd.apache.arrow.stream',
+    'parquet': 'application/vnd.apache.parquet'
+}
+
+FILE_EXTENSIONS = {'csv': 'csv', 'arrow': 'arrows', 'parquet': 'parquet'}
+
+# Columns put in front of the cell values of every row
+SOURCE_COLUMNS = ('source_file', 'sheet', 'row')
+
+def available_formats():
+    """Output formats that can be produced with the installed packages"""
+    return OUTPUT_FORMATS if pyarrow is not None else ('csv',)
+
+def convert_workbook(path, relative_path, sheets=None, cell_range=None):
+    """
+    Parse one workbook; runs in a worker process
+
+    Returns:
+        dict: relative_path, and either 'sheets' as returned by
+            read_workbook_rows or the 'error' that stopped the parse
+    """
+    try:
+        return {'relative_path': relative_path, 'sheets': read_workbook_rows(path, sheets, cell_range)}
+    except Exception as e:
+        return {'relative_path': relative_path, 'error': f"{type(e).__name__}: {e}"}
+
+def format_value(value):
+    """Text of a cell value in CSV output"""
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, bool):
+        return 'TRUE' if value else 'FALSE'
+    return str(value)
+
+class ConvertedTable:
+    """
+    Rows of converted workbooks laid out as one table: the source
+    columns followed by one column per spreadsheet column
+
+    With header, the first row of every sheet holds column names; the
+    names of the first sheet are used and those rows are left out.
+    """
+
+    def __init__(self, first_column=1, width=None, header=False):
+        self.first_column = first_column
+        self.width = width
+        self.header = header
+        self.names = None
+
+    def rows(self, result):
+        """Yield the output rows of a convert_workbook result"""
+        for sheet_name, rows in result.get('sheets', ()):
+            for index, (row_number, values) in enumerate(rows):
+                if self.header and index == 0:
+                    if self.names is None:
+                        self.names = values
+                    continue
+                if self.width is not None:
+                    values = values[:self.width]
+                yield [result['relative_path'], sheet_name, row_number] + values
+
+    def widest(self, results):
+        """
+        Set the width to the widest row of complete results, and with
+        header take the column names from them, so both are known before
+        any output is written
+        """
+        width = 0
+        for result in results:
+            for _, rows in result.get('sheets', ()):
+                for index, (_, values) in enumerate(rows):
+                    if self.header and index == 0:
+                        if self.names is None:
+                            self.names = values
+                        continue
+                    width = max(width, len(values))
+        self.width = width
+
+    def column_names(self):
+        """Names of the output columns, unique and never empty"""
+        names = list(SOURCE_COLUMNS)
+        seen = set(names)
+        header = self.names or []
+        for index in range(self.width or 0):
+            name = format_value(header[index]) if index < len(header) else ''
+            name = name.strip() or column_letters(self.first_column + index)
+            unique, number = name, 1
+            while unique in seen:
+                number += 1
+                unique = f"{name}_{number}"
+            seen.add(unique)
+            names.append(unique)
+        return names
+
+    def csv_chunk(self, rows, header_row=False):
+        """Encode rows (and optionally the column names) as CSV bytes"""
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator='\n')
+        if header_row:
+            writer.writerow(self.column_names())
+        width = len(SOURCE_COLUMNS) + (self.width or 0)
+        for row in rows:
+            writer.writerow([format_value(value) for value in row] + [''] * (width - len(row)))
+        return buffer.getvalue().encode('utf-8')
+
+    def arrow_table(self, results):
+        """Build a pyarrow Table, typing each column by the values it holds"""
+        rows = [row for result in results for row in self.rows(result)]
+        names = self.column_names()
+        columns = []
+        for index, name in enumerate(names):
+            values = [row[index] if index < len(row) else None for row in rows]
+            columns.append(self._arrow_column(values, index < len(SOURCE_COLUMNS)))
+        return pyarrow.table(columns, names=names)
+
+    @staticmethod
+    def _arrow_column(values, source_column):
+        present = [value for value in values if value is not None]
+        if source_column:
+            return pyarrow.array(values)
+        if not present:
+            return pyarrow.array(values, pyarrow.string())
+        if all(isinstance(value, bool) for value in present):
+            return pyarrow.array(values, pyarrow.bool_())
+        if all(isinstance(value, int) and not isinstance(value, bool) for value in present):
+            return pyarrow.array(values, pyarrow.int64())
+        if all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in present):
+            return pyarrow.array([float(value) if value is not None else None for value in values], pyarrow.float64())
+        if all(isinstance(value, datetime) for value in present):
+            return pyarrow.array(values, pyarrow.timestamp('ms'))
+        # Mixed columns keep the text of every value
+        return pyarrow.array([format_value(value) if value is not None else None for value in values], pyarrow.string())
+
+    def write(self, results, output_format, path):
+        """Write complete results to path as an Arrow IPC stream or Parquet file"""
+        table = self.arrow_table(results)
+        if output_format == 'parquet':
+            pyarrow.parquet.write_table(table, path)
+        else:
+            with pyarrow.OSFile(path, 'wb') as sink, pyarrow.ipc.new_stream(sink, table.schema) as writer:
+                writer.write_table(table)
+
+class WorkbookConverter:
+    """
+    Parses workbooks on a pool of worker processes, so many workbooks are
+    parsed at once without sharing the GIL of the server. The pool is
+    started on first use, from a fork server where the platform has one.
+    """
+
+    def __init__(self, workers=None, max_pending=None):
+        """
+        Args:
+            workers (int): Worker processes, CPU count by default
+            max_pending (int): Workbooks submitted ahead of the one being
+                consumed, which bounds the parsed rows held in memory
+        """
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self.max_pending = max_pending or self.workers * 2
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                # Forking the server directly would copy locks held by its
+                # other threads into the workers; a fork server is a clean
+                # single-threaded process with only this module loaded
+                if 'forkserver' in multiprocessing.get_all_start_methods():
+                    context = multiprocessing.get_context('forkserver')
+                    context.set_forkserver_preload([__name__])
+                else:
+                    context = multiprocessing.get_context()
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+                logger.info(f"Started workbook converter with {self.workers} processes")
+            return self._pool
+
+    def iter_results(self, entries, sheets=None, cell_range=None):
+        """
+        Parse workbooks in parallel and yield their results in the order
+        of entries
+
+        Args:
+            entries (list): WalkEntry objects of the workbooks
+            sheets (list): Sheet names or 0-based positions, None for all
+            cell_range (CellRange): Only cells inside this range
+
+        Yields:
+            dict: Result of convert_workbook for each entry
+        """
+        return self.iter_map(convert_workbook, entries, sheets, cell_range)
+
+    def iter_map(self, function, entries, *args):
+        """
+        Run function(path, relative_path, *args) for every workbook on the
+        worker processes and yield the results in the order of entries
+
+        Args:
+            function (callable): Module-level function, so it can be pickled
+            entries (iterable): WalkEntry objects of the workbooks
+            *args: Further arguments passed with every call
+
+        Yields:
+            object: Return value of function for each entry
+        """
+        pool = self._get_pool()
+        pending = deque()
+        entries = iter(entries)
+        try:
+            while True:
+                while len(pending) < self.max_pending:
+                    entry = next(entries, None)
+                    if entry is None:
+                        break
+                    relative_path = entry.relative_path.replace(os.sep, '/')
+                    pending.append(pool.submit(function, str(entry.path), relative_path, *args))
+                if not pending:
+                    return
+                try:
+                    result = pending.popleft().result()
+                except BrokenProcessPool:
+                    # A worker died (killed or out of memory); start a new
+                    # pool for the next request
+                    with self._lock:
+                        if self._pool is pool:
+                            self._pool = None
+                    raise
+                yield result
+        finally:
+            # Abandoned requests don't keep workers busy
+            for future in pending:
+                future.cancel()
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import sqlite3
+import logging
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor
+from xlsx_reader import XlsxWorkbook, column_letters
+
+logger = logging.getLogger(__name__)
+
+# Bump when the tables change; older index files are rebuilt from scratch
+SCHEMA_VERSION = 1
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS workbooks (
+    id INTEGER PRIMARY KEY,
+    root TEXT NOT NULL,
+    relative_path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    indexed_at REAL NOT NULL,
+    error TEXT,
+    UNIQUE (root, relative_path)
+);
+CREATE TABLE IF NOT EXISTS sheets (
+    workbook_id INTEGER NOT NULL REFERENCES workbooks (id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    state TEXT NOT NULL,
+    used_range TEXT,
+    row_count INTEGER NOT NULL,
+    column_count INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sheets_by_name ON sheets (name COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS sheets_by_workbook ON sheets (workbook_id);
+CREATE TABLE IF NOT EXISTS defined_names (
+    workbook_id INTEGER NOT NULL REFERENCES workbooks (id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    value TEXT NOT NULL,
+    sheet TEXT
+);
+CREATE INDEX IF NOT EXISTS defined_names_by_name ON defined_names (name COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS defined_names_by_workbook ON defined_names (workbook_id);
+"""
+
+def extract_metadata(path):
+    """
+    Read the metadata of a workbook from the XML parts of its package:
+    the workbook part for sheets and defined names, and the start of each
+    sheet part for its used range
+
+    Returns:
+        dict: 'sheets' and 'defined_names' lists
+    """
+    with XlsxWorkbook(path) as workbook:
+        sheets = []
+        for position, sheet in enumerate(workbook.sheets):
+            used = workbook.used_range(position)
+            sheets.append({
+                'position': position,
+                'name': sheet['name'],
+                'state': sheet['state'],
+                'used_range': (
+                    f"{column_letters(used.min_col)}{used.min_row}:{column_letters(used.max_col)}{used.max_row}"
+                    if used else None
+                ),
+                'row_count': used.max_row - used.min_row + 1 if used else 0,
+                'column_count': used.max_col - used.min_col + 1 if used else 0
+            })
+
+        defined_names = []
+        for defined_name in workbook.defined_names:
+            local_sheet = defined_name['local_sheet']
+            defined_names.append({
+                'name': defined_name['name'],
+                'value': defined_name['value'],
+                'sheet': (
+                    workbook.sheets[local_sheet]['name']
+                    if local_sheet is not None and local_sheet < len(workbook.sheets) else None
+                )
+            })
+
+    return {'sheets': sheets, 'defined_names': defined_names}
+
+def plan_update(known, entries):
+    """
+    Compare a scan with what an index holds
+
+    Args:
+        known (dict): (size, mtime) of indexed workbooks keyed by relative path
+        entries (list): WalkEntry objects of the scan
+
+    Returns:
+        tuple: (number of workbooks found, (relative path, WalkEntry) pairs
+            that are new or whose size or mtime changed, relative paths of
+            indexed workbooks that are gone)
+    """
+    found = {entry.relative_path.replace(os.sep, '/'): entry for entry in entries}
+    changed = [
+        (relative_path, entry) for relative_path, entry in found.items()
+        if known.get(relative_path) != (entry.size, entry.mtime)
+    ]
+    removed = [relative_path for relative_path in known if relative_path not in found]
+    return len(found), changed, removed
+
+def glob_to_like(pattern):
+    """Turn a * and ? glob into a LIKE pattern (escape character: backslash)"""
+    escaped = pattern.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return escaped.replace('*', '%').replace('?', '_')
+
+class WorkbookIndex:
+    """
+    On-disk SQLite index of workbook metadata: sheet names, used ranges,
+    row and column counts, defined names, size and mtime.
+
+    Every operation opens its own connection, so the index can be used
+    from any thread, and the database runs in WAL mode so several server
+    processes can share one index file.
+    """
+
+    def __init__(self, db_path, workers=8):
+        """
+        Args:
+            db_path (str): Index file, created if missing
+            workers (int): Workbooks read at the same time while updating
+        """
+        self.db_path = db_path
+        self.workers = max(1, workers)
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        with closing(self._connect()) as connection, connection:
+            version = connection.execute("PRAGMA user_version").fetchone()[0]
+            if version != SCHEMA_VERSION:
+                logger.info(f"Creating workbook index {db_path} (schema {version} -> {SCHEMA_VERSION})")
+                connection.executescript(
+                    "DROP TABLE IF EXISTS defined_names; DROP TABLE IF EXISTS sheets; DROP TABLE IF EXISTS workbooks;"
+                )
+                connection.executescript(_SCHEMA)
+                connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def _connect(self):
+        connection = sqlite3.connect(self.db_path, timeout=30)
+        connection.row_factory = sqlite3.Row
+        connection.execute("PRAGMA journal_mode = WAL")
+        connection.execute("PRAGMA foreign_keys = ON")
+        return connection
+
+    def update(self, root, entries):
+        """
+        Bring the index of a root in line with a scan of it. Workbooks
+        whose size and mtime are unchanged are not opened; workbooks that
+        are no longer found are removed.
+
+        Args:
+            root (str): Normalized NAS path the entries were scanned from
+            entries (list): WalkEntry objects of the scan
+
+        Returns:
+            dict: Counts of indexed, unchanged, removed and failed workbooks
+                and the seconds taken
+        """
+        started = time.perf_counter()
+        with closing(self._connect()) as connection:
+            known = {
+                row['relative_path']: (row['size'], row['mtime'])
+                for row in connection.execute(
+                    "SELECT relative_path, size, mtime FROM workbooks WHERE root = ?", (root,)
+                )
+            }
+
+        found, changed, removed = plan_update(known, entries)
+
+        def read(item):
+            relative_path, entry = item
+            try:
+                return relative_path, entry, extract_metadata(entry.path), None
+            except Exception as e:
+                logger.warning(f"Failed to index {entry.path}: {str(e)}")
+                return relative_path, entry, None, f"{type(e).__name__}: {e}"
+
+        failed = 0
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="workbook-index") as pool, \
+                closing(self._connect()) as connection:
+            # Commit in batches so a long update doesn't hold the write lock
+            pending = 0
+            for relative_path, entry, metadata, error in pool.map(read, changed):
+                failed += error is not None
+                self._store(connection, root, relative_path, entry, metadata, error)
+                pending += 1
+                if pending >= 100:
+                    connection.commit()
+                    pending = 0
+            connection.executemany(
+                "DELETE FROM workbooks WHERE root = ? AND relative_path = ?",
+                [(root, relative_path) for relative_path in removed]
+            )
+            connection.commit()
+
+        stats = {
+            'indexed': len(changed) - failed,
+            'unchanged': found - len(changed),
+            'removed': len(removed),
+            'failed': failed,
+            'seconds': round(time.perf_counter() - started, 3)
+        }
+        logger.info(f"Updated workbook index of {root}: {stats}")
+        return stats
+
+    def _store(self, connection, root, relative_path, entry, metadata, error):
+        connection.execute("DELETE FROM workbooks WHERE root = ? AND relative_path = ?", (root, relative_path))
+        workbook_id = connection.execute(
+            "INSERT INTO workbooks (root, relative_path, size, mtime, indexed_at, error) VALUES (?, ?, ?, ?, ?, ?)",
+            (root, relative_path, entry.size, entry.mtime, time.time(), error)
+        ).lastrowid
+        if metadata is None:
+            return
+        connection.executemany(
+            "INSERT INTO sheets (workbook_id, position, name, state, used_range, row_count, column_count) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [
+                (workbook_id, sheet['position'], sheet['name'], sheet['state'], sheet['used_range'],
+                 sheet['row_count'], sheet['column_count'])
+                for sheet in metadata['sheets']
+            ]
+        )
+        connection.executemany(
+            "INSERT INTO defined_names (workbook_id, name, value, sheet) VALUES (?, ?, ?, ?)",
+            [(workbook_id, name['name'], name['value'], name['sheet']) for name in metadata['defined_names']]
+        )
+
+    def query(self, root=None, sheet=None, defined_name=None, path=None, min_rows=None, limit=100, offset=0):
+        """
+        Find workbooks by their metadata. Patterns are case-insensitive
+        globs (* and ?), so an exact name matches itself.
+
+        Args:
+            root (str): Only workbooks indexed under this normalized path
+            sheet (str): Workbooks with a sheet whose name matches
+            defined_name (str): Workbooks with a defined name that matches
+            path (str): Workbooks whose relative path matches
+            min_rows (int): Workbooks with a matching sheet of at least
+                this many rows (any sheet when no sheet pattern is given)
+            limit (int): Most workbooks returned
+            offset (int): Matching workbooks skipped, for paging
+
+        Returns:
+            list: Workbooks ordered by root and relative path, each with
+                its sheets and defined names
+        """
+        conditions, parameters = [], []
+        if root is not None:
+            conditions.append("w.root = ?")
+            parameters.append(root)
+        if path:
+            conditions.append("w.relative_path LIKE ? ESCAPE '\\'")
+            parameters.append(glob_to_like(path))
+        if sheet or min_rows is not None:
+            sheet_conditions = ["s.workbook_id = w.id"]
+            if sheet:
+                sheet_conditions.append("s.name LIKE ? ESCAPE '\\'")
+                parameters.append(glob_to_like(sheet))
+            if min_rows is not None:
+                sheet_conditions.append("s.row_count >= ?")
+                parameters.append(min_rows)
+            conditions.append(f"EXISTS (SELECT 1 FROM sheets s WHERE {' AND '.join(sheet_conditions)})")
+        if defined_name:
+            conditions.append(
+                "EXISTS (SELECT 1 FROM defined_names d WHERE d.workbook_id = w.id AND d.name LIKE ? ESCAPE '\\')"
+            )
+            parameters.append(glob_to_like(defined_name))
+
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        with closing(self._connect()) as connection:
+            workbooks = connection.execute(
+                f"SELECT * FROM workbooks w {where} ORDER BY w.root, w.relative_path LIMIT ? OFFSET ?",
+                parameters + [limit, offset]
+            ).fetchall()
+
+            results = []
+            for workbook in workbooks:
+                sheets = connection.execute(
+                    "SELECT position, name, state, used_range, row_count, column_count FROM sheets "
+                    "WHERE workbook_id = ? ORDER BY position", (workbook['id'],)
+                ).fetchall()
+                defined_names = connection.execute(
+                    "SELECT name, value, sheet FROM defined_names WHERE workbook_id = ? ORDER BY name",
+                    (workbook['id'],)
+                ).fetchall()
+                results.append({
+                    'root': workbook['root'],
+                    'relative_path': workbook['relative_path'],
+                    'size': workbook['size'],
+                    'mtime': workbook['mtime'],
+                    'indexed_at': workbook['indexed_at'],
+                    'error': workbook['error'],
+                    'sheets': [dict(row) for row in sheets],
+                    'defined_names': [dict(row) for row in defined_names]
+                })
+        return results
+
+    def stats(self):
+        """Number of indexed roots, workbooks, sheets and the index file size"""
+        with closing(self._connect()) as connection:
+            counts = connection.execute(
+                "SELECT (SELECT COUNT(DISTINCT root) FROM workbooks), (SELECT COUNT(*) FROM workbooks), "
+                "(SELECT COUNT(*) FROM workbooks WHERE error IS NOT NULL), (SELECT COUNT(*) FROM sheets)"
+            ).fetchone()
+        return {
+            'db_path': self.db_path,
+            'roots': counts[0],
+            'workbooks': counts[1],
+            'failed_workbooks': counts[2],
+            'sheets': counts[3],
+            'size_bytes': os.path.getsize(self.db_path) if os.path.exists(self.db_path) else 0
+        }
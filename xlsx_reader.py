@@ -0,0 +1,465 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import re
+import zipfile
+import posixpath
+from datetime import datetime, timedelta
+from xml.etree.ElementTree import iterparse, parse
+
+# Built-in number formats that display dates or times
+_DATE_FORMAT_IDS = set(range(14, 23)) | {45, 46, 47}
+
+# Quoted text, escaped characters and [Red]/[$-409] sections of a format
+# code never make it a date format
+_FORMAT_NOISE = re.compile(r'"[^"]*"|\\.|\[[^\]]*\]')
+_DATE_TOKENS = re.compile(r'[dmyhs]', re.IGNORECASE)
+
+_CELL_REF = re.compile(r'^([A-Z]+)(\d+)$')
+_RANGE_PART = re.compile(r'^([A-Z]*)(\d*)$')
+
+_EPOCH_1900 = datetime(1899, 12, 30)
+_EPOCH_1904 = datetime(1904, 1, 1)
+
+_REL_OFFICE_DOCUMENT = 'officeDocument'
+
+def _local(tag):
+    """Tag name without its namespace, so strict and transitional files read alike"""
+    return tag.rsplit('}', 1)[-1]
+
+def _attribute(element, name):
+    """Attribute by local name, whatever namespace it is in"""
+    for key, value in element.attrib.items():
+        if _local(key) == name:
+            return value
+    return None
+
+def _text(element):
+    """Text of a string item: plain <t>, or the <t> of every rich text run"""
+    parts = []
+    for child in element.iter():
+        if _local(child.tag) == 't':
+            parts.append(child.text or '')
+        elif _local(child.tag) == 'rPh':
+            # Phonetic guides are annotations, not part of the value
+            break
+    return ''.join(parts)
+
+def column_index(letters):
+    """Return the 1-based index of a column name such as 'A' or 'AB'"""
+    index = 0
+    for letter in letters:
+        index = index * 26 + ord(letter) - 64
+    return index
+
+def column_letters(index):
+    """Return the name of a 1-based column index"""
+    letters = ''
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+def split_cell_ref(ref):
+    """
+    Split a cell reference such as 'B12'
+
+    Returns:
+        tuple: (column index, row number), both 1-based
+    """
+    match = _CELL_REF.match(ref.replace('$', '').upper())
+    if not match:
+        raise ValueError(f"Invalid cell reference: {ref}")
+    return column_index(match.group(1)), int(match.group(2))
+
+class CellRange:
+    """
+    A rectangle of cells where any bound may be open, parsed from forms
+    like 'A1:D100', 'B:D' (whole columns), '5:20' (whole rows) or 'C3'
+    """
+
+    def __init__(self, min_col=None, min_row=None, max_col=None, max_row=None):
+        self.min_col = min_col
+        self.min_row = min_row
+        self.max_col = max_col
+        self.max_row = max_row
+
+    @classmethod
+    def parse(cls, text):
+        start, separator, end = text.replace('$', '').upper().strip().partition(':')
+        bounds = []
+        for part in (start, end if separator else start):
+            match = _RANGE_PART.match(part.strip())
+            if not match or not part.strip():
+                raise ValueError(f"Invalid cell range: {text}")
+            letters, digits = match.groups()
+            bounds.append((column_index(letters) if letters else None, int(digits) if digits else None))
+
+        (min_col, min_row), (max_col, max_row) = bounds
+        if 0 in (min_row, max_row):
+            raise ValueError(f"Invalid cell range: {text}")
+        if min_col and max_col and min_col > max_col or min_row and max_row and min_row > max_row:
+            raise ValueError(f"Invalid cell range: {text}")
+        return cls(min_col, min_row, max_col, max_row)
+
+    @property
+    def width(self):
+        """Number of columns, or None when the range has no last column"""
+        if self.max_col is None:
+            return None
+        return self.max_col - (self.min_col or 1) + 1
+
+    def __repr__(self):
+        start = f"{column_letters(self.min_col) if self.min_col else ''}{self.min_row or ''}"
+        end = f"{column_letters(self.max_col) if self.max_col else ''}{self.max_row or ''}"
+        return f"CellRange('{start}:{end}')"
+
+def excel_datetime(serial, date1904=False):
+    """Convert an Excel date serial number to a datetime"""
+    if not date1904 and serial < 60:
+        # Serials before the fictitious 1900-02-29 are one day off
+        serial += 1
+    # Excel keeps times to the millisecond; rounding drops float noise
+    return (_EPOCH_1904 if date1904 else _EPOCH_1900) + timedelta(milliseconds=round(serial * 86400000))
+
+def is_date_format(format_code):
+    """Return True if a number format code displays a date or a time"""
+    return bool(_DATE_TOKENS.search(_FORMAT_NOISE.sub('', format_code)))
+
+class XlsxWorkbook:
+    """
+    Read-only view of an .xlsx or .xlsm workbook that parses the XML parts
+    of the package directly. Sheets are read row by row with iterparse, so
+    memory stays flat however large a sheet is, and reading stops as soon
+    as the requested rows have been seen.
+
+    Used as a context manager, it closes the underlying zip file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._zip = zipfile.ZipFile(path)
+        self._shared_strings = None
+        self._date_styles = None
+        try:
+            self._read_workbook()
+        except Exception:
+            self._zip.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._zip.close()
+
+    def _part(self, name):
+        """Parse a whole XML part; only used for small parts"""
+        with self._zip.open(name) as f:
+            return parse(f).getroot()
+
+    def _relationships(self, part_name):
+        """Targets of the relationships of a part, keyed by relationship id"""
+        directory, name = posixpath.split(part_name)
+        rels_name = posixpath.join(directory, '_rels', name + '.rels')
+        if rels_name not in self._names:
+            return {}
+        targets = {}
+        for rel in self._part(rels_name):
+            target = rel.get('Target', '')
+            if rel.get('TargetMode') == 'External':
+                continue
+            if target.startswith('/'):
+                target = target.lstrip('/')
+            else:
+                target = posixpath.normpath(posixpath.join(directory, target))
+            targets[rel.get('Id')] = (target, rel.get('Type', '').rsplit('/', 1)[-1])
+        return targets
+
+    def _read_workbook(self):
+        self._names = set(self._zip.namelist())
+
+        # The package relationships point at the workbook part
+        self.workbook_part = 'xl/workbook.xml'
+        for target, rel_type in self._relationships('').values():
+            if rel_type == _REL_OFFICE_DOCUMENT:
+                self.workbook_part = target
+        if self.workbook_part not in self._names:
+            raise ValueError(f"{self.path} is not an xlsx workbook")
+
+        workbook = self._part(self.workbook_part)
+        relationships = self._relationships(self.workbook_part)
+
+        self.date1904 = False
+        self.sheets = []
+        self.defined_names = []
+        for element in workbook.iter():
+            name = _local(element.tag)
+            if name == 'workbookPr':
+                self.date1904 = element.get('date1904') in ('1', 'true')
+            elif name == 'sheet':
+                target, _ = relationships.get(_attribute(element, 'id'), (None, None))
+                self.sheets.append({
+                    'name': element.get('name'),
+                    'state': element.get('state', 'visible'),
+                    'part': target
+                })
+            elif name == 'definedName':
+                self.defined_names.append({
+                    'name': element.get('name'),
+                    'value': element.text or '',
+                    'local_sheet': int(element.get('localSheetId')) if element.get('localSheetId') else None
+                })
+
+        self._part_of_type = {rel_type: target for target, rel_type in relationships.values()}
+
+    @property
+    def sheet_names(self):
+        return [sheet['name'] for sheet in self.sheets]
+
+    @property
+    def shared_strings(self):
+        """Strings of the shared string table, read on first use"""
+        if self._shared_strings is None:
+            self._shared_strings = list(self.iter_shared_strings())
+        return self._shared_strings
+
+    def iter_shared_strings(self):
+        """Yield the shared string table, one string at a time"""
+        part = self._part_of_type.get('sharedStrings')
+        if part not in self._names:
+            return
+        with self._zip.open(part) as f:
+            for _, element in iterparse(f):
+                if _local(element.tag) == 'si':
+                    yield _text(element)
+                    element.clear()
+
+    @property
+    def date_styles(self):
+        """Indexes of the cell formats that display dates"""
+        if self._date_styles is None:
+            self._date_styles = set()
+            part = self._part_of_type.get('styles')
+            if part in self._names:
+                styles = self._part(part)
+                date_formats = set(_DATE_FORMAT_IDS)
+                for element in styles.iter():
+                    if _local(element.tag) == 'numFmt' and is_date_format(element.get('formatCode', '')):
+                        date_formats.add(int(element.get('numFmtId')))
+                for element in styles.iter():
+                    if _local(element.tag) == 'cellXfs':
+                        for index, xf in enumerate(element):
+                            if int(xf.get('numFmtId', 0)) in date_formats:
+                                self._date_styles.add(index)
+        return self._date_styles
+
+    def sheet(self, selector):
+        """
+        Find a sheet by name or 0-based position
+
+        Returns:
+            dict: Sheet with 'name', 'state' and 'part'
+        """
+        if isinstance(selector, int):
+            if not 0 <= selector < len(self.sheets):
+                raise KeyError(f"Sheet index {selector} out of range")
+            return self.sheets[selector]
+        for sheet in self.sheets:
+            if sheet['name'] == selector:
+                return sheet
+        raise KeyError(f"No sheet named {selector!r}")
+
+    def iter_sheet_elements(self, sheet):
+        """
+        Yield ('dimension', ref) and then ('row', element) for every row of
+        a sheet as it is parsed; each row element is cleared afterwards
+        """
+        part = sheet['part']
+        if part not in self._names:
+            return
+        with self._zip.open(part) as f:
+            parent = None
+            for event, element in iterparse(f, events=('start', 'end')):
+                name = _local(element.tag)
+                if event == 'start':
+                    if name == 'sheetData':
+                        parent = element
+                    continue
+                if name == 'dimension':
+                    yield 'dimension', element.get('ref')
+                elif name == 'row':
+                    yield 'row', element
+                    # Drop parsed rows so memory doesn't grow with the sheet
+                    if parent is not None:
+                        parent.clear()
+                elif name == 'sheetData':
+                    break
+
+    def cell_value(self, cell):
+        """Typed value of a <c> element"""
+        cell_type = cell.get('t', 'n')
+        raw = None
+        for child in cell:
+            name = _local(child.tag)
+            if name == 'v':
+                raw = child.text
+            elif name == 'is':
+                return _text(child)
+
+        if raw is None:
+            return None
+        if cell_type == 's':
+            return self.shared_strings[int(raw)]
+        if cell_type in ('str', 'e', 'd'):
+            return raw
+        if cell_type == 'b':
+            return raw == '1'
+
+        number = float(raw)
+        if cell.get('s') and int(cell.get('s')) in self.date_styles:
+            try:
+                return excel_datetime(number, self.date1904)
+            except OverflowError:
+                return number
+        if number.is_integer() and abs(number) < 2 ** 53:
+            return int(number)
+        return number
+
+    def used_range(self, selector=0):
+        """
+        Find the rectangle holding the cells of a sheet. The <dimension>
+        recorded at the top of the sheet part is used when it spans more
+        than one cell, so only the start of the sheet is read; otherwise
+        the cells with a value are scanned.
+
+        Args:
+            selector (str or int): Sheet name or 0-based position
+
+        Returns:
+            CellRange: Used range, or None for an empty sheet
+        """
+        bounds = None
+        for kind, value in self.iter_sheet_elements(self.sheet(selector)):
+            if kind == 'dimension':
+                start, _, end = (value or '').partition(':')
+                if end:
+                    try:
+                        (min_col, min_row), (max_col, max_row) = split_cell_ref(start), split_cell_ref(end)
+                        return CellRange(min_col, min_row, max_col, max_row)
+                    except ValueError:
+                        pass
+                continue
+
+            for cell in value:
+                if _local(cell.tag) != 'c' or not cell.get('r'):
+                    continue
+                if not any(_local(child.tag) in ('v', 'is') for child in cell):
+                    continue
+                column, row = split_cell_ref(cell.get('r'))
+                if bounds is None:
+                    bounds = [column, row, column, row]
+                else:
+                    bounds = [min(bounds[0], column), min(bounds[1], row), max(bounds[2], column), max(bounds[3], row)]
+
+        return CellRange(*bounds) if bounds else None
+
+    def iter_rows(self, selector=0, cell_range=None):
+        """
+        Yield the rows of a sheet that hold at least one value
+
+        Args:
+            selector (str or int): Sheet name or 0-based position
+            cell_range (CellRange): Only cells inside this range
+
+        Yields:
+            tuple: (row number, list of values starting at the first column
+                of the range), trailing empty cells left out
+        """
+        cell_range = cell_range or CellRange()
+        min_col = cell_range.min_col or 1
+        expected_row = 0
+
+        for kind, element in self.iter_sheet_elements(self.sheet(selector)):
+            if kind != 'row':
+                continue
+            expected_row = int(element.get('r')) if element.get('r') else expected_row + 1
+            row_number = expected_row
+            if cell_range.min_row and row_number < cell_range.min_row:
+                continue
+            if cell_range.max_row and row_number > cell_range.max_row:
+                break
+
+            values = []
+            column = 0
+            for cell in element:
+                if _local(cell.tag) != 'c':
+                    continue
+                column = split_cell_ref(cell.get('r'))[0] if cell.get('r') else column + 1
+                if column < min_col or (cell_range.max_col and column > cell_range.max_col):
+                    continue
+                value = self.cell_value(cell)
+                if value is None:
+                    continue
+                position = column - min_col
+                values.extend([None] * (position - len(values) + 1))
+                values[position] = value
+
+            if values:
+                yield row_number, values
+
+    def iter_text_cells(self, selector=0):
+        """
+        Yield the cells of a sheet holding text: shared strings, inline
+        strings and text results of formulas
+
+        Args:
+            selector (str or int): Sheet name or 0-based position
+
+        Yields:
+            tuple: (cell reference such as 'B12', text)
+        """
+        row_number = 0
+        for kind, element in self.iter_sheet_elements(self.sheet(selector)):
+            if kind != 'row':
+                continue
+            row_number = int(element.get('r')) if element.get('r') else row_number + 1
+            column = 0
+            for cell in element:
+                if _local(cell.tag) != 'c':
+                    continue
+                column = split_cell_ref(cell.get('r'))[0] if cell.get('r') else column + 1
+                if cell.get('t') not in ('s', 'inlineStr', 'str'):
+                    continue
+                text = self.cell_value(cell)
+                if text:
+                    yield f"{column_letters(column)}{row_number}", text
+
+def read_workbook_rows(path, sheets=None, cell_range=None):
+    """
+    Read the selected sheets of a workbook; a plain function so process
+    pools can run it
+
+    Args:
+        path (str): Workbook to read
+        sheets (list): Sheet names or 0-based positions, None for all sheets;
+            sheets a workbook doesn't have are left out
+        cell_range (CellRange): Only cells inside this range
+
+    Returns:
+        list: (sheet name, rows) pairs, rows as returned by iter_rows
+    """
+    result = []
+    with XlsxWorkbook(path) as workbook:
+        selected = []
+        for selector in (sheets if sheets is not None else range(len(workbook.sheets))):
+            try:
+                selected.append(workbook.sheet(selector))
+            except KeyError:
+                continue
+        for sheet in selected:
+            result.append((sheet['name'], list(workbook.iter_rows(sheet['name'], cell_range))))
+    return result
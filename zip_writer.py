@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import time
+import zlib
+import struct
+import logging
+from datetime import datetime
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Input is compressed in independent blocks of this size, which is what
+# lets several cores deflate the same entry at once
+BLOCK_SIZE = 1024 * 1024
+
+# Bytes of the first block compressed to decide whether an entry is worth deflating
+AUTO_SAMPLE_SIZE = 64 * 1024
+
+# In auto mode an entry is stored when deflate would keep more than this fraction
+AUTO_STORE_RATIO = 0.95
+
+COMPRESSION_MODES = ('auto', 'stored', 'deflate')
+
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+
+_ZIP64_LIMIT = 0xFFFFFFFF
+_ZIP_MAX_ENTRIES = 0xFFFF
+_FLAG_DATA_DESCRIPTOR = 0x08
+_FLAG_UTF8 = 0x800
+_VERSION_ZIP64 = 45
+_EMPTY_FINAL_BLOCK = zlib.compressobj(0, zlib.DEFLATED, -15).flush(zlib.Z_FINISH)
+
+class CompressionPolicy:
+    """
+    How entries of an archive are compressed
+
+    Modes:
+        stored: no compression
+        deflate: deflate every entry at the given level
+        auto: sample each entry and store it when deflate doesn't pay off,
+            which is the case for .xlsx files as they are zip containers already
+    """
+
+    def __init__(self, mode='auto', level=6, workers=None):
+        if mode not in COMPRESSION_MODES:
+            raise ValueError(f"Compression mode must be one of {', '.join(COMPRESSION_MODES)}")
+        if not 0 <= level <= 9:
+            raise ValueError("Compression level must be between 0 and 9")
+
+        self.mode = mode
+        self.level = level
+        self.workers = max(1, workers or os.cpu_count() or 1)
+
+    @property
+    def cache_key(self):
+        """Identifies the archive bytes this policy produces (independent of workers)"""
+        return f"{self.mode}:{self.level}"
+
+    def __repr__(self):
+        return f"CompressionPolicy(mode={self.mode!r}, level={self.level}, workers={self.workers})"
+
+class ZipEntry:
+    """Central directory record of an entry that has been written"""
+
+    __slots__ = ('name', 'method', 'dos_time', 'dos_date', 'crc', 'compress_size', 'file_size',
+                 'offset', 'descriptor')
+
+    def __init__(self, name, method, mtime, offset, descriptor=True):
+        self.name = name
+        self.method = method
+        self.dos_time, self.dos_date = _dos_datetime(mtime)
+        self.crc = 0
+        self.compress_size = 0
+        self.file_size = 0
+        self.offset = offset
+        self.descriptor = descriptor
+
+def _dos_datetime(mtime):
+    moment = datetime.fromtimestamp(mtime)
+    if moment.year < 1980:
+        moment = datetime(1980, 1, 1)
+    dos_time = (moment.hour << 11) | (moment.minute << 5) | (moment.second // 2)
+    dos_date = ((moment.year - 1980) << 9) | (moment.month << 5) | moment.day
+    return dos_time, dos_date
+
+def file_crc32(path, block_size=BLOCK_SIZE):
+    """
+    Read a file to compute the CRC and size a stored entry announces up front
+
+    Returns:
+        tuple: (crc32, size)
+    """
+    crc = 0
+    size = 0
+    with open(path, 'rb') as source:
+        for block in iter(lambda: source.read(block_size), b''):
+            crc = zlib.crc32(block, crc)
+            size += len(block)
+    return crc, size
+
+def _deflate_block(block, level):
+    """Compress one block into a non-final raw deflate block sequence"""
+    started = time.perf_counter()
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    data = compressor.compress(block) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    return data, time.perf_counter() - started
+
+class ZipStreamWriter:
+    """
+    Zip archive writer that produces the archive as a sequence of bytes,
+    so it can be sent over HTTP or written to a file while being built.
+
+    Deflated entries are written with a data descriptor and zip64 sizes,
+    so nothing needs to be known before they start and the output never
+    needs seeking. They are compressed in independent blocks on a thread
+    pool (zlib releases the GIL), so one large workbook keeps several
+    cores busy. Stored entries announce their CRC and sizes in the local
+    header whenever they can be known up front, because streaming readers
+    such as Java's ZipInputStream can't find the end of a stored entry
+    otherwise.
+    """
+
+    def __init__(self, policy=None, block_size=BLOCK_SIZE):
+        self.policy = policy or CompressionPolicy()
+        self.block_size = block_size
+        self.entries = []
+        self.offset = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.entries_stored = 0
+        self.entries_deflated = 0
+        self.compress_seconds = 0.0
+        self._pool = None
+
+    @property
+    def bytes_saved(self):
+        return self.bytes_in - self.bytes_out
+
+    def stats(self):
+        """Return compression statistics of everything written so far"""
+        return {
+            'compression': self.policy.mode,
+            'compression_level': self.policy.level,
+            'entries_stored': self.entries_stored,
+            'entries_deflated': self.entries_deflated,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'bytes_saved': self.bytes_saved,
+            'compress_seconds': round(self.compress_seconds, 3)
+        }
+
+    def _emit(self, data):
+        self.offset += len(data)
+        return data
+
+    def _should_deflate(self, first_block):
+        if self.policy.mode == 'stored' or not first_block:
+            return False
+        if self.policy.mode == 'deflate':
+            return True
+
+        sample = first_block[:AUTO_SAMPLE_SIZE]
+        started = time.perf_counter()
+        compressed_size = len(zlib.compress(sample, 1))
+        self.compress_seconds += time.perf_counter() - started
+        return compressed_size < len(sample) * AUTO_STORE_RATIO
+
+    def _flags(self, entry):
+        flags = _FLAG_UTF8 if not entry.name.isascii() else 0
+        if entry.descriptor:
+            flags |= _FLAG_DATA_DESCRIPTOR
+        return flags
+
+    def _local_header(self, entry):
+        name = entry.name.encode('utf-8')
+        crc, compress_size, file_size = entry.crc, entry.compress_size, entry.file_size
+        if entry.descriptor:
+            # Real sizes follow in the data descriptor; the zip64 extra field
+            # announces that the descriptor uses 8-byte sizes
+            extra = struct.pack('<HHQQ', 0x0001, 16, 0, 0)
+            crc, compress_size, file_size = 0, _ZIP64_LIMIT, _ZIP64_LIMIT
+        elif file_size >= _ZIP64_LIMIT:
+            extra = struct.pack('<HHQQ', 0x0001, 16, file_size, compress_size)
+            compress_size, file_size = _ZIP64_LIMIT, _ZIP64_LIMIT
+        else:
+            extra = b''
+        return struct.pack(
+            '<4sHHHHHLLLHH',
+            b'PK\x03\x04', _VERSION_ZIP64, self._flags(entry), entry.method, entry.dos_time, entry.dos_date,
+            crc, compress_size, file_size, len(name), len(extra)
+        ) + name + extra
+
+    def _data_descriptor(self, entry):
+        return struct.pack('<4sLQQ', b'PK\x07\x08', entry.crc, entry.compress_size, entry.file_size)
+
+    def _iter_deflated(self, first_block, source, entry):
+        """Yield compressed blocks in order while later blocks are still compressing"""
+        level = self.policy.level
+        window = self.policy.workers * 2
+        pending = deque()
+        block = first_block
+
+        if self.policy.workers > 1 and self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.policy.workers, thread_name_prefix="zip-deflate")
+
+        def collect(result):
+            data, seconds = result
+            self.compress_seconds += seconds
+            entry.compress_size += len(data)
+            return data
+
+        while block:
+            entry.crc = zlib.crc32(block, entry.crc)
+            entry.file_size += len(block)
+            if self._pool is None:
+                yield collect(_deflate_block(block, level))
+            else:
+                pending.append(self._pool.submit(_deflate_block, block, level))
+                if len(pending) >= window:
+                    yield collect(pending.popleft().result())
+            block = source.read(self.block_size)
+
+        for future in pending:
+            yield collect(future.result())
+
+        entry.compress_size += len(_EMPTY_FINAL_BLOCK)
+        yield _EMPTY_FINAL_BLOCK
+
+    def _iter_stored(self, first_block, source, entry):
+        block = first_block
+        while block:
+            entry.crc = zlib.crc32(block, entry.crc)
+            entry.file_size += len(block)
+            entry.compress_size += len(block)
+            yield block
+            block = source.read(self.block_size)
+
+    def add_file(self, name, source, mtime, measure=None):
+        """
+        Write an entry whose content is read from a binary file object
+
+        Args:
+            name (str): Name of the entry in the archive ('/' separated)
+            source (file): Binary file object positioned at the start
+            mtime (float): Modification time of the entry
+            measure (callable): Returns the (crc32, size) of the content
+                without consuming source, e.g. file_crc32 of its path. Used
+                to put the CRC of stored entries larger than one block in
+                the local header; without it they get a data descriptor.
+
+        Yields:
+            bytes: Next piece of the archive
+
+        Raises:
+            OSError: If the content differs from what measure returned
+        """
+        first_block = source.read(self.block_size)
+        deflate = self._should_deflate(first_block)
+
+        expected = None
+        if not deflate:
+            if len(first_block) < self.block_size:
+                expected = zlib.crc32(first_block), len(first_block)
+            elif measure is not None:
+                expected = measure()
+        entry = ZipEntry(name, ZIP_DEFLATED if deflate else ZIP_STORED, mtime, self.offset,
+                         descriptor=expected is None)
+        if expected is not None:
+            entry.crc, entry.file_size = expected
+            entry.compress_size = entry.file_size
+
+        yield self._emit(self._local_header(entry))
+        if deflate:
+            blocks = self._iter_deflated(first_block, source, entry)
+        else:
+            # Recount while streaming; the header must match what was sent
+            entry.crc = entry.file_size = entry.compress_size = 0
+            blocks = self._iter_stored(first_block, source, entry)
+        for data in blocks:
+            yield self._emit(data)
+        if entry.descriptor:
+            yield self._emit(self._data_descriptor(entry))
+        elif (entry.crc, entry.file_size) != expected:
+            raise OSError(f"{name} changed while it was added to the archive")
+
+        self.entries.append(entry)
+        self.bytes_in += entry.file_size
+        self.bytes_out += entry.compress_size
+        if deflate:
+            self.entries_deflated += 1
+        else:
+            self.entries_stored += 1
+
+    def add_bytes(self, name, data, mtime=None):
+        """
+        Write an entry from in-memory content
+
+        Yields:
+            bytes: Next piece of the archive
+        """
+        yield from self.add_file(name, io.BytesIO(data), time.time() if mtime is None else mtime)
+
+    def shutdown(self):
+        """Stop the compression threads; safe to call when abandoning an archive"""
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def _central_record(self, entry):
+        name = entry.name.encode('utf-8')
+        flags = self._flags(entry)
+
+        # Only fields that overflow go into the zip64 extra field, in this order
+        zip64_fields = []
+        file_size, compress_size, offset = entry.file_size, entry.compress_size, entry.offset
+        if file_size >= _ZIP64_LIMIT:
+            zip64_fields.append(file_size)
+            file_size = _ZIP64_LIMIT
+        if compress_size >= _ZIP64_LIMIT:
+            zip64_fields.append(compress_size)
+            compress_size = _ZIP64_LIMIT
+        if offset >= _ZIP64_LIMIT:
+            zip64_fields.append(offset)
+            offset = _ZIP64_LIMIT
+
+        extra = b''
+        if zip64_fields:
+            extra = struct.pack(f'<HH{len(zip64_fields)}Q', 0x0001, 8 * len(zip64_fields), *zip64_fields)
+
+        return struct.pack(
+            '<4sBBHHHHHLLLHHHHHLL',
+            b'PK\x01\x02', _VERSION_ZIP64, 3, _VERSION_ZIP64, flags, entry.method,
+            entry.dos_time, entry.dos_date, entry.crc, compress_size, file_size,
+            len(name), len(extra), 0, 0, 0, (0o100644 & 0xFFFF) << 16, offset
+        ) + name + extra
+
+    def close(self):
+        """
+        Finish the archive by writing the central directory
+
+        Yields:
+            bytes: Remaining pieces of the archive
+        """
+        self.shutdown()
+
+        start = self.offset
+        for entry in self.entries:
+            yield self._emit(self._central_record(entry))
+        size = self.offset - start
+        count = len(self.entries)
+
+        if count >= _ZIP_MAX_ENTRIES or start >= _ZIP64_LIMIT or size >= _ZIP64_LIMIT:
+            zip64_end = self.offset
+            yield self._emit(struct.pack(
+                '<4sQHHLLQQQQ', b'PK\x06\x06', 44, _VERSION_ZIP64, _VERSION_ZIP64,
+                0, 0, count, count, size, start
+            ))
+            yield self._emit(struct.pack('<4sLQL', b'PK\x06\x07', 0, zip64_end, 1))
+            count = min(count, _ZIP_MAX_ENTRIES)
+            size = min(size, _ZIP64_LIMIT)
+            start = min(start, _ZIP64_LIMIT)
+
+        yield self._emit(struct.pack('<4sHHHHLLH', b'PK\x05\x06', 0, 0, count, count, size, start, 0))